@@ -1,19 +1,108 @@
+import math
 
 import streamlit as st
 import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
 
 import ms.io as io
 
 st.title("API Interaction")
 api_url="http://127.0.0.1:8000"
 
-# Show a specific item by ID
+# Cached API results expire after this many seconds
+CACHE_TTL_S = 60
+PAGE_SIZES = [50, 100, 500, 1000]
+
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """
+    Returns a single HTTP session shared by all reruns and users, so that
+    connections to the API are pooled.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_data_holder() -> io.DataHolder:
+    return io.DataHolder(api_url, session=get_session())
+
+
+@st.cache_data(ttl=CACHE_TTL_S, show_spinner=False)
+def fetch_compounds_page(skip, limit, name, compound_type):
+    return get_data_holder().get_compounds_page_from_db(
+        skip=skip, limit=limit, name=name, type=compound_type
+    )
+
+
+@st.cache_data(ttl=CACHE_TTL_S, show_spinner=False)
+def search_compounds(query):
+    return get_data_holder().search_compounds_from_db(query, limit=20)
+
+
+@st.cache_data(ttl=CACHE_TTL_S, show_spinner=False)
+def fetch_measured_compounds(retention_time, compound_type, ion_mode):
+    return get_data_holder().get_measured_compounds_from_db(
+        retention_time=retention_time, type=compound_type, ion_mode=ion_mode
+    )
+
+
+@st.cache_data(ttl=CACHE_TTL_S, show_spinner=False)
+def fetch_measured_compounds_page(skip, limit):
+    return get_data_holder().get_measured_compounds_page_from_db(
+        skip=skip, limit=limit
+    )
+
+
+def paginated(key: str, fetch_page, page_size: int) -> list[dict]:
+    """
+    Fetches the page selected in the page selector `key` with
+    `fetch_page(skip, limit)` and renders the selector below the filters.
+    """
+    page = st.session_state.get(key, 1)
+    items, total = fetch_page((page - 1) * page_size, page_size)
+    n_pages = max(math.ceil(total / page_size), 1)
+    if page > n_pages:
+        # The filters changed and the selected page does not exist anymore
+        page = st.session_state[key] = n_pages
+        items, total = fetch_page((page - 1) * page_size, page_size)
+
+    st.number_input(
+        f"Page (of {n_pages}, {total} rows)", min_value=1, max_value=n_pages,
+        step=1, key=key
+    )
+    return items
+
+
+# Search compounds by name
+search_query = st.text_input("Search compounds", value="", key="search_query")
+if search_query.strip():
+    st.dataframe(pd.DataFrame(search_compounds(search_query.strip())))
+
+st.markdown("---")
+# Show compounds
 if st.button("Get Compounds"):
-    dataholder1 = io.DataHolder(api_url)
-    compounds = dataholder1.get_compounds_from_db()
-    compounds_df = pd.DataFrame(compounds)
-    st.dataframe(compounds_df)
-    
+    st.session_state["show_compounds"] = True
+
+if st.session_state.get("show_compounds"):
+    name_filter = st.text_input("Name contains", value="", key="name_filter")
+    type_filter = st.text_input("Type", value="", key="type_filter")
+    page_size = st.selectbox(
+        "Rows per page", PAGE_SIZES, index=1, key="compounds_page_size"
+    )
+    compounds = paginated(
+        "compounds_page",
+        lambda skip, limit: fetch_compounds_page(
+            skip, limit, name_filter or None, type_filter or None
+        ),
+        page_size
+    )
+    st.dataframe(pd.DataFrame(compounds))
+
 st.markdown("---")
 # Define parameters for measured compounds
 retention_time = st.text_input("Retention Time", value=None)
@@ -21,14 +110,27 @@ compound_type = st.text_input("Type", value=None)
 ion_mode = st.text_input("Ion Mode", value=None)
 
 if st.button("Get Measured Compounds"):
-    dataholder2 = io.DataHolder(api_url)
-    msc = dataholder2.get_measured_compounds_from_db(
-        retention_time=retention_time, type=compound_type, ion_mode=ion_mode
+    st.session_state["measured_compounds_query"] = (
+        retention_time, compound_type, ion_mode
     )
+
+if "measured_compounds_query" in st.session_state:
+    query = st.session_state["measured_compounds_query"]
+    if any(query):
+        msc = fetch_measured_compounds(*query)
+    else:
+        page_size = st.selectbox(
+            "Rows per page", PAGE_SIZES, index=1,
+            key="measured_compounds_page_size"
+        )
+        msc = paginated(
+            "measured_compounds_page", fetch_measured_compounds_page,
+            page_size
+        )
     msc_df = pd.DataFrame(msc)
     st.dataframe(msc_df)
-    
-    
+
+
 st.markdown("---")
 # Define parameters for adding a measured compound
 compound_id = st.number_input("Compound ID", value=0, step=1)
@@ -39,7 +141,7 @@ molecular_formula = st.text_input("Molecular Formula", value=None, key="molecula
 retention_time_comment = st.text_input("Retention Time Comment", value=None, key="retention_time_comment")
 
 if st.button("Add Measured Compound"):
-    dataholder3 = io.DataHolder(api_url)
+    dataholder3 = get_data_holder()
     result = dataholder3.add_measured_compound(
         compound_id=compound_id,
         compound_name=compound_name,
@@ -49,4 +151,7 @@ if st.button("Add Measured Compound"):
         retention_time_comment=retention_time_comment
     )
     dataholder3.insert_measured_compounds_in_db()
-    st.write(result)
\ No newline at end of file
+    # The new row invalidates the cached measured compounds
+    fetch_measured_compounds.clear()
+    fetch_measured_compounds_page.clear()
+    st.write(result)
@@ -0,0 +1,63 @@
+"""
+Runs the benchmark suite and writes the results as JSON.
+
+Usage:
+    python -m benchmarks --scale small --output results.json
+    python -m benchmarks --suite chem --suite io --scale full
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from . import bench_chem, bench_index, bench_io, bench_read_in
+from .runner import BenchmarkRunner
+
+SUITES = {
+    "chem": bench_chem,
+    "index": bench_index,
+    "io": bench_io,
+    "read_in": bench_read_in,
+}
+
+SCALES = {
+    "small": {
+        "chem": [1, 1_000],
+        "index": [10_000],
+        "io": [10_000],
+        "read_in": [1_000],
+    },
+    "full": {
+        "chem": [1, 1_000, 1_000_000],
+        "index": [10_000, 100_000, 1_000_000],
+        "io": [10_000, 100_000, 1_000_000],
+        "read_in": [1_000, 10_000, 100_000],
+    },
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--suite", action="append", choices=list(SUITES),
+        help="Suite to run, can be given several times. Defaults to all."
+    )
+    parser.add_argument("--scale", choices=list(SCALES), default="small")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--output", default="benchmark-results.json",
+        help="Path of the JSON result file."
+    )
+    args = parser.parse_args(argv)
+
+    runner = BenchmarkRunner(repeat=args.repeat)
+    for suite in args.suite or list(SUITES):
+        SUITES[suite].run(runner, SCALES[args.scale][suite])
+    runner.write(args.output)
+    print(f"Wrote {len(runner.results)} results to {args.output}",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
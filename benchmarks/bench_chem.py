@@ -0,0 +1,33 @@
+from database import chem
+
+from . import datasets
+
+
+def run(runner, sizes: list[int]):
+    """
+    Benchmarks the formula parsing and mass computation in `database.chem`
+    over lists of synthetic formulas of the given sizes.
+    """
+    adduct_names = [adduct["adduct_name"] for adduct in datasets.ADDUCTS]
+    for n in sizes:
+        formulas = datasets.formulas(n, seed=n)
+        repeat = 1 if n >= 100_000 else None
+
+        runner.run(
+            "chem", "parse_formula",
+            lambda: [chem.parse_formula(f) for f in formulas],
+            params={"n": n}, repeat=repeat
+        )
+        runner.run(
+            "chem", "parse_and_compute_mass",
+            lambda: [chem.parse_and_compute_mass(f) for f in formulas],
+            params={"n": n}, repeat=repeat
+        )
+        runner.run(
+            "chem", "update_molecular_formula",
+            lambda: [
+                chem.update_molecular_formula(f, adduct_names[i % 3])
+                for i, f in enumerate(formulas)
+            ],
+            params={"n": n}, repeat=repeat
+        )
@@ -0,0 +1,146 @@
+import numpy as np
+
+from database import conflicts, grid_index
+
+# Query windows: (name, keyword arguments of `grid_index.feature_windows`)
+WINDOWS = [
+    ("5ppm_0.2min", {"ppm": 5.0, "rt_tolerance": 0.2}),
+    ("10ppm_no_rt", {"ppm": 10.0, "rt_tolerance": None}),
+    ("0.01Da_0.5min", {"mz_tolerance": 0.01, "rt_tolerance": 0.5}),
+]
+
+
+def library_points(n: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the m/z and retention times of `n` synthetic measured ions, with
+    values rounded like the library so that duplicates occur.
+    """
+    rng = np.random.default_rng(seed)
+    mz = np.round(rng.uniform(100.0, 1000.0, n), 4)
+    rt = np.round(rng.uniform(0.5, 30.0, n), 2)
+    return mz, rt
+
+
+def feature_table(mz: np.ndarray, rt: np.ndarray, n: int, seed: int = 0):
+    """
+    Returns `n` features, half of them library ions with measurement noise
+    and half of them random.
+    """
+    rng = np.random.default_rng(seed + 1)
+    hits = rng.integers(0, len(mz), n // 2)
+    feature_mz = np.concatenate([
+        mz[hits] * (1 + rng.normal(0, 2e-6, len(hits))),
+        rng.uniform(100.0, 1000.0, n - len(hits)),
+    ])
+    feature_rt = np.concatenate([
+        rt[hits] + rng.normal(0, 0.05, len(hits)),
+        rng.uniform(0.5, 30.0, n - len(hits)),
+    ])
+    return feature_mz, feature_rt
+
+
+def check_consistency(index, mz, rt, windows):
+    """
+    Raises an AssertionError unless the index returns exactly the matches of
+    the brute-force reference.
+    """
+    expected = grid_index.brute_force_query(mz, rt, *windows)
+    actual = index.query(*windows)
+    assert np.array_equal(expected[0], actual[0]) \
+        and np.array_equal(expected[1], actual[1]), \
+        "GridIndex.query differs from brute_force_query"
+
+
+def check_random_windows(n_checks: int = 200, seed: int = 0):
+    """
+    Compares `GridIndex.query` with the brute-force reference on small
+    random indexes, querying every point at its exact m/z and retention
+    time, which includes the minimum and maximum retention time, as well as
+    random windows and windows without retention time bounds.
+    """
+    rng = np.random.default_rng(seed)
+    for _ in range(n_checks):
+        n = int(rng.integers(1, 50))
+        mz = np.round(rng.uniform(50.0, 60.0, n), int(rng.integers(1, 5)))
+        rt = np.round(rng.uniform(0.0, 30.0, n), int(rng.integers(0, 3)))
+        index = grid_index.GridIndex(
+            mz, rt, mz_bin=float(rng.choice([0.1, 1]))
+        )
+        feature_mz = np.concatenate([mz, rng.uniform(49.0, 61.0, n)])
+        feature_rt = np.concatenate([rt, rng.uniform(-1.0, 31.0, n)])
+        for kwargs in ({"ppm": 5.0, "rt_tolerance": 2.0},
+                       {"ppm": 5.0, "rt_tolerance": None},
+                       {"mz_tolerance": 0.5, "rt_tolerance": 0.0},
+                       {"mz_tolerance": 0.0, "rt_tolerance": 1.0}):
+            windows = grid_index.feature_windows(feature_mz, feature_rt,
+                                                **kwargs)
+            check_consistency(index, mz, rt, windows)
+
+
+def check_conflicts(mz, ion_mode, compound_id, rt, **kwargs):
+    """
+    Raises an AssertionError unless `conflicts.find_conflicts` returns exactly
+    the pairs of the brute-force reference.
+    """
+    expected = conflicts.brute_force_conflicts(
+        mz, ion_mode, compound_id, rt, **kwargs
+    )
+    found = conflicts.find_conflicts(
+        mz, ion_mode, compound_id, np.zeros(len(mz)), rt, **kwargs
+    )
+    actual = {
+        (min(a, b), max(a, b))
+        for a, b in zip(found["a"].tolist(), found["b"].tolist())
+    }
+    assert expected == actual, \
+        "find_conflicts differs from brute_force_conflicts"
+
+
+def run(runner, sizes: list[int]):
+    """
+    Benchmarks building and querying the (m/z, retention time) index over
+    `n` library ions with feature tables of n / 10 features, and the conflict
+    report over the same ions, and checks the results against the
+    brute-force references first.
+    """
+    check_random_windows()
+    for n in sizes:
+        mz, rt = library_points(n, seed=n)
+        feature_mz, feature_rt = feature_table(mz, rt, max(n // 10, 1),
+                                               seed=n)
+        index = grid_index.GridIndex(mz, rt)
+
+        runner.run(
+            "index", "GridIndex", lambda: grid_index.GridIndex(mz, rt),
+            params={"n": n}
+        )
+        for name, kwargs in WINDOWS:
+            windows = grid_index.feature_windows(feature_mz, feature_rt,
+                                                **kwargs)
+            if n <= 100_000:
+                check_consistency(index, mz, rt, windows)
+            runner.run(
+                "index", f"GridIndex.query[{name}]",
+                lambda: index.query(*windows),
+                params={"n": n, "features": len(feature_mz)}
+            )
+            if n <= 10_000:
+                runner.run(
+                    "index", f"brute_force_query[{name}]",
+                    lambda: grid_index.brute_force_query(mz, rt, *windows),
+                    params={"n": n, "features": len(feature_mz)}
+                )
+
+        ion_mode = np.where(np.arange(n) % 2, "positive", "negative").tolist()
+        compound_id = np.random.default_rng(n).integers(0, max(n // 5, 1), n)
+        adduct_id = np.arange(n) % 5
+        for name, kwargs in WINDOWS[:2]:
+            check_conflicts(mz[:2_000], ion_mode[:2_000],
+                            compound_id[:2_000], rt[:2_000], **kwargs)
+            runner.run(
+                "index", f"find_conflicts[{name}]",
+                lambda: conflicts.find_conflicts(
+                    mz, ion_mode, compound_id, adduct_id, rt, **kwargs
+                ),
+                params={"n": n}
+            )
@@ -0,0 +1,167 @@
+import os
+import random
+import tempfile
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from database import io, migrate, pydantic_models, schema
+
+from . import datasets
+
+BATCH_SIZE = 1000
+
+
+def seed_database(db, n: int):
+    """
+    Bulk loads `n` compounds, retention times and measured compounds plus the
+    default adducts, bypassing `database.io` so that large tables can be
+    built quickly.
+    """
+    compounds = datasets.compounds(n, seed=n)
+    db.execute(insert(schema.Compound.__table__), compounds)
+    db.execute(insert(schema.Adduct.__table__), datasets.ADDUCTS)
+    db.execute(
+        insert(schema.RetentionTime.__table__),
+        datasets.retention_times(n, seed=n)
+    )
+    rng = random.Random(n)
+    db.execute(insert(schema.MeasuredCompound.__table__), [
+        {"compound_id": rng.randint(1, n),
+         "retention_time_id": i + 1,
+         "adduct_id": rng.randint(1, len(datasets.ADDUCTS))}
+        for i in range(n)
+    ])
+    db.commit()
+    return compounds
+
+
+def run(runner, sizes: list[int]):
+    """
+    Benchmarks the create and get functions of `database.io` against SQLite
+    databases holding `n` rows per table.
+
+    Get functions read from the seeded tables; create functions insert a
+    batch of `BATCH_SIZE` new rows on top of them, each timed call starting
+    from a rolled back state.
+    """
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine = create_engine(
+                f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+            )
+            schema.Base.metadata.create_all(bind=engine)
+            migrate.create_name_index(engine)
+            Session = sessionmaker(autocommit=False, autoflush=False,
+                                   bind=engine)
+            with Session() as db:
+                compounds = seed_database(db, n)
+                _run_size(runner, db, n, compounds)
+            engine.dispose()
+
+
+def _run_size(runner, db, n: int, compounds: list[dict]):
+    params = {"rows": n}
+    repeat = 1 if n >= 100_000 else 3
+    probe = compounds[n // 2]
+    rt = db.get(schema.RetentionTime, n // 2)
+    mc = db.get(schema.MeasuredCompound, n // 2)
+
+    new_compounds = [
+        pydantic_models.CompoundCreate(**c)
+        for c in datasets.compounds(BATCH_SIZE, seed=-1, start_id=n + 1)
+    ]
+    new_adducts = [
+        pydantic_models.AdductCreate(
+            adduct_name=f"adduct-{i}", mass_adjustment=float(i),
+            ion_mode="positive"
+        )
+        for i in range(BATCH_SIZE)
+    ]
+    new_rts = [
+        pydantic_models.RetentionTimeCreate(**r)
+        for r in datasets.retention_times(BATCH_SIZE, seed=-1)
+    ]
+    new_mccs = [
+        pydantic_models.MeasuredCompoundClient(**mcc)
+        for mcc in datasets.measured_compounds(
+            compounds, BATCH_SIZE, seed=-1
+        )
+    ]
+    new_mcs = [
+        pydantic_models.MeasuredCompoundCreate(
+            compound_id=i % n + 1, retention_time_id=i % n + 1, adduct_id=1
+        )
+        for i in range(BATCH_SIZE)
+    ]
+
+    def rollback():
+        # Undo the rows committed by the previous create call.
+        db.rollback()
+        for table, key, limit in (
+            (schema.MeasuredCompound, "measured_compound_id", n),
+            (schema.RetentionTime, "retention_time_id", n),
+            (schema.Adduct, "adduct_id", len(datasets.ADDUCTS)),
+            (schema.CompoundComposition, "compound_id", n),
+            (schema.Compound, "compound_id", n),
+        ):
+            db.query(table).filter(getattr(table, key) > limit).delete()
+        db.commit()
+
+    batch = {"rows": n, "batch": BATCH_SIZE}
+    runner.run("io", "create_compounds",
+               lambda _: io.create_compounds(db, new_compounds),
+               params=batch, repeat=repeat, setup=rollback)
+    runner.run("io", "create_adducts",
+               lambda _: io.create_adducts(db, new_adducts),
+               params=batch, repeat=repeat, setup=rollback)
+    runner.run("io", "create_retention_times",
+               lambda _: io.create_retention_times(db, new_rts),
+               params=batch, repeat=repeat, setup=rollback)
+    runner.run("io", "prepare_measured_compounds_create",
+               lambda _: io.prepare_measured_compounds_create(db, new_mccs),
+               params=batch, repeat=repeat, setup=rollback)
+    runner.run("io", "create_measured_compounds",
+               lambda _: io.create_measured_compounds(db, new_mcs),
+               params=batch, repeat=repeat, setup=rollback)
+    rollback()
+
+    runner.run("io", "get_compounds",
+               lambda: io.get_compounds(db, limit=n),
+               params=params, repeat=repeat)
+    runner.run("io", "get_compound_by_compound_name",
+               lambda: io.get_compound_by_compound_name(
+                   db, probe["compound_name"]),
+               params=params)
+    runner.run("io", "search_compounds",
+               lambda: io.search_compounds(
+                   db, probe["compound_name"][2:8]),
+               params=params)
+    runner.run("io", "get_compound_by_id_name",
+               lambda: io.get_compound_by_id_name(
+                   db, probe["compound_id"], probe["compound_name"]),
+               params=params)
+    runner.run("io", "get_adducts",
+               lambda: io.get_adducts(db), params=params)
+    runner.run("io", "get_adduct_by_adduct_name",
+               lambda: io.get_adduct_by_adduct_name(db, "M-H"),
+               params=params)
+    runner.run("io", "get_retention_times",
+               lambda: io.get_retention_times(db, limit=n),
+               params=params, repeat=repeat)
+    runner.run("io", "get_retention_time_by_value_comment",
+               lambda: io.get_retention_time_by_value_comment(
+                   db, rt.retention_time, rt.comment),
+               params=params)
+    runner.run("io", "get_measured_compounds",
+               lambda: io.get_measured_compounds(db),
+               params=params, repeat=repeat)
+    runner.run("io", "get_measured_compound_by_ids",
+               lambda: io.get_measured_compound_by_ids(
+                   db, mc.compound_id, mc.adduct_id, mc.retention_time_id),
+               params=params)
+    runner.run("io", "get_measured_compounds_by_rt_type_ion_mode",
+               lambda: io.get_measured_compounds_by_rt_type_ion_mode(
+                   db, rt.retention_time, "positive", "pesticide"),
+               params=params)
+    db.expunge_all()
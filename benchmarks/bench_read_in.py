@@ -0,0 +1,41 @@
+import json
+import os
+import tempfile
+
+import pandas as pd
+
+from ms.io import DataHolder
+
+from . import datasets
+
+
+def run(runner, sizes: list[int]):
+    """
+    Benchmarks `DataHolder.read_in` on synthetic compound files in the xlsx
+    and json formats of the `data/` directory.
+    """
+    dtypes = {
+        "compound_id": "Int64",
+        "compound_name": "string",
+        "molecular_formula": "string",
+        "type": "string"
+    }
+    data_holder = DataHolder(api_url="http://127.0.0.1:8000")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n in sizes:
+            records = datasets.compounds(n, seed=n)
+            xlsx_path = os.path.join(tmp_dir, f"compounds-{n}.xlsx")
+            json_path = os.path.join(tmp_dir, f"compounds-{n}.json")
+            pd.DataFrame(records).to_excel(xlsx_path, index=False)
+            with open(json_path, "w") as f:
+                json.dump(records, f)
+
+            for fmt, path in (("xlsx", xlsx_path), ("json", json_path)):
+                runner.run(
+                    "read_in", "DataHolder.read_in",
+                    lambda: data_holder.read_in(
+                        path, unique_cols=["compound_id"], dtypes=dtypes
+                    ),
+                    params={"n": n, "format": fmt},
+                    repeat=1 if n >= 100_000 else None
+                )
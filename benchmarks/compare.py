@@ -0,0 +1,68 @@
+"""
+Compares two benchmark result files written by `python -m benchmarks`.
+
+Usage:
+    python -m benchmarks.compare baseline.json new.json [--threshold 1.1]
+"""
+import argparse
+import json
+import sys
+
+
+def _key(result: dict) -> tuple:
+    return (result["group"], result["name"],
+            json.dumps(result["params"], sort_keys=True))
+
+
+def compare(baseline: dict, new: dict) -> list[dict]:
+    """
+    Returns the ratio of the median timings of all cases present in both
+    result sets.
+    """
+    baseline_results = {_key(r): r for r in baseline["results"]}
+    rows = []
+    for result in new["results"]:
+        old = baseline_results.get(_key(result))
+        if old is None:
+            continue
+        rows.append({
+            "group": result["group"],
+            "name": result["name"],
+            "params": result["params"],
+            "baseline_s": old["median_s"],
+            "new_s": result["median_s"],
+            "ratio": result["median_s"] / old["median_s"],
+        })
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("baseline")
+    parser.add_argument("new")
+    parser.add_argument(
+        "--threshold", type=float, default=1.1,
+        help="Ratio above which a case counts as a regression."
+    )
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    regressions = 0
+    for row in compare(baseline, new):
+        flag = ""
+        if row["ratio"] > args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(
+            f"{row['group']:>8} {row['name']:<45} "
+            f"{json.dumps(row['params']):<30} {row['ratio']:6.2f}x{flag}"
+        )
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""
+Synthetic, reproducible datasets resembling the files in `data/`.
+
+Compounds have CHNOPS formulas with halogens and a realistic hydrogen count
+(non-negative ring and double bond equivalents). A part of them comes with
+isotope labelled variants in the notation of the compound files, e.g.
+"C9H3[2]H6O3Cl1" or "C2[13]C6H5O3Cl2", typed as internal standards.
+
+The module can also be run to write a library to disk:
+
+    python -m benchmarks.datasets --compounds 100000 --measured 20000 \
+        --out-dir /tmp/library
+"""
+import argparse
+import base64
+import json
+import os
+import random
+
+ADDUCTS = [
+    {"adduct_name": "M+H", "mass_adjustment": 1.007276, "ion_mode": "positive"},
+    {"adduct_name": "M+Na", "mass_adjustment": 22.989218,
+     "ion_mode": "positive"},
+    {"adduct_name": "M+NH4", "mass_adjustment": 18.033823,
+     "ion_mode": "positive"},
+    {"adduct_name": "M-H", "mass_adjustment": -1.007276,
+     "ion_mode": "negative"},
+    {"adduct_name": "M+FA-H", "mass_adjustment": 44.998201,
+     "ion_mode": "negative"},
+]
+
+# Adduct frequencies of data/measured-compounds.xlsx
+ADDUCT_WEIGHTS = [379, 35, 38, 150, 4]
+
+# Type frequencies of data/compounds.xlsx
+COMPOUND_TYPES = [
+    "parent compound", None, "metabolite", "internal standard",
+    "transformation product"
+]
+COMPOUND_TYPE_WEIGHTS = [1807, 865, 385, 175, 97]
+
+# Probability of an element being present and its maximum count
+HETERO_ELEMENTS = [
+    ("N", 0.6, 6), ("O", 0.85, 10), ("P", 0.05, 2), ("S", 0.15, 3),
+    ("F", 0.08, 6), ("Cl", 0.2, 6), ("Br", 0.04, 4), ("I", 0.01, 2),
+]
+HALOGENS = ("F", "Cl", "Br", "I")
+
+LABEL_PROBABILITY = 0.08
+
+
+def random_composition(rng: random.Random) -> dict:
+    """
+    Returns a random elemental composition as a dict of element counts with
+    at least one carbon and a non-negative, integer ring and double bond
+    equivalent.
+    """
+    composition = {"C": rng.randint(2, 40)}
+    for element, probability, max_count in HETERO_ELEMENTS:
+        if rng.random() < probability:
+            composition[element] = rng.randint(1, max_count)
+
+    halogens = sum(composition.get(x, 0) for x in HALOGENS)
+    trivalent = composition.get("N", 0) + composition.get("P", 0)
+    max_h = 2 * composition["C"] + 2 + trivalent - halogens
+    rdbe = rng.randint(0, min(composition["C"], 12))
+    h = max_h - 2 * rdbe
+    while h < 0:
+        h += 2
+    composition["H"] = h
+    return composition
+
+
+def format_formula(composition: dict, labels: dict | None = None) -> str:
+    """
+    Formats a composition in the notation of the compound files, where
+    labelled isotopes follow the unlabelled atoms of the same element, e.g.
+    "C9H3[2]H6O3Cl1".
+
+    Args:
+        composition (dict): Total counts per element.
+        labels (dict, optional): Maps an element to a tuple of isotope mass
+        number and the number of labelled atoms.
+    """
+    labels = labels or {}
+    order = ["C", "H", "N", "O", "P", "S", "F", "Cl", "Br", "I"]
+    parts = []
+    for element in order:
+        count = composition.get(element, 0)
+        if count == 0:
+            continue
+        isotope, labelled = labels.get(element, (None, 0))
+        if count - labelled > 0:
+            parts.append(f"{element}{count - labelled}")
+        if labelled:
+            parts.append(f"[{isotope}]{element}{labelled}")
+    return "".join(parts)
+
+
+def random_formula(rng: random.Random) -> str:
+    return format_formula(random_composition(rng))
+
+
+def _label(rng: random.Random, composition: dict) -> tuple[dict, str]:
+    choices = []
+    for n in (3, 4, 6, 9):
+        if composition["H"] >= n:
+            choices.append(("H", 2, n, f"-d{n}"))
+    if composition["C"] >= 6:
+        choices.append(("C", 13, 6, " 13C6"))
+    if composition.get("N", 0) >= 1:
+        n = composition["N"]
+        choices.append(("N", 15, n, f" 15N{n}"))
+    if not choices:
+        return {}, ""
+    element, isotope, n, suffix = rng.choice(choices)
+    return {element: (isotope, n)}, suffix
+
+
+def formulas(n: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    return [random_formula(rng) for _ in range(n)]
+
+
+def compounds(n: int, seed: int = 0, start_id: int = 1) -> list[dict]:
+    """
+    Returns `n` synthetic compound records with unique ids and names.
+    A fraction of them are isotope labelled variants of the preceding
+    compound, named like the internal standards of the library.
+    """
+    rng = random.Random(seed)
+    records = []
+    parent = None
+    for i in range(n):
+        compound_id = start_id + i
+        if parent is not None and rng.random() < LABEL_PROBABILITY:
+            labels, suffix = _label(rng, parent["composition"])
+            records.append({
+                "compound_id": compound_id,
+                "compound_name": f"{parent['name']}{suffix}-{compound_id}",
+                "molecular_formula": format_formula(
+                    parent["composition"], labels
+                ),
+                "type": "internal standard",
+            })
+            continue
+
+        composition = random_composition(rng)
+        name = f"compound-{compound_id}"
+        parent = {"name": name, "composition": composition}
+        records.append({
+            "compound_id": compound_id,
+            "compound_name": name,
+            "molecular_formula": format_formula(composition),
+            "type": rng.choices(COMPOUND_TYPES, COMPOUND_TYPE_WEIGHTS)[0],
+        })
+    return records
+
+
+def retention_times(n: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    return [
+        {"retention_time": round(rng.uniform(0.5, 30.0), 2),
+         "comment": rng.choice([None, "difficult to measure"])}
+        for _ in range(n)
+    ]
+
+
+def measured_compounds(compounds: list[dict], n: int, seed: int = 0,
+                       adducts: list[dict] = ADDUCTS) -> list[dict]:
+    """
+    Returns `n` measured compound records in the client format referencing
+    the given compounds and adducts.
+    """
+    rng = random.Random(seed)
+    weights = ADDUCT_WEIGHTS if adducts is ADDUCTS else None
+    records = []
+    for _ in range(n):
+        compound = rng.choice(compounds)
+        records.append({
+            "compound_id": compound["compound_id"],
+            "compound_name": compound["compound_name"],
+            "retention_time": round(rng.uniform(0.5, 30.0), 2),
+            "retention_time_comment": None,
+            "adduct_name": rng.choices(adducts, weights)[0]["adduct_name"],
+            "molecular_formula": compound["molecular_formula"],
+        })
+    return records
+
+
+def library(n_compounds: int, n_measured: int, seed: int = 0) -> dict:
+    """
+    Returns a synthetic library with compounds, adducts and measured
+    compounds as lists of records in the formats posted by `ms.io`.
+    """
+    compound_records = compounds(n_compounds, seed=seed)
+    return {
+        "compounds": compound_records,
+        "adducts": ADDUCTS,
+        "measured_compounds": measured_compounds(
+            compound_records, n_measured, seed=seed
+        ),
+    }
+
+
+def write_library(lib: dict, out_dir: str, fmt: str = "json"):
+    """
+    Writes a library as compounds, adducts and measured compounds files that
+    can be read with `ms.io.DataHolder`.
+    """
+    import pandas as pd
+
+    os.makedirs(out_dir, exist_ok=True)
+    adducts = [
+        {"name": a["adduct_name"], "mass": a["mass_adjustment"],
+         "ion_mode": a["ion_mode"]}
+        for a in lib["adducts"]
+    ]
+    with open(os.path.join(out_dir, "adducts.json"), "w") as f:
+        json.dump(adducts, f, indent=1)
+
+    for name in ("compounds", "measured_compounds"):
+        file_name = name.replace("_", "-")
+        if fmt == "xlsx":
+            pd.DataFrame(lib[name]).to_excel(
+                os.path.join(out_dir, f"{file_name}.xlsx"), index=False
+            )
+        else:
+            with open(os.path.join(out_dir, f"{file_name}.json"), "w") as f:
+                json.dump(lib[name], f)
+
+
+def _binary_array(values, name: str, accession: str) -> str:
+    import numpy as np
+
+    data = base64.b64encode(np.asarray(values, dtype="<f8").tobytes())
+    return (
+        f'<binaryDataArray encodedLength="{len(data)}">'
+        '<cvParam cvRef="MS" accession="MS:1000523" name="64-bit float"/>'
+        '<cvParam cvRef="MS" accession="MS:1000576" name="no compression"/>'
+        f'<cvParam cvRef="MS" accession="{accession}" name="{name}"/>'
+        f'<binary>{data.decode()}</binary></binaryDataArray>'
+    )
+
+
+def write_mzml(
+    path: str,
+    ions: list[dict],
+    n_scans: int = 1000,
+    rt_range: tuple[float, float] = (0.5, 30.0),
+    noise_peaks: int = 200,
+    profile: bool = False,
+    polarity: str = "positive",
+    seed: int = 0
+    ):
+    """
+    Writes a synthetic MS1 run as uncompressed mzML, scan by scan, so that
+    large files can be generated. Every ion with "mz" and "retention_time"
+    elutes as a Gaussian peak of 0.1 min width around its retention time, on
+    top of random noise peaks. Profile scans sample every peak at 5 points.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    ion_mz = np.array([ion["mz"] for ion in ions], dtype=np.float64)
+    ion_rt = np.array([ion["retention_time"] for ion in ions],
+                      dtype=np.float64)
+    ion_height = rng.uniform(1e4, 1e6, len(ions))
+    scan_polarity = (
+        '<cvParam cvRef="MS" accession="MS:1000130" name="positive scan"/>'
+        if polarity == "positive" else
+        '<cvParam cvRef="MS" accession="MS:1000129" name="negative scan"/>'
+    )
+    spectrum_type = (
+        '<cvParam cvRef="MS" accession="MS:1000128" name="profile spectrum"/>'
+        if profile else
+        '<cvParam cvRef="MS" accession="MS:1000127" name="centroid spectrum"/>'
+    )
+    with open(path, "w") as f:
+        f.write(
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<mzML xmlns="http://psi.hupo.org/ms/mzml" version="1.1.0">'
+            '<cvList count="1"><cv id="MS" fullName="PSI-MS" '
+            'URI="https://purl.obolibrary.org/obo/ms.obo"/></cvList>'
+            f'<run id="synthetic"><spectrumList count="{n_scans}">\n'
+        )
+        for i, rt in enumerate(np.linspace(*rt_range, n_scans)):
+            height = ion_height * np.exp(-0.5 * ((ion_rt - rt) / 0.05) ** 2)
+            eluting = height > 100
+            mz = np.concatenate([
+                ion_mz[eluting] * (1 + rng.normal(0, 1e-6, eluting.sum())),
+                rng.uniform(50, 1200, noise_peaks),
+            ])
+            intensity = np.concatenate([
+                height[eluting], rng.uniform(10, 5e3, noise_peaks)
+            ])
+            if profile:
+                offsets = np.array([-2, -1, 0, 1, 2]) * 0.002
+                shape = np.exp(-0.5 * (offsets / 0.002) ** 2)
+                mz = (mz[:, None] + offsets[None, :]).ravel()
+                intensity = (intensity[:, None] * shape[None, :]).ravel()
+            order = np.argsort(mz)
+            mz, intensity = mz[order], intensity[order]
+            f.write(
+                f'<spectrum index="{i}" id="scan={i + 1}" '
+                f'defaultArrayLength="{len(mz)}">'
+                '<cvParam cvRef="MS" accession="MS:1000511" name="ms level" '
+                'value="1"/>'
+                f'{scan_polarity}{spectrum_type}'
+                '<scanList count="1"><scan><cvParam cvRef="MS" '
+                'accession="MS:1000016" name="scan start time" '
+                f'value="{rt:.5f}" unitCvRef="UO" unitAccession="UO:0000031" '
+                'unitName="minute"/></scan></scanList>'
+                '<binaryDataArrayList count="2">'
+                f'{_binary_array(mz, "m/z array", "MS:1000514")}'
+                f'{_binary_array(intensity, "intensity array", "MS:1000515")}'
+                '</binaryDataArrayList></spectrum>\n'
+            )
+        f.write('</spectrumList></run></mzML>\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Writes a synthetic compound library."
+    )
+    parser.add_argument("--compounds", type=int, default=10_000)
+    parser.add_argument("--measured", type=int, default=2_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", choices=["json", "xlsx"], default="json")
+    parser.add_argument("--out-dir", required=True)
+    args = parser.parse_args(argv)
+
+    lib = library(args.compounds, args.measured, seed=args.seed)
+    write_library(lib, args.out_dir, fmt=args.format)
+
+
+if __name__ == "__main__":
+    main()
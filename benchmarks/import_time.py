@@ -0,0 +1,78 @@
+"""
+Checks the cold import time of the API module against a fixed budget.
+
+Every run imports the module in a fresh interpreter with `python -X
+importtime`. The check fails if the median cumulative import time exceeds
+the budget or if one of the modules that must only be loaded lazily is
+imported.
+
+Usage:
+    python -m benchmarks.import_time [--module database.fastapi]
+        [--budget-ms 1000] [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Heavy modules that the API must not import at startup
+LAZY_MODULES = ["pandas", "pyteomics", "pyarrow", "openpyxl"]
+
+
+def import_times(module: str) -> dict[str, int]:
+    """
+    Imports `module` in a fresh interpreter and returns the cumulative import
+    time in microseconds of every imported module.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=ROOT, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--module", default="database.fastapi")
+    parser.add_argument("--budget-ms", type=float, default=1000.0)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    median_ms = statistics.median(t[args.module] for t in runs) / 1e3
+
+    slowest = sorted(runs[-1].items(), key=lambda x: -x[1])[:10]
+    for name, us in slowest:
+        print(f"{us / 1e3:10.1f} ms  {name}")
+
+    failures = []
+    if median_ms > args.budget_ms:
+        failures.append(
+            f"import of {args.module} took {median_ms:.0f} ms, budget is "
+            f"{args.budget_ms:.0f} ms"
+        )
+    imported = [
+        m for m in LAZY_MODULES if any(
+            name == m or name.startswith(m + ".") for name in runs[-1]
+        )
+    ]
+    if imported:
+        failures.append(f"modules must be imported lazily: {imported}")
+
+    print(f"median import time of {args.module}: {median_ms:.0f} ms")
+    if failures:
+        print("FAILED: " + "; ".join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+Load test of the FastAPI service with a mixed read/write traffic profile.
+
+The driver seeds a synthetic library, then runs concurrent clients that pick
+scenarios by weight and reports throughput and latency percentiles per
+scenario. It either targets a running server or boots the app with uvicorn
+on localhost against a temporary SQLite database.
+
+Usage:
+    python -m benchmarks.loadtest --in-process --clients 16 --duration 30
+    python -m benchmarks.loadtest --url http://127.0.0.1:8000 --no-seed
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from . import datasets
+
+SEED_BATCH_SIZE = 1000
+
+
+class LoadContext:
+    """
+    State shared by the scenarios: the synthetic library and counters for
+    generating new, unique records during the run.
+    """
+    def __init__(self, lib: dict):
+        self.lib = lib
+        self.compound_count = len(lib["compounds"])
+        self._next_id = max(
+            (c["compound_id"] for c in lib["compounds"]), default=0
+        ) + 1_000_000
+        self._lock = threading.Lock()
+
+    def reserve_compound_ids(self, n: int) -> int:
+        """
+        Reserves `n` consecutive unused compound ids and returns the first.
+        """
+        with self._lock:
+            start = self._next_id
+            self._next_id += n
+            return start
+
+
+def get_adducts(session, url, ctx, rng):
+    return session.get(f"{url}/adducts/")
+
+
+def get_compounds_page(session, url, ctx, rng):
+    skip = rng.randrange(0, max(ctx.compound_count, 1))
+    return session.get(f"{url}/compounds/", params={"skip": skip,
+                                                    "limit": 100})
+
+
+def get_measured_compounds_query(session, url, ctx, rng):
+    mc = rng.choice(ctx.lib["measured_compounds"])
+    adduct = next(a for a in ctx.lib["adducts"]
+                  if a["adduct_name"] == mc["adduct_name"])
+    return session.get(f"{url}/measured_compounds/", params={
+        "retention_time": mc["retention_time"],
+        "ion_mode": adduct["ion_mode"],
+    })
+
+
+def get_measured_compounds_all(session, url, ctx, rng):
+    return session.get(f"{url}/measured_compounds/")
+
+
+def post_measured_compound(session, url, ctx, rng):
+    record = datasets.measured_compounds(
+        ctx.lib["compounds"], 1, seed=rng.random()
+    )[0]
+    return session.post(f"{url}/measured_compounds/", json=[record])
+
+
+def post_compounds(session, url, ctx, rng):
+    records = datasets.compounds(
+        10, seed=rng.random(), start_id=ctx.reserve_compound_ids(10)
+    )
+    for record in records:
+        record["compound_name"] = f"load-{record['compound_id']}"
+    return session.post(f"{url}/compounds/", json=records)
+
+
+# Scenario name -> (function, weight)
+SCENARIOS = {
+    "GET /adducts/": (get_adducts, 30),
+    "GET /compounds/ (page)": (get_compounds_page, 20),
+    "GET /measured_compounds/ (query)": (get_measured_compounds_query, 30),
+    "GET /measured_compounds/ (all)": (get_measured_compounds_all, 2),
+    "POST /measured_compounds/ (1 row)": (post_measured_compound, 13),
+    "POST /compounds/ (10 rows)": (post_compounds, 5),
+}
+
+
+def seed(url: str, lib: dict):
+    """
+    Posts the library in batches and returns the timings of the seeding.
+    """
+    timings = {}
+    with requests.Session() as session:
+        for endpoint, records in (
+            ("/adducts/", lib["adducts"]),
+            ("/compounds/", lib["compounds"]),
+            ("/measured_compounds/", lib["measured_compounds"]),
+        ):
+            t0 = time.perf_counter()
+            for i in range(0, len(records), SEED_BATCH_SIZE):
+                response = session.post(
+                    url + endpoint, json=records[i:i + SEED_BATCH_SIZE]
+                )
+                response.raise_for_status()
+            elapsed = time.perf_counter() - t0
+            timings[endpoint] = {
+                "rows": len(records),
+                "seconds": elapsed,
+                "rows_per_s": len(records) / elapsed if elapsed else None,
+            }
+            print(f"seeded {len(records)} rows to {endpoint} in "
+                  f"{elapsed:.1f} s", file=sys.stderr)
+    return timings
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """
+    Returns the q-th percentile (0-100) of sorted values by nearest rank.
+    """
+    if not sorted_values:
+        return float("nan")
+    rank = max(int(round(q / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def run_load(url: str, ctx: LoadContext, clients: int, duration_s: float,
+             seed: int = 0, scenarios: list[str] | None = None) -> dict:
+    """
+    Runs `clients` concurrent clients for `duration_s` seconds and returns
+    throughput and latency statistics per scenario and overall. `scenarios`
+    restricts the traffic to some of the scenarios, keeping their weights.
+    """
+    names = list(scenarios or SCENARIOS)
+    weights = [SCENARIOS[name][1] for name in names]
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration_s
+
+    def client(client_id: int):
+        rng = random.Random(seed * 1000 + client_id)
+        local_latencies = defaultdict(list)
+        local_errors = defaultdict(int)
+        with requests.Session() as session:
+            while time.perf_counter() < deadline:
+                name = rng.choices(names, weights)[0]
+                t0 = time.perf_counter()
+                try:
+                    response = SCENARIOS[name][0](session, url, ctx, rng)
+                    ok = response.status_code < 500
+                except requests.RequestException:
+                    ok = False
+                local_latencies[name].append(time.perf_counter() - t0)
+                if not ok:
+                    local_errors[name] += 1
+        with lock:
+            for name, values in local_latencies.items():
+                latencies[name].extend(values)
+            for name, count in local_errors.items():
+                errors[name] += count
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(client, range(clients)))
+    elapsed = time.perf_counter() - t0
+
+    def stats(values: list[float], n_errors: int) -> dict:
+        values = sorted(values)
+        return {
+            "requests": len(values),
+            "errors": n_errors,
+            "throughput_rps": len(values) / elapsed,
+            "p50_ms": percentile(values, 50) * 1e3,
+            "p95_ms": percentile(values, 95) * 1e3,
+            "p99_ms": percentile(values, 99) * 1e3,
+        }
+
+    report = {
+        name: stats(latencies[name], errors[name]) for name in names
+    }
+    report["total"] = stats(
+        [v for values in latencies.values() for v in values],
+        sum(errors.values())
+    )
+    return {"clients": clients, "duration_s": elapsed, "scenarios": report}
+
+
+def print_report(report: dict):
+    print(f"{'scenario':<36} {'requests':>9} {'errors':>7} {'req/s':>9} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, s in report["scenarios"].items():
+        print(f"{name:<36} {s['requests']:>9} {s['errors']:>7} "
+              f"{s['throughput_rps']:>9.1f} {s['p50_ms']:>9.1f} "
+              f"{s['p95_ms']:>9.1f} {s['p99_ms']:>9.1f}")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(db_path: str):
+    """
+    Starts the app with uvicorn in a background thread on a free localhost
+    port against a fresh SQLite database and returns the server and its URL.
+    """
+    import uvicorn
+
+    os.environ["MS_DATABASE_URL"] = f"sqlite:///{db_path}"
+    from database.fastapi import app
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(
+        app, host="127.0.0.1", port=port, log_level="warning"
+    ))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Base URL of a running server.")
+    target.add_argument(
+        "--in-process", action="store_true",
+        help="Boot the app on localhost against a temporary database."
+    )
+    parser.add_argument("--compounds", type=int, default=5_000)
+    parser.add_argument("--measured", type=int, default=1_000)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-seed", action="store_true",
+        help="Do not post the synthetic library before the run."
+    )
+    parser.add_argument(
+        "--scenario", action="append", choices=list(SCENARIOS),
+        help="Scenario to run, can be given several times. Defaults to all."
+    )
+    parser.add_argument("--output", help="Path of a JSON report.")
+    args = parser.parse_args(argv)
+
+    lib = datasets.library(args.compounds, args.measured, seed=args.seed)
+    ctx = LoadContext(lib)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        server = None
+        if args.in_process:
+            server, thread, url = start_server(
+                os.path.join(tmp_dir, "loadtest.db")
+            )
+        else:
+            url = args.url.rstrip("/")
+
+        try:
+            seeding = None if args.no_seed else seed(url, lib)
+            report = run_load(url, ctx, args.clients, args.duration,
+                              seed=args.seed, scenarios=args.scenario)
+        finally:
+            if server is not None:
+                server.should_exit = True
+                thread.join()
+
+    report["seeding"] = seeding
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
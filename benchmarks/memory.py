@@ -0,0 +1,181 @@
+"""
+Measures the peak memory of the full-table read endpoints.
+
+Every endpoint is called in process through the ASGI interface against
+SQLite databases of growing size, and the tracemalloc peak of the call is
+reported. The response body is counted and discarded as it is sent, so the
+peak is the memory the server holds, not the size of the response.
+
+A streamed read keeps its database cursor open while the response is sent,
+so every size also times a write made after the first chunk of a streamed
+read and before the rest is sent; it must not wait for the read to finish.
+
+Usage:
+    python -m benchmarks.memory [--sizes 10000 100000] [--output mem.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(ROOT)
+
+ENDPOINTS = [
+    "/compounds/?limit={n}",
+    "/measured_compounds/",
+    "/retention_times/?limit={n}",
+]
+
+
+async def _call(app, path: str, on_first_chunk=None) -> tuple[int, int]:
+    """
+    Sends a GET request to the app and returns the status code and the
+    number of body bytes. `on_first_chunk` is called after the first chunk
+    of a streamed body has been received, before the rest is sent.
+    """
+    url_path, _, query = path.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": url_path,
+        "raw_path": url_path.encode(), "query_string": query.encode(),
+        "headers": [(b"host", b"localhost")], "client": ("127.0.0.1", 1),
+        "server": ("localhost", 80), "root_path": "",
+    }
+    status, size = 0, 0
+    requested, done = False, asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Streaming responses listen for the client to disconnect
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status, size, on_first_chunk
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                done.set()
+            elif on_first_chunk is not None:
+                on_first_chunk()
+                on_first_chunk = None
+
+    await app(scope, receive, send)
+    return status, size
+
+
+def measure(app, path: str) -> dict:
+    """
+    Returns the tracemalloc peak in bytes and the response size of a GET.
+    """
+    asyncio.run(_call(app, path))  # warm-up
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    status, size = asyncio.run(_call(app, path))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if status != 200:
+        raise RuntimeError(f"GET {path} answered {status}")
+    return {"peak_bytes": peak, "response_bytes": size}
+
+
+def measure_write_during_stream(app, path: str, session_factory) -> dict:
+    """
+    Returns the seconds a retention time insert takes while the response of
+    a streamed GET is being sent.
+    """
+    from database import io, pydantic_models
+
+    timing = {}
+
+    def write():
+        start = time.perf_counter()
+        with session_factory() as db:
+            io.create_retention_times(db, [
+                pydantic_models.RetentionTimeCreate(retention_time=1.0)
+            ])
+        timing["write_during_stream_s"] = time.perf_counter() - start
+
+    status, _ = asyncio.run(_call(app, path, on_first_chunk=write))
+    if status != 200 or not timing:
+        raise RuntimeError(f"GET {path} answered {status} or did not stream")
+    return timing
+
+
+def run(sizes: list[int]) -> list[dict]:
+    """
+    Seeds a database of every size and measures all endpoints against it.
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from database import database, schema
+    from database.database import enable_wal
+    from database.fastapi import app
+
+    from .bench_io import seed_database
+
+    results = []
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine = create_engine(
+                f"sqlite:///{os.path.join(tmp_dir, 'memory.db')}",
+                connect_args={"check_same_thread": False}
+            )
+            enable_wal(engine)
+            schema.Base.metadata.create_all(bind=engine)
+            Session = sessionmaker(autocommit=False, autoflush=False,
+                                   bind=engine)
+            with Session() as db:
+                seed_database(db, n)
+            database.SessionLocal.configure(bind=engine)
+            for template in ENDPOINTS:
+                path = template.format(n=n)
+                result = {"endpoint": path.split("?")[0], "rows": n,
+                          **measure(app, path)}
+                results.append(result)
+                print(
+                    f"{result['endpoint']:<22} {n:>9} rows  peak "
+                    f"{result['peak_bytes'] / 2**20:8.1f} MiB  response "
+                    f"{result['response_bytes'] / 2**20:8.1f} MiB",
+                    file=sys.stderr
+                )
+            path = ENDPOINTS[-1].format(n=n)
+            result = {"endpoint": path.split("?")[0], "rows": n,
+                      **measure_write_during_stream(app, path, Session)}
+            results.append(result)
+            print(
+                f"{result['endpoint']:<22} {n:>9} rows  write during stream "
+                f"{result['write_during_stream_s'] * 1e3:8.1f} ms",
+                file=sys.stderr
+            )
+            engine.dispose()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 50_000, 200_000]
+    )
+    parser.add_argument("--output", help="Path of a JSON result file.")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
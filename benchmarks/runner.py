@@ -0,0 +1,87 @@
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+
+class BenchmarkRunner:
+    """
+    Collects timings of benchmark cases and writes them as JSON.
+
+    Every case is run `repeat` times after one warm-up call. Each result
+    stores the raw timings together with summary statistics, so that result
+    files of different runs can be compared with `benchmarks.compare`.
+    """
+    def __init__(self, repeat: int = 5):
+        self.repeat = repeat
+        self.results = []
+
+    def run(self, group: str, name: str, func, params: dict | None = None,
+            repeat: int | None = None, setup=None):
+        """
+        Times `func` and records the result.
+
+        Args:
+            group (str): The benchmark group, e.g. "chem" or "io".
+            name (str): The name of the benchmarked function.
+            func (callable): Called without arguments, or with the return value
+            of `setup` if given.
+            params (dict, optional): Parameters of the case such as the
+            dataset size.
+            repeat (int, optional): Overrides the runner's repeat count.
+            setup (callable, optional): Called before every timed call;
+            its return value is passed to `func` and is not timed.
+        """
+        repeat = repeat or self.repeat
+        times = []
+        for i in range(repeat + 1):
+            arg = setup() if setup is not None else None
+            t0 = time.perf_counter()
+            func(arg) if setup is not None else func()
+            elapsed = time.perf_counter() - t0
+            if i > 0:
+                times.append(elapsed)
+
+        result = {
+            "group": group,
+            "name": name,
+            "params": params or {},
+            "times_s": times,
+            "min_s": min(times),
+            "median_s": statistics.median(times),
+            "mean_s": statistics.fmean(times),
+        }
+        self.results.append(result)
+        print(
+            f"{group:>8} {name:<45} {json.dumps(params or {}):<30} "
+            f"median {result['median_s'] * 1e3:10.3f} ms",
+            file=sys.stderr
+        )
+        return result
+
+    def to_dict(self) -> dict:
+        return {"metadata": metadata(), "results": self.results}
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+    }
@@ -0,0 +1,227 @@
+"""
+Admission control for the expensive endpoints.
+
+Requests are sorted into endpoint classes by method and path: "heavy"
+(screening, annotation, formula and spectral search, chemistry batches,
+batched lookups, snapshot downloads) and "write" (all other POST and PUT
+requests). With write coalescing, the small POSTs the coalescer takes are
+counted in a class "coalesced" of their own instead: they do not hold a
+database connection, so they must not take write slots, and the write
+limit stays low enough to leave connections to the reads. Every class runs at most `limit` requests at once and queues at
+most `queue_size` more; a request that finds the queue full, or waits
+longer than the queue timeout, is answered with 503 and a Retry-After
+estimated from the recent service times of its class. All other requests,
+e.g. `GET /adducts/`, are not limited, so a few large imports or
+annotations cannot take all threadpool workers and database connections
+from them.
+"""
+import asyncio
+import json
+import math
+import time
+from collections import deque
+
+from fastapi.responses import JSONResponse
+
+from . import config
+
+HEAVY_PATHS = (
+    "/screening/", "/formulas/", "/spectra/search/", "/chem/",
+    "/compounds/by_composition/", "/compounds/mass_defect/", "/snapshot/",
+    "/measured_compounds/lookup/",
+)
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+# Endpoints of `database.coalescer`; larger bodies are not parsed to count
+# their rows, they count as writes
+COALESCED_PATHS = ("/compounds/", "/adducts/", "/measured_compounds/")
+COALESCED_MAX_BODY_BYTES = 64 * 1024
+
+
+class EndpointClass:
+    """
+    A concurrency limit with a bounded queue, used from the event loop.
+
+    Attributes:
+        name (str): The name of the class.
+        limit (int): The number of requests running at once.
+        queue_size (int): The number of requests waiting at most.
+        queue_timeout (float): Seconds a request waits at most.
+        active (int): The number of running requests.
+        admitted (int): The number of admitted requests.
+        rejected (int): The number of requests rejected with a full queue.
+        timed_out (int): The number of requests rejected after waiting.
+        mean_duration (float): Moving average of the seconds a request
+        runs.
+    """
+    def __init__(
+        self,
+        name: str,
+        limit: int,
+        queue_size: int,
+        queue_timeout: float = config.ADMISSION_QUEUE_TIMEOUT_S
+        ):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.mean_duration = 0.0
+        self._waiters = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> bool:
+        """
+        Waits for a free slot. Returns False if the request is rejected.
+        """
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not waiter.done() or waiter.cancelled():
+                self.timed_out += 1
+                return False
+            # The slot was handed over as the wait timed out
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        self.admitted += 1
+        return True
+
+    def release(self, duration: float):
+        """
+        Frees the slot of a finished request, handing it to the next waiting
+        request.
+        """
+        self.mean_duration += 0.1 * (duration - self.mean_duration)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def retry_after(self) -> int:
+        """
+        Returns the seconds until the queue has likely drained.
+        """
+        drain = self.mean_duration * (self.waiting + 1) / self.limit
+        return max(1, math.ceil(drain))
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "mean_duration_s": self.mean_duration,
+        }
+
+
+class AdmissionController:
+    """
+    Assigns requests to endpoint classes.
+
+    Attributes:
+        classes (dict[str, EndpointClass]): The endpoint classes by name.
+    """
+    def __init__(self):
+        self.classes = {
+            "heavy": EndpointClass(
+                "heavy", config.ADMISSION_HEAVY_LIMIT,
+                config.ADMISSION_HEAVY_QUEUE
+            ),
+            "write": EndpointClass(
+                "write", config.ADMISSION_WRITE_LIMIT,
+                config.ADMISSION_WRITE_QUEUE
+            ),
+            "coalesced": EndpointClass(
+                "coalesced", config.ADMISSION_COALESCED_LIMIT,
+                config.ADMISSION_COALESCED_QUEUE
+            ),
+        }
+
+    def classify(
+        self,
+        method: str,
+        path: str,
+        coalesced: bool = False
+        ) -> EndpointClass | None:
+        """
+        Returns the endpoint class of a request, None if it is not limited.
+        `coalesced` tells whether the write coalescer takes the request.
+        """
+        if path.startswith("/admin/"):
+            return None
+        if path.startswith(HEAVY_PATHS):
+            return self.classes["heavy"]
+        if coalesced:
+            return self.classes["coalesced"]
+        if method in WRITE_METHODS:
+            return self.classes["write"]
+        return None
+
+
+async def is_coalesced(request) -> bool:
+    """
+    Whether the write coalescer takes a request: a POST of at most
+    `config.WRITE_COALESCE_MAX_REQUEST_ROWS` rows to one of its endpoints.
+    The body stays available to the endpoint.
+    """
+    if not config.WRITE_COALESCING or request.method != "POST" \
+            or request.url.path not in COALESCED_PATHS:
+        return False
+    length = request.headers.get("content-length", "")
+    if not length.isdigit() or int(length) > COALESCED_MAX_BODY_BYTES:
+        return False
+    try:
+        rows = json.loads(await request.body())
+    except ValueError:
+        return False
+    return isinstance(rows, list) \
+        and len(rows) <= config.WRITE_COALESCE_MAX_REQUEST_ROWS
+
+
+admission_controller = AdmissionController()
+
+
+async def admit_requests(request, call_next):
+    """
+    HTTP middleware applying the limits of the endpoint classes.
+    """
+    if not config.ADMISSION_ENABLED:
+        return await call_next(request)
+    endpoint_class = admission_controller.classify(
+        request.method, request.url.path, await is_coalesced(request)
+    )
+    if endpoint_class is None:
+        return await call_next(request)
+    if not await endpoint_class.acquire():
+        return JSONResponse(
+            {"detail": f"Too many {endpoint_class.name} requests, retry "
+                       "later."},
+            status_code=503,
+            headers={"Retry-After": str(endpoint_class.retry_after())}
+        )
+    start = time.perf_counter()
+    try:
+        return await call_next(request)
+    finally:
+        endpoint_class.release(time.perf_counter() - start)
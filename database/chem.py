@@ -1,5 +1,4 @@
 import re
-from pyteomics import mass
 
 def parse_formula(formula):
     """
@@ -40,6 +39,9 @@ def parse_and_compute_mass(formula):
     Returns:
         float: The monoisotopic mass of the given chemical formula.
     """
+    # pyteomics is slow to import, so it is only loaded once masses are needed
+    from pyteomics import mass
+
     parsed_formula = parse_formula(formula)
     monoisotopic_mass = mass.calculate_mass(formula=parsed_formula)
     
@@ -90,3 +92,128 @@ def update_molecular_formula(formula, adduct_name):
     
     return new_formula
 
+
+
+def parse_composition(formula):
+    """
+    Parses a chemical formula into its elemental composition.
+    Isotope labels are kept apart from the natural element, e.g. 
+    "C9H3[2]H6O3Cl1" gives {("C", 0): 9, ("H", 0): 3, ("H", 2): 6, 
+    ("O", 0): 3, ("Cl", 0): 1}.
+    Args:
+        formula (str): The chemical formula to be parsed.
+    Returns:
+        dict: Maps (element, isotope) tuples to atom counts, where isotope is
+        the mass number of a labelled isotope or 0 for the natural element.
+    """
+    pattern = re.compile(r'(?:\[(\d+)\])?([A-Z][a-z]*)(\d*)')
+
+    composition = {}
+    for match in pattern.finditer(formula):
+        isotope = int(match.group(1) or 0)
+        element = match.group(2)
+        count = int(match.group(3) or 1)
+        key = (element, isotope)
+        composition[key] = composition.get(key, 0) + count
+
+    return composition
+
+
+def isotope_pattern(formula, mass_adjustment=0.0, max_peaks=6,
+                    min_abundance=1e-4):
+    """
+    Computes the isotope pattern of a chemical formula at nominal mass 
+    resolution. Natural elements contribute their isotope distribution, 
+    labelled isotopes (e.g. [2]H) are fixed.
+    Args:
+        formula (str): The chemical formula.
+        mass_adjustment (float, optional): Added to every peak mass, e.g. the 
+        mass adjustment of an adduct. Defaults to 0.0.
+        max_peaks (int, optional): The number of nominal mass peaks, starting 
+        at the monoisotopic peak. Defaults to 6.
+        min_abundance (float, optional): Peaks below this abundance relative 
+        to the most abundant peak are dropped. Defaults to 1e-4.
+    Returns:
+        list[tuple[float, float]]: Pairs of peak mass and abundance relative
+        to the most abundant peak.
+    """
+    from pyteomics import mass
+
+    # Per nominal mass shift: (abundance, abundance-weighted mass)
+    pattern = [(1.0, 0.0)] + [(0.0, 0.0)] * (max_peaks - 1)
+
+    for (element, isotope), count in parse_composition(formula).items():
+        isotopes = mass.nist_mass[element]
+        if isotope:
+            atom = [(0, isotopes[isotope][0], 1.0)]
+        else:
+            mono_mass = isotopes[0][0]
+            atom = [
+                (round(m - mono_mass), m, abundance)
+                for number, (m, abundance) in isotopes.items()
+                if number and abundance > 0
+            ]
+        for _ in range(count):
+            new = [[0.0, 0.0] for _ in range(max_peaks)]
+            for shift, (abundance, mass_sum) in enumerate(pattern):
+                if abundance == 0.0:
+                    continue
+                for atom_shift, atom_mass, atom_abundance in atom:
+                    k = shift + atom_shift
+                    if 0 <= k < max_peaks:
+                        p = abundance * atom_abundance
+                        new[k][0] += p
+                        new[k][1] += mass_sum * atom_abundance \
+                            + p * atom_mass
+            pattern = [tuple(peak) for peak in new]
+
+    max_abundance = max(abundance for abundance, _ in pattern)
+    return [
+        (mass_sum / abundance + mass_adjustment, abundance / max_abundance)
+        for abundance, mass_sum in pattern
+        if abundance / max_abundance >= min_abundance
+    ]
+
+
+def composition_mass(composition):
+    """
+    Computes the monoisotopic mass of an elemental composition as returned by
+    `parse_composition`.
+    Args:
+        composition (dict): Maps (element, isotope) tuples to atom counts.
+    Returns:
+        float: The monoisotopic mass.
+    Raises:
+        ValueError: If the composition contains an unknown element or isotope.
+    """
+    from pyteomics import mass
+
+    total = 0.0
+    for (element, isotope), count in composition.items():
+        try:
+            total += mass.nist_mass[element][isotope][0] * count
+        except KeyError:
+            label = f"[{isotope}]{element}" if isotope else element
+            raise ValueError(f"Unknown element or isotope: {label}")
+    return total
+
+
+def parse_compositions(formulas):
+    """
+    Parses a batch of chemical formulas into compositions and monoisotopic
+    masses.
+    Args:
+        formulas (list[str]): The chemical formulas.
+    Returns:
+        list[tuple[dict, float | None]]: The composition and the mass of every
+        formula, the mass being None for formulas with unknown elements.
+    """
+    results = []
+    for formula in formulas:
+        composition = parse_composition(formula)
+        try:
+            monoisotopic_mass = composition_mass(composition)
+        except ValueError:
+            monoisotopic_mass = None
+        results.append((composition, monoisotopic_mass))
+    return results
@@ -0,0 +1,234 @@
+"""
+Group commit of small concurrent inserts.
+
+Single-row POSTs, e.g. from the "Add Measured Compound" button, each open a
+session, validate and commit on their own, so a burst of them becomes a
+burst of transactions and fsyncs on SQLite. With `MS_WRITE_COALESCING=1`,
+requests of at most `config.WRITE_COALESCE_MAX_REQUEST_ROWS` rows are handed
+to a `WriteCoalescer` thread instead. It collects the requests arriving
+within `config.WRITE_COALESCE_WINDOW_MS` of the first one (or until
+`config.WRITE_COALESCE_MAX_ROWS` rows are waiting), validates every request
+on its own and inserts the rows of all of them with one call of the bulk
+`database.io` functions. Every caller gets the result it would have got
+without coalescing; if the combined insert fails, the requests of the batch
+are retried one by one so one bad request does not fail the others.
+"""
+import threading
+import time
+from concurrent.futures import Future
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import config, io, pydantic_models, schema
+
+
+class _Request:
+    def __init__(self, kind: str, rows: list):
+        self.kind = kind
+        self.rows = rows
+        self.future = Future()
+
+
+def _insert_new_by_name(db, requests, model, name, create, response_model):
+    # Skips names already in the database or earlier in the batch, like the
+    # endpoints do per row
+    names = {
+        getattr(row, name) for request in requests for row in request.rows
+    }
+    column = getattr(model, name)
+    taken = set(
+        db.execute(select(column).where(column.in_(names))).scalars()
+    )
+    new_rows, owners = [], []
+    for i, request in enumerate(requests):
+        for row in request.rows:
+            if getattr(row, name) not in taken:
+                taken.add(getattr(row, name))
+                new_rows.append(row)
+                owners.append(i)
+    created = create(db, new_rows)
+    results = [[] for _ in requests]
+    for owner, row in zip(owners, created):
+        results[owner].append(
+            response_model.model_validate(row, from_attributes=True)
+        )
+    for request, result in zip(requests, results):
+        request.future.set_result(result)
+
+
+def _insert_compounds(db: Session, requests: list[_Request]):
+    _insert_new_by_name(
+        db, requests, schema.Compound, "compound_name", io.create_compounds,
+        pydantic_models.Compound
+    )
+
+
+def _insert_adducts(db: Session, requests: list[_Request]):
+    _insert_new_by_name(
+        db, requests, schema.Adduct, "adduct_name", io.create_adducts,
+        pydantic_models.Adduct
+    )
+
+
+def _insert_measured_compounds(db: Session, requests: list[_Request]):
+    # `io.create_measured_compounds` only skips rows already in the
+    # database, so rows repeated within the batch are skipped here
+    valid, results, seen = [], [], set()
+    for request in requests:
+        try:
+            prepared = io.prepare_measured_compounds_create(db, request.rows)
+        except ValueError as e:
+            request.future.set_exception(e)
+            continue
+        for row in prepared["valid"]:
+            key = (row.compound_id, row.adduct_id, row.retention_time_id)
+            if key not in seen:
+                seen.add(key)
+                valid.append(row)
+        results.append((request, prepared["invalid"]))
+    if valid:
+        io.create_measured_compounds(db, valid)
+    for request, invalid in results:
+        request.future.set_result(invalid)
+
+
+INSERTS = {
+    "compounds": _insert_compounds,
+    "adducts": _insert_adducts,
+    "measured_compounds": _insert_measured_compounds,
+}
+
+
+class WriteCoalescer:
+    """
+    Thread inserting the rows of concurrent small requests in batches.
+
+    Attributes:
+        window (float): Seconds a request waits at most for others to join
+        its batch.
+        max_rows (int): A batch is inserted as soon as it has this many rows.
+        max_request_rows (int): Larger requests are not coalesced.
+        batches (int): The number of inserted batches.
+        requests (int): The number of coalesced requests.
+    """
+    def __init__(
+        self,
+        window_ms: float = config.WRITE_COALESCE_WINDOW_MS,
+        max_rows: int = config.WRITE_COALESCE_MAX_ROWS,
+        max_request_rows: int = config.WRITE_COALESCE_MAX_REQUEST_ROWS
+        ):
+        self.window = window_ms / 1000
+        self.max_rows = max_rows
+        self.max_request_rows = max_request_rows
+        self.batches = 0
+        self.requests = 0
+        self._session_factory = None
+        self._thread = None
+        self._pending = []
+        self._pending_rows = 0
+        self._first_arrival = None
+        self._stopped = False
+        self._condition = threading.Condition()
+
+    def start(self, session_factory):
+        """
+        Starts the thread.
+        """
+        if self._thread is not None:
+            return
+        self._session_factory = session_factory
+        self._stopped = False
+        self._thread = threading.Thread(
+            target=self._loop, name="write-coalescer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """
+        Inserts the waiting requests and stops the thread.
+        """
+        if self._thread is None:
+            return
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+
+    def accepts(self, rows: list) -> bool:
+        """
+        Whether a request with these rows is coalesced.
+        """
+        return self._thread is not None and not self._stopped \
+            and len(rows) <= self.max_request_rows
+
+    def submit(self, kind: str, rows: list):
+        """
+        Inserts the rows with those of concurrent requests and waits for the
+        result.
+
+        Args:
+            kind (str): "compounds", "adducts" or "measured_compounds".
+            rows (list): The validated pydantic models of the request.
+
+        Returns:
+            list: The created compounds or adducts, or the invalid measured
+            compounds.
+
+        Raises:
+            ValueError: If all measured compounds are invalid.
+        """
+        request = _Request(kind, rows)
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("The write coalescer is stopped.")
+            if not self._pending:
+                self._first_arrival = time.monotonic()
+            self._pending.append(request)
+            self._pending_rows += len(rows)
+            self._condition.notify()
+        return request.future.result()
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                deadline = self._first_arrival + self.window
+                while not self._stopped \
+                        and self._pending_rows < self.max_rows:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending
+                self._pending, self._pending_rows = [], 0
+            self._insert(batch)
+
+    def _insert(self, batch: list[_Request]):
+        by_kind = {}
+        for request in batch:
+            by_kind.setdefault(request.kind, []).append(request)
+        self.batches += 1
+        self.requests += len(batch)
+        with self._session_factory() as db:
+            for kind, requests in by_kind.items():
+                try:
+                    INSERTS[kind](db, requests)
+                    continue
+                except Exception:
+                    db.rollback()
+                for request in requests:
+                    if request.future.done():
+                        continue
+                    try:
+                        INSERTS[kind](db, [request])
+                    except Exception as e:
+                        db.rollback()
+                        request.future.set_exception(e)
+
+
+write_coalescer = WriteCoalescer()
@@ -0,0 +1,110 @@
+import os
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return default if value is None else float(value)
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return default if value is None else int(value)
+
+
+# Profiling of slow requests
+PROFILING_ENABLED = _env_bool("MS_PROFILING_ENABLED", False)
+PROFILING_HEADER = "X-Profile"
+PROFILING_THRESHOLD_S = _env_float("MS_PROFILING_THRESHOLD_S", 1.0)
+PROFILING_INTERVAL_S = _env_float("MS_PROFILING_INTERVAL_S", 0.005)
+PROFILING_MAX_PROFILES = _env_int("MS_PROFILING_MAX_PROFILES", 20)
+
+# Process pool for CPU-bound chemistry computations
+CHEM_POOL_WORKERS = _env_int("MS_CHEM_POOL_WORKERS", os.cpu_count() or 1)
+CHEM_INLINE_THRESHOLD = _env_int("MS_CHEM_INLINE_THRESHOLD", 2000)
+CHEM_CHUNK_SIZE = _env_int("MS_CHEM_CHUNK_SIZE", 5000)
+
+# Formula generation takes milliseconds per query, so small batches already
+# go to the process pool
+FORMULA_INLINE_THRESHOLD = _env_int("MS_FORMULA_INLINE_THRESHOLD", 8)
+FORMULA_CHUNK_SIZE = _env_int("MS_FORMULA_CHUNK_SIZE", 16)
+FORMULA_MAX_QUERIES = _env_int("MS_FORMULA_MAX_QUERIES", 1000)
+# Heteroatom count combinations enumerated (and cached) per element bounds;
+# the default bounds have 161 700
+FORMULA_MAX_COMBINATIONS = _env_int("MS_FORMULA_MAX_COMBINATIONS", 1_000_000)
+
+# Bounds of the spectral library search, whose work grows with both
+SPECTRUM_SEARCH_MAX_TOP_K = _env_int("MS_SPECTRUM_SEARCH_MAX_TOP_K", 100)
+SPECTRUM_SEARCH_MAX_PRECURSOR_TOLERANCE = _env_float(
+    "MS_SPECTRUM_SEARCH_MAX_PRECURSOR_TOLERANCE", 10.0
+)
+
+# Delta segments of the in-memory ion index before they are merged
+ION_INDEX_MAX_SEGMENTS = _env_int("MS_ION_INDEX_MAX_SEGMENTS", 8)
+
+# Memory-mapped library snapshot shared by the worker processes, by default
+# stored next to the SQLite database file
+SNAPSHOT_ENABLED = _env_bool("MS_SNAPSHOT_ENABLED", True)
+SNAPSHOT_DIR = os.environ.get("MS_SNAPSHOT_DIR")
+SNAPSHOT_CHECK_INTERVAL_S = _env_float("MS_SNAPSHOT_CHECK_INTERVAL_S", 1.0)
+SNAPSHOT_REBUILD_DELAY_S = _env_float("MS_SNAPSHOT_REBUILD_DELAY_S", 0.5)
+
+# Rows fetched at once by the streamed full-table reads
+READ_BATCH_SIZE = _env_int("MS_READ_BATCH_SIZE", 1000)
+
+# Matches of each index lookup ranked by the compound name search
+NAME_SEARCH_CANDIDATES = _env_int("MS_NAME_SEARCH_CANDIDATES", 1000)
+
+# Bounds of feature matching: wider m/z windows are rejected and at most
+# MATCH_MAX_MATCHES matches are returned per request
+MATCH_MAX_PPM = _env_float("MS_MATCH_MAX_PPM", 100.0)
+MATCH_MAX_MZ_TOLERANCE = _env_float("MS_MATCH_MAX_MZ_TOLERANCE", 0.5)
+MATCH_MAX_RT_TOLERANCE = _env_float("MS_MATCH_MAX_RT_TOLERANCE", 60.0)
+MATCH_MAX_MATCHES = _env_int("MS_MATCH_MAX_MATCHES", 100_000)
+
+# Bounds of the ion conflict report: the number of pairs grows with the
+# square of the window, so wide windows are rejected and the search stops
+# after CONFLICT_MAX_PAIRS pairs (about 25 bytes each)
+CONFLICT_MAX_PPM = _env_float("MS_CONFLICT_MAX_PPM", 100.0)
+CONFLICT_MAX_PAIRS = _env_int("MS_CONFLICT_MAX_PAIRS", 5_000_000)
+
+# Background jobs for large imports
+JOB_CHUNK_SIZE = _env_int("MS_JOB_CHUNK_SIZE", 2000)
+JOB_POLL_INTERVAL_S = _env_float("MS_JOB_POLL_INTERVAL_S", 1.0)
+# Running jobs without progress for this long are taken over by another
+# worker, e.g. after the process working on them died
+JOB_STALE_AFTER_S = _env_float("MS_JOB_STALE_AFTER_S", 120.0)
+
+# Chunks of resumable uploads still being imported after this long are
+# imported again by a retry
+UPLOAD_STALE_AFTER_S = _env_float("MS_UPLOAD_STALE_AFTER_S", 120.0)
+# Chunks of one upload at most; its status lists every missing chunk
+UPLOAD_MAX_CHUNKS = _env_int("MS_UPLOAD_MAX_CHUNKS", 10_000)
+
+# Group commit of small concurrent inserts, see `database.coalescer`
+WRITE_COALESCING = _env_bool("MS_WRITE_COALESCING", False)
+WRITE_COALESCE_WINDOW_MS = _env_float("MS_WRITE_COALESCE_WINDOW_MS", 5.0)
+WRITE_COALESCE_MAX_ROWS = _env_int("MS_WRITE_COALESCE_MAX_ROWS", 1000)
+WRITE_COALESCE_MAX_REQUEST_ROWS = _env_int(
+    "MS_WRITE_COALESCE_MAX_REQUEST_ROWS", 50
+)
+
+# Admission control, see `database.admission`. Keep the sum of the heavy and
+# write limits below the database connection pool size (15) so unlimited
+# reads always get a connection. Coalesced writes wait for the coalescer
+# without holding a connection, so they have a limit of their own, and a
+# lower one would only make their batches smaller
+ADMISSION_ENABLED = _env_bool("MS_ADMISSION_ENABLED", True)
+ADMISSION_HEAVY_LIMIT = _env_int("MS_ADMISSION_HEAVY_LIMIT", 4)
+ADMISSION_HEAVY_QUEUE = _env_int("MS_ADMISSION_HEAVY_QUEUE", 16)
+ADMISSION_WRITE_LIMIT = _env_int("MS_ADMISSION_WRITE_LIMIT", 8)
+ADMISSION_WRITE_QUEUE = _env_int("MS_ADMISSION_WRITE_QUEUE", 64)
+ADMISSION_COALESCED_LIMIT = _env_int("MS_ADMISSION_COALESCED_LIMIT", 24)
+ADMISSION_COALESCED_QUEUE = _env_int("MS_ADMISSION_COALESCED_QUEUE", 64)
+ADMISSION_QUEUE_TIMEOUT_S = _env_float("MS_ADMISSION_QUEUE_TIMEOUT_S", 10.0)
@@ -0,0 +1,203 @@
+"""
+Detection of library ions that cannot be told apart by m/z.
+
+Two ions of the same ion mode conflict if their m/z differ by at most `ppm`
+of the lower one and, optionally, their retention times by at most
+`rt_tolerance`: a feature matching one of them matches the other as well.
+Instead of comparing all pairs, the ions of every ion mode are sorted by m/z
+once and the end of every ion's m/z window is found with a binary search, so
+only the pairs inside a window are ever built. The pairs are expanded and
+filtered with NumPy in chunks of at most `MAX_PAIRS_PER_CHUNK` candidates.
+"""
+import numpy as np
+
+from .grid_index import _expand_ranges
+
+# Conflicting ions of the same adduct whose m/z differ by at most this many Da
+# are isomers, compounds of the same composition; all others are isobars
+ISOMER_TOLERANCE_DA = 1e-6
+MAX_PAIRS_PER_CHUNK = 5_000_000
+
+
+def _empty_conflicts() -> dict:
+    return {
+        "a": np.empty(0, dtype=np.int64),
+        "b": np.empty(0, dtype=np.int64),
+        "ppm": np.empty(0, dtype=np.float64),
+        "isomer": np.empty(0, dtype=bool),
+        "truncated": False,
+    }
+
+
+def _sweep(
+    order: np.ndarray,
+    mz: np.ndarray,
+    ppm: float,
+    keep,
+    max_pairs: int | None = None
+    ) -> tuple[list[dict], bool]:
+    """
+    Finds the pairs of the rows `order`, sorted by m/z, within `ppm` of each
+    other for which `keep(a, b)` is true, stopping after `max_pairs` pairs.
+
+    Returns:
+        tuple[list[dict], bool]: The pairs in chunks and whether the search
+        stopped at `max_pairs`.
+    """
+    sorted_mz = mz[order]
+    starts = np.arange(1, len(order) + 1)
+    ends = np.searchsorted(sorted_mz, sorted_mz * (1 + ppm * 1e-6), "right")
+    ends = np.maximum(ends, starts)
+    total = np.cumsum(ends - starts)
+
+    parts, found, chunk_start = [], 0, 0
+    while chunk_start < len(order):
+        done = total[chunk_start - 1] if chunk_start else 0
+        chunk_end = max(
+            chunk_start + 1,
+            int(np.searchsorted(total, done + MAX_PAIRS_PER_CHUNK, "right"))
+        )
+        owner, positions = _expand_ranges(
+            starts[chunk_start:chunk_end], ends[chunk_start:chunk_end]
+        )
+        a, b = order[chunk_start + owner], order[positions]
+        kept = np.flatnonzero(keep(a, b))
+        if max_pairs is not None and found + len(kept) > max_pairs:
+            kept = kept[:max_pairs - found]
+            parts.append({"a": a[kept], "b": b[kept]})
+            return parts, True
+        parts.append({"a": a[kept], "b": b[kept]})
+        found += len(kept)
+        chunk_start = chunk_end
+    return parts, False
+
+
+def find_conflicts(
+    mz: np.ndarray,
+    ion_mode: list[str],
+    compound_id: np.ndarray,
+    adduct_id: np.ndarray,
+    retention_time: np.ndarray | None = None,
+    ppm: float = 5.0,
+    rt_tolerance: float | None = None,
+    max_pairs: int | None = None
+    ) -> dict:
+    """
+    Finds all pairs of conflicting ions.
+
+    Pairs of ions of the same compound are left out: they are ambiguous only
+    in the adduct or retention time, not in the compound.
+
+    Args:
+        mz (np.ndarray): The m/z of the ions.
+        ion_mode (list[str]): The ion mode of every ion.
+        compound_id (np.ndarray): The compound of every ion.
+        adduct_id (np.ndarray): The adduct of every ion.
+        retention_time (np.ndarray | None, optional): The retention time of
+        every ion. Defaults to None.
+        ppm (float, optional): The m/z window in ppm. Defaults to 5.0.
+        rt_tolerance (float | None, optional): The retention time window,
+        None to ignore the retention time. Defaults to None.
+        max_pairs (int | None, optional): Stops after this many pairs, which
+        bounds the memory of wide windows over large libraries. Defaults to
+        None, finding all pairs.
+
+    Returns:
+        dict: Arrays "a" and "b", the rows of the two ions of every pair with
+        the lower m/z in "a", "ppm", their m/z difference, and "isomer",
+        whether they are isomers rather than isobars, ordered by ion mode
+        and the m/z of "a", and "truncated", whether the search stopped at
+        `max_pairs`.
+
+    Raises:
+        ValueError: If the tolerances are negative or rt_tolerance is given
+        without retention times.
+    """
+    if ppm < 0 or (rt_tolerance is not None and rt_tolerance < 0):
+        raise ValueError("ppm and rt_tolerance must be >= 0.")
+    if rt_tolerance is not None and retention_time is None:
+        raise ValueError("rt_tolerance requires retention times.")
+    mz = np.asarray(mz, dtype=np.float64)
+    compound_id = np.asarray(compound_id)
+    adduct_id = np.asarray(adduct_id)
+    if rt_tolerance is not None:
+        retention_time = np.asarray(retention_time, dtype=np.float64)
+
+    def keep(a, b):
+        kept = compound_id[a] != compound_id[b]
+        if rt_tolerance is not None:
+            kept &= np.abs(retention_time[a] - retention_time[b]) \
+                <= rt_tolerance
+        return kept
+
+    modes = np.asarray(ion_mode, dtype=object)
+    parts, truncated, found = [], False, 0
+    for mode in sorted(set(ion_mode)):
+        rows = np.flatnonzero(modes == mode)
+        order = rows[np.argsort(mz[rows], kind="stable")]
+        mode_parts, truncated = _sweep(
+            order, mz, ppm, keep,
+            None if max_pairs is None else max_pairs - found
+        )
+        parts.extend(mode_parts)
+        found += sum(len(part["a"]) for part in mode_parts)
+        if truncated:
+            break
+    if not parts:
+        return _empty_conflicts()
+
+    a = np.concatenate([part["a"] for part in parts])
+    b = np.concatenate([part["b"] for part in parts])
+    difference = mz[b] - mz[a]
+    return {
+        "a": a,
+        "b": b,
+        "ppm": difference / mz[a] * 1e6,
+        "isomer": (adduct_id[a] == adduct_id[b])
+        & (difference <= ISOMER_TOLERANCE_DA),
+        "truncated": truncated,
+    }
+
+
+def brute_force_conflicts(
+    mz: np.ndarray,
+    ion_mode: list[str],
+    compound_id: np.ndarray,
+    retention_time: np.ndarray | None = None,
+    ppm: float = 5.0,
+    rt_tolerance: float | None = None
+    ) -> set[tuple[int, int]]:
+    """
+    Reference implementation of `find_conflicts` comparing all pairs, for
+    testing. Returns the pairs as (row, row) with the lower row first.
+    """
+    mz = np.asarray(mz, dtype=np.float64)
+    pairs = set()
+    for i in range(len(mz)):
+        for j in range(i + 1, len(mz)):
+            if ion_mode[i] != ion_mode[j] or compound_id[i] == compound_id[j]:
+                continue
+            low, high = sorted((mz[i], mz[j]))
+            if high > low * (1 + ppm * 1e-6):
+                continue
+            if rt_tolerance is not None and \
+                    abs(retention_time[i] - retention_time[j]) > rt_tolerance:
+                continue
+            pairs.add((i, j))
+    return pairs
+
+
+def conflict_summary(conflicts: dict, n_ions: int) -> dict:
+    """
+    Counts the pairs, isomer pairs and ions in at least one conflict; these
+    are lower bounds if the search was truncated.
+    """
+    return {
+        "n_ions": n_ions,
+        "truncated": conflicts["truncated"],
+        "n_pairs": len(conflicts["a"]),
+        "n_isomer_pairs": int(conflicts["isomer"].sum()),
+        "n_conflicting_ions": len(
+            np.union1d(conflicts["a"], conflicts["b"])
+        ),
+    }
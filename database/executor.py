@@ -0,0 +1,99 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from starlette.concurrency import run_in_threadpool
+
+from . import config
+
+
+def _apply(func, chunk):
+    return [func(item) for item in chunk]
+
+
+class ChemExecutor:
+    """
+    Runs CPU-bound chemistry functions over batches of inputs.
+
+    Batches smaller than the inline threshold run in the threadpool of the
+    API. Larger batches are split into chunks and distributed over a pool of
+    worker processes, so that they neither hold the GIL of the API process
+    nor block other requests.
+
+    Attributes:
+        max_workers (int): The number of worker processes.
+        inline_threshold (int): Batches with fewer items run inline.
+        chunk_size (int): The number of items sent to a worker at once.
+    """
+    def __init__(
+        self,
+        max_workers: int = config.CHEM_POOL_WORKERS,
+        inline_threshold: int = config.CHEM_INLINE_THRESHOLD,
+        chunk_size: int = config.CHEM_CHUNK_SIZE
+        ):
+        self.max_workers = max_workers
+        self.inline_threshold = inline_threshold
+        self.chunk_size = chunk_size
+        self._pool = None
+
+    def start(self):
+        """
+        Starts the worker processes. They are spawned rather than forked,
+        because forking the threaded API process is unsafe.
+        """
+        if self._pool is None and self.max_workers > 0:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stops the worker processes after finishing the submitted chunks and
+        cancels chunks that have not started yet.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+    async def map(
+        self,
+        func,
+        items: list,
+        inline_threshold: int | None = None,
+        chunk_size: int | None = None
+        ) -> list:
+        """
+        Applies `func` to every item and returns the results in order.
+
+        Args:
+            func (callable): A picklable module-level function (or a
+            functools.partial of one) taking a single item.
+            items (list): The inputs.
+            inline_threshold (int | None, optional): Overrides the inline
+            threshold for functions that are much slower per item.
+            chunk_size (int | None, optional): Overrides the chunk size.
+
+        Returns:
+            list: The results of `func` for every item.
+        """
+        if inline_threshold is None:
+            inline_threshold = self.inline_threshold
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+        if self._pool is None or len(items) < inline_threshold:
+            return await run_in_threadpool(_apply, func, items)
+
+        loop = asyncio.get_running_loop()
+        chunks = [
+            items[i:i + chunk_size]
+            for i in range(0, len(items), chunk_size)
+        ]
+        results = await asyncio.gather(*[
+            loop.run_in_executor(self._pool, _apply, func, chunk)
+            for chunk in chunks
+        ])
+        return [result for chunk in results for result in chunk]
+
+
+chem_executor = ChemExecutor()
@@ -1,12 +1,61 @@
-from fastapi import Depends, FastAPI, HTTPException
+import functools
+import re
+from contextlib import asynccontextmanager
+
+import numpy as np
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, \
+    Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import TypeAdapter
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from . import io, pydantic_models, schema
+from . import admission, chem, config, conflicts, formula_generator, io, \
+    ion_index, jobs, library, migrate, profiling, pydantic_models, \
+    screening, snapshot, spectra, uploads
+from .coalescer import write_coalescer
+from .executor import chem_executor
 from .database import SessionLocal, engine
 
-schema.Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    migrate.init_db(bind=engine)
+    chem_executor.start()
+    loader = None
+    if config.SNAPSHOT_ENABLED:
+        library_snapshot = snapshot.library_snapshot
+        library_snapshot.start(
+            SessionLocal,
+            directory=config.SNAPSHOT_DIR
+            or snapshot.default_directory(engine.url)
+        )
+        mapped = library_snapshot.current()
+        if mapped is not None:
+            loader = mapped.measured_ion_arrays
+            library_snapshot.subscribe(_rebase_ion_index)
+    ion_index.measured_ion_index.start(SessionLocal, loader=loader)
+    jobs.job_runner.start(SessionLocal)
+    if config.WRITE_COALESCING:
+        write_coalescer.start(SessionLocal)
+    yield
+    write_coalescer.stop()
+    jobs.job_runner.stop()
+    ion_index.measured_ion_index.stop()
+    snapshot.library_snapshot.stop()
+    chem_executor.shutdown()
+
+
+def _rebase_ion_index(mapped: snapshot.LibrarySnapshot):
+    # Picks up the measured compounds written by other worker processes
+    ion_index.measured_ion_index.rebase(mapped.measured_ion_arrays())
+
+
+app = FastAPI(lifespan=lifespan)
+app.router.route_class = profiling.ProfiledRoute
+app.middleware("http")(profiling.profile_requests)
+# Added last so rejected requests are not profiled
+app.middleware("http")(admission.admit_requests)
 
 
 # Dependency
@@ -18,11 +67,59 @@ def get_db():
         db.close()
 
 
+def ready_ion_index() -> ion_index.LiveMeasuredIonIndex:
+    """
+    Returns the measured ion index, or responds with 503 while it is built.
+    """
+    if not ion_index.measured_ion_index.ready.is_set():
+        raise HTTPException(
+            status_code=503,
+            detail="The measured ion index is being built.",
+            headers={"Retry-After": "1"}
+        )
+    return ion_index.measured_ion_index
+
+
+@functools.cache
+def _list_adapter(model: type) -> TypeAdapter:
+    return TypeAdapter(list[model])
+
+
+def stream_json(
+    batches,
+    model: type,
+    headers: dict | None = None
+    ) -> StreamingResponse:
+    """
+    Responds with a JSON list of the rows of `batches`, serialized with the
+    response model one batch at a time, so the server never holds the whole
+    list as ORM objects, pydantic models and JSON at once.
+    """
+    adapter = _list_adapter(model)
+
+    def body():
+        separator = b""
+        yield b"["
+        for batch in batches:
+            if batch:
+                yield separator + adapter.dump_json(
+                    adapter.validate_python(batch)
+                )[1:-1]
+                separator = b","
+        yield b"]"
+
+    return StreamingResponse(
+        body(), media_type="application/json", headers=headers
+    )
+
+
 @app.post("/compounds/", response_model=list[pydantic_models.Compound])
 def create_compounds(
     compounds: list[pydantic_models.CompoundCreate],
     db: Session = Depends(get_db)
     ):
+    if write_coalescer.accepts(compounds):
+        return write_coalescer.submit("compounds", compounds)
     compounds_to_add = []
     for compound in compounds:
         db_compound_found = io.get_compound_by_compound_name(
@@ -38,10 +135,128 @@ def create_compounds(
 def get_compounds(
     skip: int = 0, 
     limit: int = 10000, 
+    name: str | None = None,
+    type: str | None = None,
+    with_total: bool = False,
+    db: Session = Depends(get_db)
+    ):
+    headers = {}
+    if with_total:
+        headers["X-Total-Count"] = str(
+            io.count_compounds(db, name=name, compound_type=type)
+        )
+    compounds = io.iter_compounds(
+        db, skip=skip, limit=limit, name=name, compound_type=type
+    )
+    return stream_json(compounds, pydantic_models.Compound, headers=headers)
+
+
+def parse_element_range(spec: str) -> tuple[str, int, int, int | None]:
+    """
+    Parses an element range such as "Cl:1:3" (1 to 3 Cl), "S:0:0" (no S),
+    "Br:2" (at least 2 Br), "N" (at least one N) or "[2]H:3:9" (3 to 9 
+    deuterium labels) into element, minimum and maximum count and isotope.
+    """
+    match = re.fullmatch(
+        r"(?:\[(\d+)\])?([A-Z][a-z]*)(?::(\d+))?(?::(\d+))?", spec.strip()
+    )
+    if match is None:
+        raise ValueError(
+            f"Invalid element range '{spec}', expected e.g. 'Cl:1:3'."
+        )
+    isotope, element, min_count, max_count = match.groups()
+    min_count = int(min_count) if min_count is not None else 1
+    max_count = int(max_count) if max_count is not None else 2**31 - 1
+    if min_count > max_count:
+        raise ValueError(f"Invalid element range '{spec}', min > max.")
+    return element, min_count, max_count, (
+        int(isotope) if isotope is not None else None
+    )
+
+
+@app.get(
+    "/compounds/search/", response_model=list[pydantic_models.Compound]
+)
+def search_compounds(
+    q: str,
+    limit: int = 10,
     db: Session = Depends(get_db)
     ):
-    compounds = io.get_compounds(db, skip=skip, limit=limit)
-    return compounds
+    """
+    Returns the compounds whose name contains `q`, best matches first, for
+    search-as-you-type.
+    """
+    if not 1 <= limit <= 1000:
+        raise HTTPException(
+            status_code=400, detail="limit must be between 1 and 1000."
+        )
+    return io.search_compounds(db, q, limit=limit)
+
+
+@app.get(
+    "/compounds/by_composition/",
+    response_model=list[pydantic_models.Compound]
+)
+def get_compounds_by_composition(
+    element: list[str] = Query(default=[]),
+    min_mass: float | None = None,
+    max_mass: float | None = None,
+    type: str | None = None,
+    skip: int = 0,
+    limit: int = 1000,
+    db: Session = Depends(get_db)
+    ):
+    try:
+        element_ranges = [parse_element_range(spec) for spec in element]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return io.get_compounds_by_composition(
+        db, element_ranges, min_mass=min_mass, max_mass=max_mass,
+        compound_type=type, skip=skip, limit=limit
+    )
+
+
+@app.get(
+    "/compounds/mass_defect/",
+    response_model=list[pydantic_models.CompoundMassDefect]
+)
+def get_compounds_by_mass_defect(
+    base: str = screening.DEFAULT_KENDRICK_BASE,
+    min_mass_defect: float | None = None,
+    max_mass_defect: float | None = None,
+    min_kmd: float | None = None,
+    max_kmd: float | None = None,
+    min_mass: float | None = None,
+    max_mass: float | None = None,
+    type: str | None = None,
+    skip: int = 0,
+    limit: int = 1000,
+    db: Session = Depends(get_db)
+    ):
+    try:
+        rows = io.get_compounds_by_mass_defect(
+            db, base=base,
+            min_mass_defect=min_mass_defect, max_mass_defect=max_mass_defect,
+            min_kmd=min_kmd, max_kmd=max_kmd,
+            min_mass=min_mass, max_mass=max_mass,
+            compound_type=type, skip=skip, limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return [
+        pydantic_models.CompoundMassDefect(
+            compound_id=compound.compound_id,
+            compound_name=compound.compound_name,
+            molecular_formula=compound.molecular_formula,
+            type=compound.type,
+            computed_mass=compound.computed_mass,
+            mass_defect=md,
+            kendrick_mass_defect=kmd
+        )
+        for compound, md, kmd in rows
+    ]
 
 
 @app.post("/adducts/", response_model=list[pydantic_models.Adduct])
@@ -49,6 +264,8 @@ def create_adducts(
     adducts: list[pydantic_models.AdductCreate],
     db: Session = Depends(get_db)
     ):
+    if write_coalescer.accepts(adducts):
+        return write_coalescer.submit("adducts", adducts)
     adducts_to_add = []
     for adduct in adducts:
         db_adduct_found = io.get_adduct_by_adduct_name(
@@ -78,6 +295,13 @@ def create_measured_compounds(
     measured_compounds: list[pydantic_models.MeasuredCompoundClient],
     db: Session = Depends(get_db)
     ):
+    if write_coalescer.accepts(measured_compounds):
+        try:
+            return write_coalescer.submit(
+                "measured_compounds", measured_compounds
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     try:
         msc_d = io.prepare_measured_compounds_create(db, measured_compounds)
         created = io.create_measured_compounds(db, msc_d["valid"])
@@ -94,6 +318,9 @@ def get_measured_compounds(
     retention_time: float | None = None,
     type: str | None = None,
     ion_mode: str | None = None,
+    skip: int = 0,
+    limit: int | None = None,
+    with_total: bool = False,
     db: Session = Depends(get_db)
     ):
     params = [retention_time, ion_mode]
@@ -109,10 +336,40 @@ def get_measured_compounds(
             detail="Please provide retention_time and ion_mode.")
 
     else:
-        msrd_cmps = io.get_measured_compounds(db)
+        headers = {}
+        if with_total:
+            headers["X-Total-Count"] = str(io.count_measured_compounds(db))
+        return stream_json(
+            io.iter_measured_compounds(db, skip=skip, limit=limit),
+            pydantic_models.MeasuredCompoundClient,
+            headers=headers
+        )
         
     return msrd_cmps
 
+@app.post(
+    "/measured_compounds/lookup/",
+    response_model=list[pydantic_models.MeasuredCompoundLookup]
+)
+def lookup_measured_compounds(
+    queries: list[pydantic_models.MeasuredCompoundQuery],
+    db: Session = Depends(get_db)
+    ):
+    """
+    Resolves a list of (retention_time, ion_mode, type) queries, each as 
+    `GET /measured_compounds/` would, optionally with a retention time 
+    tolerance. The results are returned in the order of the queries.
+    """
+    if any(query.rt_tolerance < 0 for query in queries):
+        raise HTTPException(
+            status_code=400, detail="rt_tolerance must be >= 0."
+        )
+    results = io.lookup_measured_compounds(db, queries)
+    return [
+        {"query": query, "measured_compounds": rows}
+        for query, rows in zip(queries, results)
+    ]
+
 @app.get(
     "/retention_times/", 
     response_model=list[pydantic_models.RetentionTime]
@@ -122,5 +379,766 @@ def get_retention_times(
     limit: int = 100, 
     db: Session = Depends(get_db)
     ):
-    rts = io.get_retention_times(db, skip=skip, limit=limit)
-    return rts
\ No newline at end of file
+    return stream_json(
+        io.iter_retention_times(db, skip=skip, limit=limit),
+        pydantic_models.RetentionTime
+    )
+
+
+async def _mass_adjustments(
+    db: Session,
+    queries: list[pydantic_models.MassQuery | pydantic_models.FormulaQuery]
+    ) -> list[float]:
+    """
+    Looks up the mass adjustment of the adduct of every query, 0 for queries
+    without adduct.
+    """
+    adducts = await run_in_threadpool(io.get_adducts, db, 0, None)
+    adjustments = {a.adduct_name: a.mass_adjustment for a in adducts}
+    unknown = {
+        q.adduct_name for q in queries
+        if q.adduct_name is not None and q.adduct_name not in adjustments
+    }
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown adducts: {sorted(unknown)}"
+        )
+    return [
+        adjustments[q.adduct_name] if q.adduct_name is not None else 0.0
+        for q in queries
+    ]
+
+
+@app.post("/chem/masses/", response_model=list[pydantic_models.MassResult])
+async def compute_masses(
+    queries: list[pydantic_models.MassQuery],
+    db: Session = Depends(get_db)
+    ):
+    adjustments = await _mass_adjustments(db, queries)
+    try:
+        masses = await chem_executor.map(
+            chem.parse_and_compute_mass,
+            [q.molecular_formula for q in queries]
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return [
+        pydantic_models.MassResult(
+            molecular_formula=q.molecular_formula,
+            adduct_name=q.adduct_name,
+            mass=m,
+            mz=m + adjustment
+        )
+        for q, m, adjustment in zip(queries, masses, adjustments)
+    ]
+
+
+@app.post(
+    "/chem/isotope_patterns/",
+    response_model=list[pydantic_models.IsotopePattern]
+)
+async def compute_isotope_patterns(
+    queries: list[pydantic_models.MassQuery],
+    max_peaks: int = Query(6, ge=1),
+    min_abundance: float = Query(1e-4, ge=0, lt=1),
+    db: Session = Depends(get_db)
+    ):
+    adjustments = await _mass_adjustments(db, queries)
+    try:
+        patterns = await chem_executor.map(
+            functools.partial(
+                chem.isotope_pattern,
+                max_peaks=max_peaks,
+                min_abundance=min_abundance
+            ),
+            [q.molecular_formula for q in queries]
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return [
+        pydantic_models.IsotopePattern(
+            molecular_formula=q.molecular_formula,
+            adduct_name=q.adduct_name,
+            peaks=[
+                pydantic_models.IsotopePeak(
+                    mz=m + adjustment, abundance=abundance
+                )
+                for m, abundance in pattern
+            ]
+        )
+        for q, pattern, adjustment in zip(queries, patterns, adjustments)
+    ]
+
+
+@app.post(
+    "/formulas/candidates/",
+    response_model=list[pydantic_models.FormulaCandidates]
+)
+async def generate_formula_candidates(
+    queries: list[pydantic_models.FormulaQuery],
+    db: Session = Depends(get_db)
+    ):
+    if len(queries) > config.FORMULA_MAX_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {config.FORMULA_MAX_QUERIES} queries per request."
+        )
+    try:
+        for q in queries:
+            formula_generator.check_bounds(q.element_bounds)
+            formula_generator.check_parameters(q.ppm, q.max_candidates)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    adjustments = await _mass_adjustments(db, queries)
+    candidates = await chem_executor.map(
+        formula_generator.generate_formulas_for_query,
+        [
+            {
+                "mz": q.mz,
+                "mass_adjustment": adjustment,
+                "ppm": q.ppm,
+                "bounds": q.element_bounds,
+                "rdbe_range": (q.min_rdbe, q.max_rdbe),
+                "senior_rules": q.senior_rules,
+                "heuristics": q.heuristics,
+                "max_candidates": q.max_candidates,
+            }
+            for q, adjustment in zip(queries, adjustments)
+        ],
+        inline_threshold=config.FORMULA_INLINE_THRESHOLD,
+        chunk_size=config.FORMULA_CHUNK_SIZE
+    )
+
+    return [
+        pydantic_models.FormulaCandidates(
+            mz=q.mz,
+            adduct_name=q.adduct_name,
+            candidates=[pydantic_models.FormulaCandidate(**c) for c in cs]
+        )
+        for q, cs in zip(queries, candidates)
+    ]
+
+@app.post(
+    "/screening/features/",
+    response_model=pydantic_models.FeatureScreenResult
+)
+def screen_features(screen: pydantic_models.FeatureScreen):
+    try:
+        result = screening.screen(
+            screen.mz, base=screen.base,
+            min_mass_defect=screen.min_mass_defect,
+            max_mass_defect=screen.max_mass_defect,
+            min_kmd=screen.min_kmd, max_kmd=screen.max_kmd,
+            min_mass=screen.min_mz, max_mass=screen.max_mz
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    indices = result["indices"]
+    return pydantic_models.FeatureScreenResult(
+        indices=indices.tolist(),
+        mz=[screen.mz[i] for i in indices],
+        mass_defect=result["mass_defect"].tolist(),
+        kendrick_mass_defect=result["kendrick_mass_defect"].tolist()
+    )
+
+
+@app.get(
+    "/screening/library_ions/",
+    response_model=list[pydantic_models.LibraryIon]
+)
+def screen_library_ions(
+    ion_mode: str | None = None,
+    type: str | None = None,
+    base: str = screening.DEFAULT_KENDRICK_BASE,
+    min_mass_defect: float | None = None,
+    max_mass_defect: float | None = None,
+    min_kmd: float | None = None,
+    max_kmd: float | None = None,
+    min_mz: float | None = None,
+    max_mz: float | None = None,
+    limit: int = 10000,
+    db: Session = Depends(get_db)
+    ):
+    mapped = snapshot.library_snapshot.current()
+    if mapped is not None:
+        ions = mapped.library_ions(ion_mode=ion_mode, compound_type=type)
+    else:
+        ions = library.library_ions(db, ion_mode=ion_mode, compound_type=type)
+    try:
+        result = screening.screen(
+            ions["mz"], base=base,
+            min_mass_defect=min_mass_defect, max_mass_defect=max_mass_defect,
+            min_kmd=min_kmd, max_kmd=max_kmd,
+            min_mass=min_mz, max_mass=max_mz
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    compounds, adducts = ions["compounds"], ions["adducts"]
+    selected = result["indices"][:limit]
+    return [
+        pydantic_models.LibraryIon(
+            compound_id=compounds["compound_id"][c],
+            compound_name=compounds["compound_name"][c],
+            adduct_name=adducts["adduct_name"][a],
+            ion_mode=adducts["ion_mode"][a],
+            mz=mz,
+            mass_defect=md,
+            kendrick_mass_defect=kmd
+        )
+        for c, a, mz, md, kmd in zip(
+            ions["compound_index"][selected].tolist(),
+            ions["adduct_index"][selected].tolist(),
+            ions["mz"][selected].tolist(),
+            result["mass_defect"][:limit].tolist(),
+            result["kendrick_mass_defect"][:limit].tolist()
+        )
+    ]
+
+
+@app.get(
+    "/screening/measured_ions/",
+    response_model=list[pydantic_models.MeasuredIon]
+)
+def get_measured_ions(
+    ion_mode: str | None = None,
+    index: ion_index.LiveMeasuredIonIndex = Depends(ready_ion_index)
+    ):
+    ions = index.ions()
+    return [
+        pydantic_models.MeasuredIon(
+            measured_compound_id=measured_compound_id,
+            compound_id=compound_id,
+            compound_name=compound_name,
+            adduct_name=adduct_name,
+            ion_mode=mode,
+            mz=mz,
+            retention_time=retention_time
+        )
+        for measured_compound_id, compound_id, compound_name, adduct_name,
+            mode, mz, retention_time in zip(
+            ions["measured_compound_id"].tolist(),
+            ions["compound_id"].tolist(),
+            ions["compound_name"],
+            ions["adduct_name"],
+            ions["ion_mode"],
+            ions["mz"].tolist(),
+            ions["retention_time"].tolist()
+        )
+        if ion_mode is None or mode == ion_mode
+    ]
+
+@app.post(
+    "/screening/measured_compounds/",
+    response_model=list[pydantic_models.FeatureMatch]
+)
+def match_features(
+    features: pydantic_models.FeatureMatchQuery,
+    response: Response,
+    index: ion_index.LiveMeasuredIonIndex = Depends(ready_ion_index)
+    ):
+    if len(features.mz) != len(features.retention_time):
+        raise HTTPException(
+            status_code=400,
+            detail="mz and retention_time must have the same length."
+        )
+    for name, value, maximum in (
+        ("ppm", features.ppm, config.MATCH_MAX_PPM),
+        ("mz_tolerance", features.mz_tolerance,
+         config.MATCH_MAX_MZ_TOLERANCE),
+        ("rt_tolerance", features.rt_tolerance,
+         config.MATCH_MAX_RT_TOLERANCE),
+    ):
+        if value is not None and not 0 <= value <= maximum:
+            raise HTTPException(
+                status_code=400,
+                detail=f"{name} must be between 0 and {maximum}."
+            )
+    feature_index, ions = index.match(
+        features.ion_mode,
+        features.mz,
+        features.retention_time,
+        ppm=features.ppm,
+        mz_tolerance=features.mz_tolerance,
+        rt_tolerance=features.rt_tolerance
+    )
+    # The matches are ordered by feature, so the last features lose theirs
+    truncated = len(feature_index) > config.MATCH_MAX_MATCHES
+    response.headers["X-Truncated"] = str(truncated).lower()
+    if truncated:
+        rows = np.arange(config.MATCH_MAX_MATCHES)
+        feature_index = feature_index[rows]
+        ions = ion_index.take_ions(ions, rows)
+
+    mz, retention_time = ions["mz"], ions["retention_time"]
+    feature_mz = np.asarray(features.mz)[feature_index]
+    feature_rt = np.asarray(features.retention_time)[feature_index]
+    return [
+        pydantic_models.FeatureMatch(
+            feature_index=i,
+            measured_compound_id=measured_compound_id,
+            compound_id=compound_id,
+            compound_name=compound_name,
+            adduct_name=adduct_name,
+            mz=ion_mz,
+            retention_time=ion_rt,
+            ppm_error=ppm_error,
+            rt_error=rt_error
+        )
+        for i, measured_compound_id, compound_id, compound_name, adduct_name,
+            ion_mz, ion_rt, ppm_error, rt_error in zip(
+            feature_index.tolist(),
+            ions["measured_compound_id"].tolist(),
+            ions["compound_id"].tolist(),
+            ions["compound_name"],
+            ions["adduct_name"],
+            mz.tolist(),
+            retention_time.tolist(),
+            ((feature_mz - mz) / mz * 1e6).tolist(),
+            (feature_rt - retention_time).tolist()
+        )
+    ]
+
+
+def _library_conflict_ions(ions: dict) -> dict:
+    """
+    Flattens library ions into the columns of measured ions used by the
+    conflict report.
+    """
+    compounds, adducts = ions["compounds"], ions["adducts"]
+    compound_index, adduct_index = ions["compound_index"], ions["adduct_index"]
+    return {
+        "compound_id": np.asarray(compounds["compound_id"])[compound_index],
+        "compound_name": np.asarray(
+            compounds["compound_name"], dtype=object
+        )[compound_index],
+        "adduct_id": np.asarray(adducts["adduct_id"])[adduct_index],
+        "adduct_name": np.asarray(
+            adducts["adduct_name"], dtype=object
+        )[adduct_index],
+        "ion_mode": np.asarray(adducts["ion_mode"], dtype=object)[adduct_index],
+        "mz": np.asarray(ions["mz"], dtype=np.float64),
+    }
+
+
+@app.get(
+    "/screening/conflicts/",
+    response_model=pydantic_models.ConflictReport
+)
+def get_conflicts(
+    source: str = "measured",
+    ion_mode: str | None = None,
+    type: str | None = None,
+    ppm: float = 5.0,
+    rt_tolerance: float | None = None,
+    kind: str | None = None,
+    limit: int = 1000,
+    db: Session = Depends(get_db)
+    ):
+    if source not in ("measured", "library"):
+        raise HTTPException(
+            status_code=400, detail="source must be 'measured' or 'library'."
+        )
+    if kind not in (None, "isomer", "isobar"):
+        raise HTTPException(
+            status_code=400, detail="kind must be 'isomer' or 'isobar'."
+        )
+    if ppm > config.CONFLICT_MAX_PPM:
+        raise HTTPException(
+            status_code=400,
+            detail=f"ppm must be <= {config.CONFLICT_MAX_PPM}."
+        )
+    if source == "measured":
+        if type is not None:
+            raise HTTPException(
+                status_code=400,
+                detail="type can only be used with source 'library'."
+            )
+        ions = ready_ion_index().ions()
+        if ion_mode is not None:
+            rows = np.flatnonzero(
+                np.asarray(ions["ion_mode"], dtype=object) == ion_mode
+            )
+            ions = ion_index.take_ions(ions, rows)
+    else:
+        if rt_tolerance is not None:
+            raise HTTPException(
+                status_code=400,
+                detail="rt_tolerance can only be used with source 'measured'."
+            )
+        mapped = snapshot.library_snapshot.current()
+        if mapped is not None:
+            ions = mapped.library_ions(ion_mode=ion_mode, compound_type=type)
+        else:
+            ions = library.library_ions(
+                db, ion_mode=ion_mode, compound_type=type
+            )
+        ions = _library_conflict_ions(ions)
+    try:
+        found = conflicts.find_conflicts(
+            ions["mz"], ions["ion_mode"], ions["compound_id"],
+            ions["adduct_id"], retention_time=ions.get("retention_time"),
+            ppm=ppm, rt_tolerance=rt_tolerance,
+            max_pairs=config.CONFLICT_MAX_PAIRS
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if kind is not None:
+        selected = found["isomer"] == (kind == "isomer")
+        found = {
+            name: values[selected] if isinstance(values, np.ndarray)
+            else values
+            for name, values in found.items()
+        }
+    summary = conflicts.conflict_summary(found, len(ions["mz"]))
+
+    order = np.argsort(found["ppm"], kind="stable")[:max(limit, 0)]
+    measured = source == "measured"
+
+    def conflict_ion(row: int) -> pydantic_models.ConflictIon:
+        return pydantic_models.ConflictIon(
+            compound_id=int(ions["compound_id"][row]),
+            compound_name=ions["compound_name"][row],
+            adduct_name=ions["adduct_name"][row],
+            mz=float(ions["mz"][row]),
+            measured_compound_id=int(ions["measured_compound_id"][row])
+            if measured else None,
+            retention_time=float(ions["retention_time"][row])
+            if measured else None
+        )
+
+    return pydantic_models.ConflictReport(
+        source=source,
+        ppm=ppm,
+        rt_tolerance=rt_tolerance,
+        **summary,
+        conflicts=[
+            pydantic_models.IonConflict(
+                kind="isomer" if isomer else "isobar",
+                ion_mode=ions["ion_mode"][a],
+                ppm=difference,
+                a=conflict_ion(a),
+                b=conflict_ion(b)
+            )
+            for a, b, difference, isomer in zip(
+                found["a"][order].tolist(),
+                found["b"][order].tolist(),
+                found["ppm"][order].tolist(),
+                found["isomer"][order].tolist()
+            )
+        ]
+    )
+
+
+@app.post("/spectra/", response_model=list[pydantic_models.Spectrum])
+def create_spectra(
+    spectra_in: list[pydantic_models.SpectrumCreate],
+    db: Session = Depends(get_db)
+    ):
+    try:
+        created = io.create_spectra(db, spectra_in)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    spectra.spectrum_library.invalidate()
+    return created
+
+
+@app.get("/spectra/", response_model=list[pydantic_models.SpectrumPeaks])
+def get_spectra(
+    measured_compound_id: int | None = None,
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db)
+    ):
+    result = []
+    for spectrum in io.get_spectra(db, measured_compound_id, skip, limit):
+        mz, intensity = spectra.decode_peaks(spectrum.mz, spectrum.intensity)
+        result.append(pydantic_models.SpectrumPeaks(
+            spectrum_id=spectrum.spectrum_id,
+            measured_compound_id=spectrum.measured_compound_id,
+            precursor_mz=spectrum.precursor_mz,
+            collision_energy=spectrum.collision_energy,
+            n_peaks=spectrum.n_peaks,
+            mz=mz.tolist(),
+            intensity=intensity.tolist()
+        ))
+    return result
+
+
+@app.post(
+    "/spectra/search/",
+    response_model=list[pydantic_models.SpectrumSearchResult]
+)
+def search_spectra(
+    search: pydantic_models.SpectrumSearch,
+    db: Session = Depends(get_db)
+    ):
+    for i, query in enumerate(search.spectra):
+        if len(query.mz) != len(query.intensity):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Spectrum {i}: mz and intensity must have the same "
+                "length."
+            )
+    lib = spectra.spectrum_library.get(db)
+    try:
+        hits = lib.search(
+            [query.precursor_mz for query in search.spectra],
+            [(query.mz, query.intensity) for query in search.spectra],
+            precursor_tolerance=search.precursor_tolerance,
+            fragment_tolerance=search.fragment_tolerance,
+            method=search.method,
+            top_k=search.top_k,
+            min_score=search.min_score,
+            min_matched_peaks=search.min_matched_peaks
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return [
+        pydantic_models.SpectrumSearchResult(
+            query_index=q,
+            hits=[
+                pydantic_models.SpectrumHit(
+                    spectrum_id=int(lib.spectrum_id[i]),
+                    measured_compound_id=int(lib.measured_compound_id[i]),
+                    compound_id=int(lib.compound_id[i]),
+                    compound_name=lib.compound_name[i],
+                    adduct_name=lib.adduct_name[i],
+                    precursor_mz=float(lib.precursor_mz[i]),
+                    score=score,
+                    matched_peaks=matched
+                )
+                for i, score, matched in query_hits
+            ]
+        )
+        for q, query_hits in enumerate(hits)
+    ]
+
+@app.get("/admin/ion_index/", response_model=pydantic_models.IonIndexStatus)
+def get_ion_index_status():
+    index = ion_index.measured_ion_index
+    return pydantic_models.IonIndexStatus(
+        ready=index.ready.is_set(),
+        version=index.version,
+        segments=len(index.segments()),
+        rows=len(index)
+    )
+
+
+@app.get(
+    "/admin/ion_index/consistency",
+    response_model=pydantic_models.IonIndexConsistency
+)
+def check_ion_index_consistency(
+    index: ion_index.LiveMeasuredIonIndex = Depends(ready_ion_index),
+    db: Session = Depends(get_db)
+    ):
+    return index.check_consistency(db)
+
+@app.post(
+    "/jobs/{kind}/", response_model=pydantic_models.Job, status_code=202
+)
+async def submit_job(kind: str, request: Request):
+    """
+    Queues a JSON list of compounds, adducts or measured compounds, as sent
+    to their POST endpoints, for import in the background. Poll 
+    `GET /jobs/{job_id}` for the progress.
+    """
+    if kind not in jobs.JOB_KINDS:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Unknown job kind '{kind}', use one of "
+            f"{list(jobs.JOB_KINDS)}."
+        )
+    body = await request.body()
+
+    def submit():
+        with SessionLocal() as db:
+            return pydantic_models.Job.model_validate(
+                jobs.submit_job(db, kind, body), from_attributes=True
+            )
+
+    try:
+        job = await run_in_threadpool(submit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    jobs.job_runner.wake()
+    return job
+
+
+@app.get("/jobs/{job_id}", response_model=pydantic_models.JobStatus)
+def get_job(
+    job_id: int,
+    invalid_limit: int = Query(1000, ge=0),
+    db: Session = Depends(get_db)
+    ):
+    status = jobs.get_job_status(db, job_id, invalid_limit=invalid_limit)
+    if status is None:
+        raise HTTPException(
+            status_code=404, detail=f"Job {job_id} does not exist."
+        )
+    return status
+
+
+@app.post("/uploads/", response_model=pydantic_models.Upload)
+def open_upload(
+    upload: pydantic_models.UploadCreate,
+    db: Session = Depends(get_db)
+    ):
+    try:
+        return uploads.open_upload(db, upload.kind, upload.total_chunks)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.put(
+    "/uploads/{upload_id}/chunks/{chunk_index}",
+    response_model=pydantic_models.UploadChunkResult
+)
+async def upload_chunk(upload_id: int, chunk_index: int, request: Request):
+    """
+    Imports a chunk of an upload, a JSON list of rows as for the POST 
+    endpoint of the upload's kind. A chunk sent again with the same 
+    Idempotency-Key header returns the stored result instead of importing 
+    the rows again.
+    """
+    body = await request.body()
+    key = request.headers.get("idempotency-key")
+
+    def upload():
+        with SessionLocal() as db:
+            return uploads.upload_chunk(db, upload_id, chunk_index, body, key)
+
+    try:
+        result = await run_in_threadpool(upload)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except uploads.ChunkConflict as e:
+        headers = None
+        if e.retry_after is not None:
+            headers = {"Retry-After": str(max(1, round(e.retry_after)))}
+        raise HTTPException(status_code=409, detail=str(e), headers=headers)
+    if result is None:
+        raise HTTPException(
+            status_code=404, detail=f"Upload {upload_id} does not exist."
+        )
+    return result
+
+
+@app.get("/uploads/{upload_id}", response_model=pydantic_models.UploadStatus)
+def get_upload(upload_id: int, db: Session = Depends(get_db)):
+    status = uploads.get_upload_status(db, upload_id)
+    if status is None:
+        raise HTTPException(
+            status_code=404, detail=f"Upload {upload_id} does not exist."
+        )
+    return status
+
+
+@app.get("/changes/", response_model=pydantic_models.Changes)
+def get_changes(since: int = 0, db: Session = Depends(get_db)):
+    if since < 0:
+        raise HTTPException(status_code=400, detail="since must be >= 0.")
+    return io.get_changes(db, since=since)
+
+
+@app.get("/snapshot/")
+def download_snapshot(request: Request, db: Session = Depends(get_db)):
+    """
+    Returns the compounds, adducts and measured compounds as compressed
+    columnar snapshot for offline clients, or 304 if the client's copy,
+    identified by the ETag it sent as If-None-Match, is current.
+    """
+    mapped = snapshot.library_snapshot.current()
+    if mapped is not None:
+        fingerprint = mapped.fingerprint
+    else:
+        fingerprint = snapshot.library_fingerprint(db)
+    etag = f'"{snapshot.snapshot_name(fingerprint)}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    if mapped is not None:
+        payload = mapped.export()
+    else:
+        arrays, metadata = snapshot.compile_library(db)
+        etag = f'"{snapshot.snapshot_name(metadata["fingerprint"])}"'
+        payload = snapshot.export_snapshot(arrays, metadata)
+    return Response(
+        payload, media_type="application/octet-stream",
+        headers={"ETag": etag}
+    )
+
+
+@app.get(
+    "/admin/snapshot/", response_model=pydantic_models.LibrarySnapshotStatus
+)
+def get_snapshot_status():
+    library_snapshot = snapshot.library_snapshot
+    mapped = library_snapshot.current()
+    if mapped is None:
+        return pydantic_models.LibrarySnapshotStatus(
+            enabled=library_snapshot.directory is not None,
+            version=library_snapshot.version
+        )
+    return pydantic_models.LibrarySnapshotStatus(
+        enabled=True,
+        version=library_snapshot.version,
+        fingerprint=mapped.fingerprint,
+        path=mapped.path,
+        bytes=mapped.nbytes,
+        compounds=len(mapped.arrays["compounds/compound_id"]),
+        adducts=len(mapped.arrays["adducts/adduct_id"]),
+        measured_ions=len(mapped.arrays["ions/measured_compound_id"])
+    )
+
+
+@app.get(
+    "/admin/admission/",
+    response_model=list[pydantic_models.AdmissionClassStatus]
+)
+def get_admission_status():
+    return [
+        endpoint_class.status()
+        for endpoint_class in admission.admission_controller.classes.values()
+    ]
+
+
+@app.get(
+    "/admin/profiles/",
+    response_model=list[pydantic_models.RequestProfileSummary]
+)
+def get_profiles():
+    return [profile.summary() for profile in profiling.profile_store.list()]
+
+
+@app.get("/admin/profiles/{profile_id}")
+def get_profile(profile_id: int, format: str = "collapsed"):
+    profile = profiling.profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+
+    if format == "collapsed":
+        return PlainTextResponse(profile.collapsed())
+    elif format == "json":
+        return {
+            **profile.summary(),
+            "stacks": [
+                {"frames": list(stack), "count": count}
+                for stack, count in profile.stacks.most_common()
+            ]
+        }
+    raise HTTPException(
+        status_code=400, detail="format must be 'collapsed' or 'json'."
+    )
+
+
+@app.delete("/admin/profiles/")
+def delete_profiles():
+    profiling.profile_store.clear()
+    return {"deleted": True}
@@ -0,0 +1,278 @@
+"""
+Generation of candidate molecular formulas for a measured mass.
+
+The search enumerates the heteroatom combinations within the element bounds
+once (cached per bounds), discards those heavier than the target and solves
+carbon and hydrogen per combination: the ring and double bond equivalent
+(RDBE) bounds confine the carbon count to a few values, and each carbon count
+determines the hydrogen count. Candidates are then filtered by the Senior
+rules and by element ratio heuristics and ranked by mass error.
+"""
+import functools
+import itertools
+
+import numpy as np
+
+from . import config
+
+# Element -> valence used for the RDBE and the Senior rules
+VALENCES = {
+    "C": 4, "H": 1, "N": 3, "O": 2, "P": 3, "S": 2,
+    "F": 1, "Cl": 1, "Br": 1, "I": 1, "Si": 4,
+}
+
+# Element order of formulas in the compound files
+ELEMENT_ORDER = ["C", "H", "N", "O", "P", "S", "Si", "F", "Cl", "Br", "I"]
+
+DEFAULT_BOUNDS = {
+    "C": (0, 100), "H": (0, 200), "N": (0, 10), "O": (0, 20),
+    "P": (0, 3), "S": (0, 4), "Cl": (0, 6), "Br": (0, 4),
+}
+
+# Maximum element / carbon ratios ("common" range of the seven golden rules,
+# Kind & Fiehn 2007) and the H/C range
+MAX_RATIOS_TO_C = {
+    "N": 1.3, "O": 1.2, "P": 0.3, "S": 0.8, "F": 1.5, "Cl": 0.8, "Br": 0.8,
+    "I": 0.8, "Si": 0.5,
+}
+H_TO_C_RANGE = (0.2, 3.1)
+
+
+@functools.lru_cache(maxsize=None)
+def _element_mass(element: str) -> float:
+    from pyteomics import mass
+
+    return mass.nist_mass[element][0][0]
+
+
+@functools.lru_cache(maxsize=16)
+def _hetero_grid(hetero_bounds: tuple) -> tuple:
+    """
+    Enumerates all heteroatom count combinations within the bounds, sorted by
+    mass.
+
+    Args:
+        hetero_bounds (tuple): Tuples of element, minimum and maximum count.
+
+    Returns:
+        tuple: The element names, the counts as array of shape
+        (combinations, elements) and their masses.
+    """
+    elements = tuple(element for element, _, _ in hetero_bounds)
+    ranges = [range(low, high + 1) for _, low, high in hetero_bounds]
+    counts = np.array(list(itertools.product(*ranges)), dtype=np.int64)
+    counts = counts.reshape(-1, len(elements))
+    masses = counts @ np.array([_element_mass(e) for e in elements])
+    order = np.argsort(masses)
+    counts, masses = counts[order], masses[order]
+    counts.flags.writeable = False
+    masses.flags.writeable = False
+    return elements, counts, masses
+
+
+def check_bounds(bounds: dict | None) -> dict:
+    """
+    Returns the bounds with defaults for carbon and hydrogen, or
+    `DEFAULT_BOUNDS` if None.
+
+    Raises:
+        ValueError: If an element is not supported, its bounds are invalid
+        or the heteroatom bounds allow more than
+        `config.FORMULA_MAX_COMBINATIONS` count combinations.
+    """
+    merged = dict(DEFAULT_BOUNDS) if bounds is None else dict(bounds)
+    merged.setdefault("C", DEFAULT_BOUNDS["C"])
+    merged.setdefault("H", DEFAULT_BOUNDS["H"])
+    for element, (low, high) in merged.items():
+        if element not in VALENCES:
+            raise ValueError(
+                f"Unsupported element '{element}', supported are "
+                f"{sorted(VALENCES)}."
+            )
+        if low < 0 or low > high:
+            raise ValueError(f"Invalid bounds for {element}: {low}-{high}.")
+    # Carbon and hydrogen are solved, all other elements enumerated
+    combinations = 1
+    for element, (low, high) in merged.items():
+        if element not in ("C", "H"):
+            combinations *= high - low + 1
+    if combinations > config.FORMULA_MAX_COMBINATIONS:
+        raise ValueError(
+            f"The element bounds allow {combinations} heteroatom "
+            f"combinations, at most {config.FORMULA_MAX_COMBINATIONS} are "
+            "supported."
+        )
+    return merged
+
+
+def check_parameters(ppm: float, max_candidates: int):
+    """
+    Raises:
+        ValueError: If ppm is not positive or max_candidates is below 1.
+    """
+    if not ppm > 0:
+        raise ValueError("ppm must be > 0.")
+    if max_candidates < 1:
+        raise ValueError("max_candidates must be >= 1.")
+
+
+def format_formula(counts: dict) -> str:
+    """
+    Formats element counts in the notation of the compound files, e.g.
+    "C9H9O3Cl1".
+    """
+    return "".join(
+        f"{element}{counts[element]}"
+        for element in ELEMENT_ORDER
+        if counts.get(element, 0) > 0
+    )
+
+
+def generate_formulas(
+    mz: float,
+    mass_adjustment: float = 0.0,
+    ppm: float = 5.0,
+    bounds: dict | None = None,
+    rdbe_range: tuple[float, float] = (-0.5, 40.0),
+    senior_rules: bool = True,
+    heuristics: bool = True,
+    max_candidates: int = 20
+    ) -> list[dict]:
+    """
+    Generates candidate molecular formulas for a measured m/z.
+
+    Args:
+        mz (float): The measured m/z.
+        mass_adjustment (float, optional): The mass adjustment of the adduct,
+        subtracted from the m/z to get the neutral mass. Defaults to 0.0.
+        ppm (float, optional): The mass tolerance in ppm of the m/z. Defaults
+        to 5.0.
+        bounds (dict | None, optional): Maps elements to (min, max) counts.
+        Defaults to `DEFAULT_BOUNDS` (CHNOPS, Cl and Br).
+        rdbe_range (tuple[float, float], optional): The allowed ring and
+        double bond equivalents. Defaults to (-0.5, 40).
+        senior_rules (bool, optional): Whether to require an even valence sum,
+        a valence sum of at least twice the maximum valence and of at least
+        twice the number of atoms minus one. Defaults to True.
+        heuristics (bool, optional): Whether to apply the H/C and
+        heteroatom/C ratio limits. Defaults to True.
+        max_candidates (int, optional): The number of returned candidates.
+        Defaults to 20.
+
+    Returns:
+        list[dict]: The candidates ordered by absolute mass error, with keys
+        "molecular_formula", "mass", "mz", "ppm_error" and "rdbe".
+
+    Raises:
+        ValueError: If the bounds or parameters are invalid, see
+        `check_bounds` and `check_parameters`.
+    """
+    check_parameters(ppm, max_candidates)
+    bounds = check_bounds(bounds)
+    hetero_bounds = tuple(
+        (element, *bounds[element])
+        for element in ELEMENT_ORDER
+        if element in bounds and element not in ("C", "H")
+    )
+    elements, counts, hetero_masses = _hetero_grid(hetero_bounds)
+
+    mass_c, mass_h = _element_mass("C"), _element_mass("H")
+    target = mz - mass_adjustment
+    tolerance = abs(mz) * ppm * 1e-6
+
+    # Heteroatom combinations lighter than the target
+    n_rows = np.searchsorted(hetero_masses, target + tolerance, side="right")
+    counts, rest = counts[:n_rows], target - hetero_masses[:n_rows]
+    if n_rows == 0:
+        return []
+
+    # Per combination, RDBE = C - (H + X) / 2 + (N + P) / 2 + 1, so the RDBE
+    # bounds translate into bounds for C given the remaining mass
+    valences = np.array([VALENCES[e] for e in elements])
+    monovalent = counts[:, valences == 1].sum(axis=1)
+    trivalent = counts[:, valences == 3].sum(axis=1)
+    tetravalent = counts[:, valences == 4].sum(axis=1)
+    offset = 2 + trivalent + 2 * tetravalent - monovalent
+    denominator = mass_c + 2 * mass_h
+    c_low = np.ceil(
+        (rest - tolerance - mass_h * (offset - 2 * rdbe_range[0]))
+        / denominator
+    )
+    c_high = np.floor(
+        (rest + tolerance - mass_h * (offset - 2 * rdbe_range[1]))
+        / denominator
+    )
+    c_low = np.maximum(c_low, bounds["C"][0])
+    c_high = np.minimum(
+        np.minimum(c_high, np.floor((rest + tolerance) / mass_c)),
+        bounds["C"][1]
+    )
+    valid = c_high >= c_low
+    if not valid.any():
+        return []
+    counts, rest, offset = counts[valid], rest[valid], offset[valid]
+    c_low, c_high = c_low[valid], c_high[valid]
+
+    width = int((c_high - c_low).max()) + 1
+    c = c_low[:, None] + np.arange(width)[None, :]
+    h = np.rint((rest[:, None] - mass_c * c) / mass_h)
+    error = rest[:, None] - mass_c * c - mass_h * h
+    keep = (
+        (c <= c_high[:, None])
+        & (np.abs(error) <= tolerance)
+        & (h >= bounds["H"][0]) & (h <= bounds["H"][1])
+    )
+    rows, cols = np.nonzero(keep)
+    c, h, error = c[rows, cols], h[rows, cols], error[rows, cols]
+    counts = counts[rows]
+    rdbe = (2 * c + offset[rows] - h) / 2
+
+    keep = (rdbe >= rdbe_range[0]) & (rdbe <= rdbe_range[1])
+    if senior_rules:
+        valence_sum = 4 * c + h + counts @ valences
+        n_atoms = c + h + counts.sum(axis=1)
+        max_valence = np.where(c > 0, 4, 0)
+        for j, valence in enumerate(valences):
+            max_valence = np.where(
+                counts[:, j] > 0, np.maximum(max_valence, valence),
+                max_valence
+            )
+        max_valence = np.where(h > 0, np.maximum(max_valence, 1), max_valence)
+        keep &= valence_sum % 2 == 0
+        keep &= valence_sum >= 2 * max_valence
+        keep &= valence_sum >= 2 * (n_atoms - 1)
+    if heuristics:
+        keep &= c > 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            h_to_c = h / c
+            keep &= (h_to_c >= H_TO_C_RANGE[0]) & (h_to_c <= H_TO_C_RANGE[1])
+            for j, element in enumerate(elements):
+                keep &= counts[:, j] / c <= MAX_RATIOS_TO_C[element]
+
+    c, h, error, rdbe = c[keep], h[keep], error[keep], rdbe[keep]
+    counts = counts[keep]
+    order = np.argsort(np.abs(error), kind="stable")[:max_candidates]
+
+    candidates = []
+    for i in order:
+        element_counts = {"C": int(c[i]), "H": int(h[i])}
+        element_counts.update(
+            (element, int(n)) for element, n in zip(elements, counts[i])
+        )
+        neutral_mass = target - error[i]
+        candidates.append({
+            "molecular_formula": format_formula(element_counts),
+            "mass": float(neutral_mass),
+            "mz": float(neutral_mass + mass_adjustment),
+            "ppm_error": float(error[i] / mz * 1e6),
+            "rdbe": float(rdbe[i]),
+        })
+    return candidates
+
+
+def generate_formulas_for_query(query: dict) -> list[dict]:
+    """
+    Calls `generate_formulas` with the keyword arguments in `query`, for use
+    with `database.executor.ChemExecutor`.
+    """
+    return generate_formulas(**query)
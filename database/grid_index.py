@@ -0,0 +1,316 @@
+"""
+2-D index over the (m/z, retention time) of ions for matching whole feature
+tables against the library.
+
+Points are bucketed by m/z and sorted by retention time within a bucket, so a
+rectangular window query only touches the buckets overlapping its m/z range
+and finds the retention time range in each with a binary search. Queries are
+answered in batches with NumPy, without a Python loop over features.
+
+This module only depends on NumPy, so the client (`ms.offline`) matches
+against its offline library with the same code as the API; the index the
+API keeps up to date with the database is in `database.ion_index`.
+"""
+import numpy as np
+
+
+def _expand_ranges(starts: np.ndarray, ends: np.ndarray) -> tuple:
+    """
+    Expands ranges [starts[i], ends[i]) into the flat positions they contain.
+
+    Returns:
+        tuple: The index of the range and the position for every element.
+    """
+    lengths = np.maximum(ends - starts, 0)
+    owner = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.cumsum(lengths) - lengths
+    positions = starts[owner] + np.arange(len(owner)) - offsets[owner]
+    return owner, positions
+
+
+def feature_windows(
+    mz: np.ndarray,
+    retention_time: np.ndarray,
+    ppm: float = 5.0,
+    mz_tolerance: float | None = None,
+    rt_tolerance: float | None = None
+    ) -> tuple:
+    """
+    Builds the query windows around features.
+
+    Args:
+        mz (np.ndarray): The m/z values of the features.
+        retention_time (np.ndarray): The retention times of the features.
+        ppm (float, optional): The m/z tolerance in ppm. Defaults to 5.0.
+        mz_tolerance (float | None, optional): An absolute m/z tolerance in Da
+        used instead of `ppm`. Defaults to None.
+        rt_tolerance (float | None, optional): The retention time tolerance,
+        None to ignore the retention time. Defaults to None.
+
+    Returns:
+        tuple: The arrays mz_low, mz_high, rt_low and rt_high.
+    """
+    mz = np.asarray(mz, dtype=np.float64)
+    retention_time = np.asarray(retention_time, dtype=np.float64)
+    if mz_tolerance is None:
+        mz_delta = np.abs(mz) * ppm * 1e-6
+    else:
+        mz_delta = np.full_like(mz, mz_tolerance)
+    if rt_tolerance is None:
+        rt_low = np.full_like(retention_time, -np.inf)
+        rt_high = np.full_like(retention_time, np.inf)
+    else:
+        rt_low = retention_time - rt_tolerance
+        rt_high = retention_time + rt_tolerance
+    return mz - mz_delta, mz + mz_delta, rt_low, rt_high
+
+
+class GridIndex:
+    """
+    Bucket index over 2-D points for batched rectangular window queries.
+
+    Attributes:
+        mz_bin (float): The width of the m/z buckets.
+        size (int): The number of indexed points.
+    """
+    def __init__(
+        self,
+        mz: np.ndarray,
+        retention_time: np.ndarray,
+        mz_bin: float = 1.0
+        ):
+        mz = np.asarray(mz, dtype=np.float64)
+        retention_time = np.asarray(retention_time, dtype=np.float64)
+        self.mz_bin = mz_bin
+        self.size = len(mz)
+
+        buckets = np.floor(mz / mz_bin).astype(np.int64)
+        self._order = np.lexsort((retention_time, buckets))
+        self._mz = mz[self._order]
+        self._rt = retention_time[self._order]
+        buckets = buckets[self._order]
+
+        # Bucket keys with the start of their segment (CSR layout)
+        self._keys, starts = np.unique(buckets, return_index=True)
+        self._starts = np.append(starts, self.size)
+
+        # Composite key bucket segment * n + rank of the retention time among
+        # the distinct retention times, which is sorted because the points
+        # are sorted by segment and retention time. Integer keys keep the
+        # bounds exact, unlike a float key segment * span + retention time.
+        self._rt_values = np.unique(self._rt)
+        segments = np.repeat(np.arange(len(self._keys)), np.diff(self._starts))
+        self._composite = segments * len(self._rt_values) \
+            + np.searchsorted(self._rt_values, self._rt)
+
+    def _composite_key(self, segments: np.ndarray, rank: np.ndarray):
+        return segments * len(self._rt_values) + rank
+
+    def query(
+        self,
+        mz_low: np.ndarray,
+        mz_high: np.ndarray,
+        rt_low: np.ndarray,
+        rt_high: np.ndarray
+        ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the points inside every window, bounds included.
+
+        Args:
+            mz_low, mz_high (np.ndarray): The m/z bounds of the windows.
+            rt_low, rt_high (np.ndarray): The retention time bounds.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The window index and the point index
+            (position in the arrays the index was built from) of every match,
+            ordered by window and point.
+        """
+        mz_low, mz_high, rt_low, rt_high = (
+            np.asarray(a, dtype=np.float64)
+            for a in (mz_low, mz_high, rt_low, rt_high)
+        )
+        empty = np.empty(0, dtype=np.int64)
+        if self.size == 0 or len(mz_low) == 0:
+            return empty, empty
+
+        # (window, bucket) pairs for all buckets overlapping the m/z range
+        first = np.clip(
+            np.floor(mz_low / self.mz_bin), self._keys[0], self._keys[-1] + 1
+        ).astype(np.int64)
+        last = np.clip(
+            np.floor(mz_high / self.mz_bin), self._keys[0] - 1, self._keys[-1]
+        ).astype(np.int64)
+        windows, buckets = _expand_ranges(first, last + 1)
+
+        segments = np.searchsorted(self._keys, buckets)
+        present = self._keys[np.minimum(segments, len(self._keys) - 1)] \
+            == buckets
+        windows, segments = windows[present], segments[present]
+
+        # Retention time range inside every bucket segment: the points with
+        # a rank of at least that of the first value >= rt_low and below
+        # that of the first value > rt_high
+        rank_low = np.searchsorted(self._rt_values, rt_low, side="left")
+        rank_high = np.searchsorted(self._rt_values, rt_high, side="right")
+        starts = np.searchsorted(
+            self._composite,
+            self._composite_key(segments, rank_low[windows]),
+            side="left"
+        )
+        ends = np.searchsorted(
+            self._composite,
+            self._composite_key(segments, rank_high[windows]),
+            side="left"
+        )
+        starts = np.clip(starts, self._starts[segments],
+                         self._starts[segments + 1])
+        ends = np.clip(ends, self._starts[segments],
+                       self._starts[segments + 1])
+
+        owner, positions = _expand_ranges(starts, ends)
+        windows = windows[owner]
+        mz, rt = self._mz[positions], self._rt[positions]
+        inside = (
+            (mz >= mz_low[windows]) & (mz <= mz_high[windows])
+            & (rt >= rt_low[windows]) & (rt <= rt_high[windows])
+        )
+        windows, points = windows[inside], self._order[positions[inside]]
+        order = np.lexsort((points, windows))
+        return windows[order], points[order]
+
+
+def brute_force_query(
+    mz: np.ndarray,
+    retention_time: np.ndarray,
+    mz_low: np.ndarray,
+    mz_high: np.ndarray,
+    rt_low: np.ndarray,
+    rt_high: np.ndarray,
+    chunk_size: int = 256
+    ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Reference implementation of `GridIndex.query` comparing every window with
+    every point.
+    """
+    mz = np.asarray(mz, dtype=np.float64)
+    retention_time = np.asarray(retention_time, dtype=np.float64)
+    windows, points = [], []
+    for i in range(0, len(mz_low), chunk_size):
+        s = slice(i, i + chunk_size)
+        inside = (
+            (mz[None, :] >= np.asarray(mz_low)[s, None])
+            & (mz[None, :] <= np.asarray(mz_high)[s, None])
+            & (retention_time[None, :] >= np.asarray(rt_low)[s, None])
+            & (retention_time[None, :] <= np.asarray(rt_high)[s, None])
+        )
+        w, p = np.nonzero(inside)
+        windows.append(w + i)
+        points.append(p)
+    if not windows:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    return np.concatenate(windows), np.concatenate(points)
+
+
+class MeasuredIonIndex:
+    """
+    `GridIndex` per ion mode over the theoretical m/z and the retention time
+    of the measured compounds.
+
+    Attributes:
+        ions (dict): The columns returned by `library.measured_ion_arrays`.
+    """
+    def __init__(self, ions: dict, mz_bin: float = 1.0):
+        self.ions = ions
+        self._sorted_ids = None
+        ion_modes = np.array(ions["ion_mode"], dtype=object)
+        self._rows = {}
+        self._indexes = {}
+        for ion_mode in set(ions["ion_mode"]):
+            rows = np.flatnonzero(ion_modes == ion_mode)
+            self._rows[ion_mode] = rows
+            self._indexes[ion_mode] = GridIndex(
+                ions["mz"][rows], ions["retention_time"][rows], mz_bin=mz_bin
+            )
+
+    @classmethod
+    def from_db(cls, db, mz_bin: float = 1.0) -> "MeasuredIonIndex":
+        # Imported here so the client does not need the database modules
+        from . import library
+
+        return cls(library.measured_ion_arrays(db), mz_bin=mz_bin)
+
+    @property
+    def ion_modes(self) -> list[str]:
+        return sorted(self._indexes)
+
+    def __len__(self):
+        return len(self.ions["measured_compound_id"])
+
+    def contains(self, measured_compound_ids: np.ndarray) -> np.ndarray:
+        """
+        Returns whether every measured compound is indexed.
+        """
+        if self._sorted_ids is None:
+            self._sorted_ids = np.sort(self.ions["measured_compound_id"])
+        if len(self._sorted_ids) == 0:
+            return np.zeros(len(measured_compound_ids), dtype=bool)
+        positions = np.minimum(
+            np.searchsorted(self._sorted_ids, measured_compound_ids),
+            len(self._sorted_ids) - 1
+        )
+        return self._sorted_ids[positions] == measured_compound_ids
+
+    def match(
+        self,
+        ion_mode: str,
+        mz: np.ndarray,
+        retention_time: np.ndarray,
+        ppm: float = 5.0,
+        mz_tolerance: float | None = None,
+        rt_tolerance: float | None = None
+        ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Matches features against the measured compounds of an ion mode.
+
+        Args:
+            ion_mode (str): The ion mode of the features.
+            mz, retention_time (np.ndarray): The features.
+            ppm, mz_tolerance, rt_tolerance: See `feature_windows`.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The feature index and the row in
+            `ions` of every match, ordered by feature.
+        """
+        empty = np.empty(0, dtype=np.int64)
+        if ion_mode not in self._indexes:
+            return empty, empty
+        windows = feature_windows(
+            mz, retention_time, ppm=ppm, mz_tolerance=mz_tolerance,
+            rt_tolerance=rt_tolerance
+        )
+        features, points = self._indexes[ion_mode].query(*windows)
+        return features, self._rows[ion_mode][points]
+
+
+def concat_ions(parts: list[dict]) -> dict:
+    """
+    Concatenates column dicts as returned by `library.measured_ion_arrays`.
+    """
+    return {
+        name: np.concatenate([part[name] for part in parts])
+        if isinstance(parts[0][name], np.ndarray)
+        else [value for part in parts for value in part[name]]
+        for name in parts[0]
+    }
+
+
+def take_ions(ions: dict, rows: np.ndarray) -> dict:
+    """
+    Selects rows of a column dict.
+    """
+    return {
+        name: values[rows] if isinstance(values, np.ndarray)
+        else [values[i] for i in rows.tolist()]
+        for name, values in ions.items()
+    }
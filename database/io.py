@@ -1,7 +1,115 @@
+import json
+from collections.abc import Iterator
+
+from sqlalchemy import Integer, bindparam, case, cast, column, func, \
+    insert, literal, or_, select, table, text, union, update
 from sqlalchemy.orm import Session
 
-from . import pydantic_models, schema
-import pandas as pd
+from . import chem, config, ion_index, pydantic_models, schema, screening, \
+    snapshot, spectra
+
+
+TRACKED_TABLES = (
+    schema.Compound, schema.Adduct, schema.RetentionTime,
+    schema.MeasuredCompound
+)
+
+
+def next_row_version(db: Session) -> int:
+    """
+    Increments the change counter in the transaction of a write and returns
+    the new version for the written rows. The counter row stays locked until
+    the transaction ends, so versions are assigned in commit order and a
+    reader that sees version v also sees all rows up to version v.
+
+    Args:
+        db (Session): The database session of the write.
+
+    Returns:
+        int: The row version of the write.
+    """
+    counter = schema.ChangeCounter.__table__
+    version = db.execute(
+        update(counter)
+        .values(version=counter.c.version + 1)
+        .returning(counter.c.version)
+    ).scalar()
+    if version is None:
+        version = 1
+        db.execute(insert(counter).values(counter_id=1, version=version))
+    return version
+
+
+def current_row_version(db: Session) -> int:
+    """
+    Returns the version of the last committed write, 0 if there was none.
+    """
+    version = db.execute(select(schema.ChangeCounter.version)).scalar()
+    return version or 0
+
+
+def backfill_row_versions(db: Session) -> int:
+    """
+    Assigns a row version to rows written before change tracking existed.
+
+    Returns:
+        int: The number of updated rows.
+    """
+    missing = [
+        model for model in TRACKED_TABLES
+        if db.query(model.row_version).filter(
+            model.row_version.is_(None)
+        ).first() is not None
+    ]
+    if not missing:
+        return 0
+    version = next_row_version(db)
+    n_updated = sum(
+        db.execute(
+            update(model)
+            .where(model.row_version.is_(None))
+            .values(row_version=version)
+        ).rowcount
+        for model in missing
+    )
+    db.commit()
+    return n_updated
+
+
+def get_changes(db: Session, since: int = 0) -> dict:
+    """
+    Returns the rows of the reference tables inserted or updated after a
+    version.
+
+    Args:
+        db (Session): The database session to use for the query.
+        since (int, optional): The version the client has. Defaults to 0 for
+        all rows.
+
+    Returns:
+        dict: "since", the current "version" and the changed "compounds",
+        "adducts", "retention_times" and "measured_compounds", each ordered
+        by row version and id. Rows of writes committed after the version
+        was read are left for the next call.
+    """
+    version = current_row_version(db)
+    changes = {"since": since, "version": version}
+    for name, model in zip(
+        ("compounds", "adducts", "retention_times", "measured_compounds"),
+        TRACKED_TABLES
+    ):
+        changes[name] = (
+            db.query(model)
+            .filter(model.row_version > since, model.row_version <= version)
+            .order_by(model.row_version, *model.__table__.primary_key)
+            .all()
+        )
+    return changes
+
+
+def _float_or_none(value) -> float | None:
+    value = float(value)
+    return None if value != value else value
 
 
 def create_compounds(db: Session, compounds: list[pydantic_models.CompoundCreate]):
@@ -14,28 +122,490 @@ def create_compounds(db: Session, compounds: list[pydantic_models.CompoundCreate
     Returns:
         list[schema.Compound]: List of created compound objects.
     """
+    parsed = chem.parse_compositions(
+        [compound.molecular_formula for compound in compounds]
+    )
+    masses = [
+        monoisotopic_mass if monoisotopic_mass is not None else float("nan")
+        for _, monoisotopic_mass in parsed
+    ]
+    mass_defects = screening.mass_defect(masses)
+    kendrick_mass_defects = screening.kendrick_mass_defect(masses)
+    row_version = next_row_version(db)
     db_compounds = [
         schema.Compound(
             compound_id=compound.compound_id,
             compound_name=compound.compound_name,
             molecular_formula=compound.molecular_formula,
-            type=compound.type
+            type=compound.type,
+            monoisotopic_mass=monoisotopic_mass,
+            mass_defect=_float_or_none(md),
+            kendrick_mass_defect=_float_or_none(kmd),
+            row_version=row_version,
+            composition=[
+                schema.CompoundComposition(
+                    element=element, isotope=isotope, count=count
+                )
+                for (element, isotope), count in composition.items()
+            ]
+        )
+        for compound, (composition, monoisotopic_mass), md, kmd in zip(
+            compounds, parsed, mass_defects, kendrick_mass_defects
         )
-        for compound in compounds
     ]
     db.add_all(db_compounds)
     db.commit()
     for compound in db_compounds:
         db.refresh(compound)
     
+    snapshot.library_snapshot.mark_stale()
     return db_compounds
 
 
-def get_compounds(db: Session, skip: int = 0, limit: int = 100):
+def _filter_compounds(query, name: str | None, compound_type: str | None):
+    if name:
+        query = query.filter(schema.Compound.compound_name.ilike(f"%{name}%"))
+    if compound_type:
+        query = query.filter(schema.Compound.type == compound_type)
+    return query
+
+
+def _stream_rows(db: Session, query, batch_size: int) -> Iterator[list]:
+    """
+    Executes a column-only select and yields its rows in batches of
+    `batch_size`, so only one batch is held in memory at a time.
+    """
+    result = db.execute(query.execution_options(yield_per=batch_size))
+    for partition in result.mappings().partitions():
+        yield [dict(row) for row in partition]
+
+
+def iter_compounds(
+    db: Session,
+    skip: int = 0,
+    limit: int | None = 100,
+    name: str | None = None,
+    compound_type: str | None = None,
+    batch_size: int = config.READ_BATCH_SIZE
+    ) -> Iterator[list[dict]]:
+    """
+    Streams the compounds of `get_compounds` in batches, without loading
+    ORM objects.
+
+    Args:
+        db (Session): The database session to use for the query.
+        skip (int, optional): The number of records to skip. Defaults to 0.
+        limit (int | None, optional): The maximum number of records to
+        return. Defaults to 100; None returns all records.
+        name (str | None, optional): Only return compounds whose name contains
+        this string, ignoring case. Defaults to None.
+        compound_type (str | None, optional): Only return compounds of this
+        type. Defaults to None.
+        batch_size (int, optional): The number of rows fetched at once.
+        Defaults to `config.READ_BATCH_SIZE`.
+
+    Yields:
+        list[dict]: Compounds with the fields of `pydantic_models.Compound`,
+        ordered by compound ID.
+    """
+    query = _filter_compounds(
+        select(
+            schema.Compound.compound_id,
+            schema.Compound.compound_name,
+            schema.Compound.molecular_formula,
+            schema.Compound.type,
+            schema.Compound.monoisotopic_mass
+        ),
+        name, compound_type
+    )
+    query = query.order_by(schema.Compound.compound_id).offset(skip)
+    for batch in _stream_rows(db, query.limit(limit), batch_size):
+        for compound in batch:
+            # Rows inserted before the mass was stored have no mass yet
+            mass = compound.pop("monoisotopic_mass")
+            compound["computed_mass"] = mass if mass is not None \
+                else chem.parse_and_compute_mass(compound["molecular_formula"])
+        yield batch
+
+
+def get_compounds(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    name: str | None = None,
+    compound_type: str | None = None
+    ) -> list[dict]:
+    """
+    Retrieve a list of compounds from the database with optional pagination
+    and filtering.
+
+    Args:
+        db (Session): The database session to use for the query.
+        skip (int, optional): The number of records to skip. Defaults to 0.
+        limit (int, optional): The maximum number of records to return.
+        Defaults to 100.
+        name (str | None, optional): Only return compounds whose name contains
+        this string, ignoring case. Defaults to None.
+        compound_type (str | None, optional): Only return compounds of this
+        type. Defaults to None.
+
+    Returns:
+        list[dict]: Compounds with the fields of `pydantic_models.Compound`,
+        ordered by compound ID.
+    """
+    return [
+        compound
+        for batch in iter_compounds(db, skip, limit, name, compound_type)
+        for compound in batch
+    ]
+
+
+def count_compounds(
+    db: Session,
+    name: str | None = None,
+    compound_type: str | None = None
+    ) -> int:
+    """
+    Count the compounds matching the filters of `get_compounds`.
+    """
+    query = _filter_compounds(
+        select(func.count()).select_from(schema.Compound), name, compound_type
+    )
+    return db.scalar(query)
+
+
+# The trigram index created by `migrate.create_name_index`
+compound_names_fts = table(
+    "compound_names_fts", column("rowid"), column("compound_names_fts")
+)
+
+
+def has_name_index(db: Session) -> bool:
+    """
+    Whether the database has the trigram index of the compound names.
+    """
+    if db.get_bind().dialect.name != "sqlite":
+        return False
+    return db.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE name = 'compound_names_fts'"
+    )).first() is not None
+
+
+def search_compounds(
+    db: Session,
+    query: str,
+    limit: int = 10,
+    candidates: int = config.NAME_SEARCH_CANDIDATES
+    ) -> list[schema.Compound]:
+    """
+    Searches the compound names for a string, ignoring case, e.g. for
+    search-as-you-type.
+
+    The names starting with the query are read from an index in
+    alphabetical order; queries of three or more characters also look up
+    names containing the query in the trigram index. Only the first
+    `candidates` matches of each lookup are ranked, so a query matching most
+    of the library is as fast as a rare one. Without the trigram index, as
+    on databases other than SQLite, the names are scanned with LIKE instead.
+
+    Args:
+        db (Session): The database session to use for the query.
+        query (str): The searched string.
+        limit (int, optional): The maximum number of compounds to return.
+        Defaults to 10.
+        candidates (int, optional): The number of matches of each lookup
+        that are ranked. Defaults to `config.NAME_SEARCH_CANDIDATES`.
+
+    Returns:
+        list[schema.Compound]: The best matches: exact matches first, then
+        names starting with the query, names with a word starting with it
+        and other names containing it, shorter names first.
+    """
+    query = query.strip()
+    if not query:
+        return []
+    candidates = max(candidates, limit)
+    compound_id = schema.Compound.compound_id
+    name = schema.Compound.compound_name
+    pattern = query.replace("\\", "\\\\").replace("%", "\\%") \
+        .replace("_", "\\_")
+
+    def like(template: str):
+        return name.ilike(template.format(pattern), escape="\\")
+
+    indexed = has_name_index(db)
+    if indexed:
+        # A range of the NOCASE index of `migrate.create_name_index`
+        nocase_name = name.collate("NOCASE")
+        lookups = [
+            select(compound_id)
+            .where(nocase_name >= query, nocase_name < query + "\U0010ffff")
+            .order_by(nocase_name)
+        ]
+    else:
+        lookups = [select(compound_id).where(like("{}%"))]
+    if len(query) >= 3 and indexed:
+        phrase = '"' + query.replace('"', '""') + '"'
+        lookups.append(
+            select(compound_names_fts.c.rowid)
+            .where(compound_names_fts.c.compound_names_fts.op("MATCH")(phrase))
+        )
+    elif len(query) >= 3:
+        lookups.append(select(compound_id).where(like("%{}%")))
+    candidate_ids = union(*(
+        select(lookup.limit(candidates).subquery().c[0])
+        for lookup in lookups
+    ))
+
+    rank = case(
+        (func.lower(name) == query.lower(), 0),
+        (like("{}%"), 1),
+        (or_(like("% {}%"), like("%-{}%"), like("%({}%")), 2),
+        else_=3
+    )
+    return db.execute(
+        select(schema.Compound)
+        .where(compound_id.in_(candidate_ids))
+        .order_by(rank, func.length(name), name)
+        .limit(limit)
+    ).scalars().all()
+
+
+def backfill_compositions(db: Session, batch_size: int = 10000) -> int:
+    """
+    Computes the composition rows and monoisotopic masses of compounds that 
+    have none, e.g. compounds inserted before the composition table existed.
+    The compounds are processed in batches, each committed on its own.
+
+    Args:
+        db (Session): The database session to use for the operation.
+        batch_size (int, optional): The number of compounds per batch. 
+        Defaults to 10000.
+
+    Returns:
+        int: The number of backfilled compounds.
+    """
+    compounds = schema.Compound.__table__
+    compositions = schema.CompoundComposition.__table__
+    has_composition = (
+        select(compositions.c.compound_id)
+        .where(compositions.c.compound_id == compounds.c.compound_id)
+        .exists()
+    )
+    n_backfilled = 0
+    last_id = None
+    while True:
+        query = (
+            select(compounds.c.compound_id, compounds.c.molecular_formula)
+            .where(~has_composition)
+            .order_by(compounds.c.compound_id)
+            .limit(batch_size)
+        )
+        if last_id is not None:
+            query = query.where(compounds.c.compound_id > last_id)
+        rows = db.execute(query).all()
+        if not rows:
+            break
+
+        parsed = chem.parse_compositions([row.molecular_formula for row in rows])
+        composition_rows = [
+            {"compound_id": row.compound_id, "element": element,
+             "isotope": isotope, "count": count}
+            for row, (composition, _) in zip(rows, parsed)
+            for (element, isotope), count in composition.items()
+        ]
+        if composition_rows:
+            db.execute(insert(compositions), composition_rows)
+        db.execute(
+            update(compounds)
+            .where(compounds.c.compound_id == bindparam("b_compound_id"))
+            .values(
+                monoisotopic_mass=bindparam("b_mass"),
+                row_version=next_row_version(db)
+            ),
+            [
+                {"b_compound_id": row.compound_id, "b_mass": mass}
+                for row, (_, mass) in zip(rows, parsed)
+            ]
+        )
+        db.commit()
+        n_backfilled += len(rows)
+        last_id = rows[-1].compound_id
+
+    return n_backfilled
+
+
+def _nominal_mass_expression(mass):
+    # Same rounding as screening.nominal_mass, for positive masses
+    return cast(mass + 0.5, Integer)
+
+
+def _kendrick_mass_defect_expression(mass, base: str):
+    kendrick_mass = mass * literal(screening.kendrick_factor(base))
+    return _nominal_mass_expression(kendrick_mass) - kendrick_mass
+
+
+def backfill_mass_defects(db: Session) -> int:
+    """
+    Computes the mass defect and the Kendrick mass defect columns in SQL for 
+    compounds with a monoisotopic mass but without mass defects.
+
+    Args:
+        db (Session): The database session to use for the operation.
+
+    Returns:
+        int: The number of updated compounds.
+    """
+    compounds = schema.Compound.__table__
+    mass = compounds.c.monoisotopic_mass
+    result = db.execute(
+        update(compounds)
+        .where(mass.is_not(None), compounds.c.mass_defect.is_(None))
+        .values(
+            mass_defect=mass - _nominal_mass_expression(mass),
+            kendrick_mass_defect=_kendrick_mass_defect_expression(
+                mass, screening.DEFAULT_KENDRICK_BASE
+            )
+        )
+    )
+    db.commit()
+    return result.rowcount
+
+
+def get_compounds_by_mass_defect(
+    db: Session,
+    base: str = screening.DEFAULT_KENDRICK_BASE,
+    min_mass_defect: float | None = None,
+    max_mass_defect: float | None = None,
+    min_kmd: float | None = None,
+    max_kmd: float | None = None,
+    min_mass: float | None = None,
+    max_mass: float | None = None,
+    compound_type: str | None = None,
+    skip: int = 0,
+    limit: int = 1000
+    ):
+    """
+    Retrieve compounds inside a mass defect and Kendrick mass defect window.
+    The window is evaluated in SQL, on the indexed columns for the default
+    Kendrick base CH2 and on the stored mass for other bases.
+
+    Args:
+        db (Session): The database session to use for the query.
+        base (str, optional): The formula of the Kendrick base. Defaults to 
+        "CH2".
+        min_mass_defect, max_mass_defect (float | None, optional): Mass defect
+        bounds.
+        min_kmd, max_kmd (float | None, optional): Kendrick mass defect bounds.
+        min_mass, max_mass (float | None, optional): Monoisotopic mass bounds.
+        compound_type (str | None, optional): The type of compound to filter.
+        skip (int, optional): The number of records to skip. Defaults to 0.
+        limit (int, optional): The maximum number of records to return. 
+        Defaults to 1000.
+
+    Returns:
+        list[tuple[schema.Compound, float, float]]: The compounds with their
+        mass defect and Kendrick mass defect, ordered by mass.
+
+    Raises:
+        ValueError: If the base is not a valid formula.
+    """
+    compound = schema.Compound
+    if base == screening.DEFAULT_KENDRICK_BASE:
+        kmd = compound.kendrick_mass_defect
+    else:
+        kmd = _kendrick_mass_defect_expression(
+            compound.monoisotopic_mass, base
+        )
+
+    query = (db.query(compound, compound.mass_defect, kmd)
+               .filter(compound.monoisotopic_mass.is_not(None))
+    )
+    for value, low, high in (
+        (compound.mass_defect, min_mass_defect, max_mass_defect),
+        (kmd, min_kmd, max_kmd),
+        (compound.monoisotopic_mass, min_mass, max_mass),
+    ):
+        if low is not None:
+            query = query.filter(value >= low)
+        if high is not None:
+            query = query.filter(value <= high)
+    if compound_type:
+        query = query.filter(compound.type == compound_type)
+
+    return (query.order_by(compound.monoisotopic_mass)
+                 .offset(skip)
+                 .limit(limit)
+                 .all()
+    )
+
+
+def get_compounds_by_composition(
+    db: Session,
+    element_ranges: list[tuple[str, int, int, int | None]],
+    min_mass: float | None = None,
+    max_mass: float | None = None,
+    compound_type: str | None = None,
+    skip: int = 0,
+    limit: int = 100
+    ):
     """
-    Retrieve a list of compounds from the database with optional pagination.
+    Retrieve compounds by element counts and monoisotopic mass range, 
+    filtered in SQL on the composition table.
+
+    Args:
+        db (Session): The database session to use for the query.
+        element_ranges (list[tuple[str, int, int, int | None]]): Tuples of 
+        element, minimum count, maximum count and isotope. Counts of an 
+        element are summed over its isotope labels if the isotope is None,
+        otherwise only atoms with this isotope label are counted (0 for the
+        natural element).
+        min_mass (float | None, optional): Minimum monoisotopic mass.
+        max_mass (float | None, optional): Maximum monoisotopic mass.
+        compound_type (str | None, optional): The type of compound to filter.
+        skip (int, optional): The number of records to skip. Defaults to 0.
+        limit (int, optional): The maximum number of records to return. 
+        Defaults to 100.
+
+    Returns:
+        List[schema.Compound]: The matching compounds ordered by mass.
     """
-    return db.query(schema.Compound).offset(skip).limit(limit).all()
+    composition = schema.CompoundComposition
+    query = db.query(schema.Compound)
+
+    for element, min_count, max_count, isotope in element_ranges:
+        counts = (
+            select(composition.compound_id)
+            .where(composition.element == element)
+            .group_by(composition.compound_id)
+        )
+        if isotope is not None:
+            counts = counts.where(composition.isotope == isotope)
+        total = func.sum(composition.count)
+        if min_count > 0:
+            # Compounds containing the element in the range
+            query = query.filter(schema.Compound.compound_id.in_(
+                counts.having(total.between(min_count, max_count))
+            ))
+        else:
+            # Compounds not containing the element above the maximum count
+            query = query.filter(schema.Compound.compound_id.not_in(
+                counts.having(total > max_count)
+            ))
+
+    if min_mass is not None:
+        query = query.filter(schema.Compound.monoisotopic_mass >= min_mass)
+    if max_mass is not None:
+        query = query.filter(schema.Compound.monoisotopic_mass <= max_mass)
+    if compound_type:
+        query = query.filter(schema.Compound.type == compound_type)
+
+    return (query.order_by(schema.Compound.monoisotopic_mass)
+                 .offset(skip)
+                 .limit(limit)
+                 .all()
+    )
+
 
 def get_compound_by_compound_name(db: Session, compound_name: str):
     """
@@ -91,11 +661,13 @@ def create_adducts(db: Session, adducts: list[pydantic_models.AdductCreate]):
         list[schema.Adduct]: A list of the created adducts after being added 
         to the database.
     """
+    row_version = next_row_version(db)
     db_adducts = [
         schema.Adduct(
             adduct_name=adduct.adduct_name,
             mass_adjustment=adduct.mass_adjustment,
-            ion_mode=adduct.ion_mode
+            ion_mode=adduct.ion_mode,
+            row_version=row_version
         )
         for adduct in adducts
     ]
@@ -104,6 +676,7 @@ def create_adducts(db: Session, adducts: list[pydantic_models.AdductCreate]):
     for adduct in db_adducts:
         db.refresh(adduct)
     
+    snapshot.library_snapshot.mark_stale()
     return db_adducts
 
 def get_adducts(db: Session, skip: int = 0, limit: int = 100):
@@ -239,11 +812,13 @@ def create_measured_compounds(
     Returns:
         list[schema.MeasuredCompound]: A list of the created measured compound schema objects.
     """
+    row_version = next_row_version(db)
     mc_schema = [
         schema.MeasuredCompound(
             compound_id=mc.compound_id,
             retention_time_id=mc.retention_time_id,
-            adduct_id=mc.adduct_id
+            adduct_id=mc.adduct_id,
+            row_version=row_version
         )
         for mc in measured_compounds
         
@@ -256,11 +831,60 @@ def create_measured_compounds(
     db.commit()
     for mc in mc_schema:
         db.refresh(mc)
+    ion_index.measured_ion_index.add_measured_compounds(
+        db, [mc.measured_compound_id for mc in mc_schema]
+    )
+    snapshot.library_snapshot.mark_stale()
     
     return mc_schema
 
 
-def get_measured_compounds(db: Session):
+def iter_measured_compounds(
+    db: Session,
+    skip: int = 0,
+    limit: int | None = None,
+    batch_size: int = config.READ_BATCH_SIZE
+    ) -> Iterator[list[dict]]:
+    """
+    Streams the measured compounds of `get_measured_compounds` in batches.
+
+    Args:
+        db (Session): The database session to use for the query.
+        skip (int, optional): The number of records to skip. Defaults to 0.
+        limit (int | None, optional): The maximum number of records to return.
+        Defaults to None, returning all records.
+        batch_size (int, optional): The number of rows fetched at once.
+        Defaults to `config.READ_BATCH_SIZE`.
+
+    Yields:
+        list[dict]: Measured compounds with the fields of
+        `pydantic_models.MeasuredCompoundClient`, ordered by measured
+        compound ID.
+    """
+    query = (select(
+                    schema.MeasuredCompound.compound_id,
+                    schema.Compound.compound_name,
+                    schema.RetentionTime.retention_time,
+                    schema.RetentionTime.comment.label(
+                        "retention_time_comment"
+                    ),
+                    schema.Adduct.adduct_name
+                )
+                .join(schema.RetentionTime, schema.MeasuredCompound.retention_time_id == schema.RetentionTime.retention_time_id)
+                .join(schema.Compound, schema.MeasuredCompound.compound_id == schema.Compound.compound_id)
+                .join(schema.Adduct, schema.MeasuredCompound.adduct_id == schema.Adduct.adduct_id)
+                .order_by(schema.MeasuredCompound.measured_compound_id)
+                .offset(skip)
+                .limit(limit)
+    )
+    yield from _stream_rows(db, query, batch_size)
+
+
+def get_measured_compounds(
+    db: Session,
+    skip: int = 0,
+    limit: int | None = None
+    ) -> list[dict]:
     """
     Retrieve measured compounds from the database.
 
@@ -270,29 +894,33 @@ def get_measured_compounds(db: Session):
 
     Args:
         db (Session): SQLAlchemy session object for database interaction.
+        skip (int, optional): The number of records to skip. Defaults to 0.
+        limit (int | None, optional): The maximum number of records to return.
+        Defaults to None, returning all records.
 
     Returns:
-        List[Tuple[int, str, float, str, str]]: A list of tuples containing 
-        the following information:
+        list[dict]: Measured compounds with the following fields:
             - compound_id (int): The ID of the compound.
             - compound_name (str): The name of the compound.
             - retention_time (float): The retention time of the compound.
-            - comment (str): Any comments associated with the retention time.
+            - retention_time_comment (str): Any comments associated with the
+              retention time.
             - adduct_name (str): The name of the adduct.
     """
-    result = (db.query(
-                    schema.MeasuredCompound.compound_id,
-                    schema.Compound.compound_name,
-                    schema.RetentionTime.retention_time,
-                    schema.RetentionTime.comment,
-                    schema.Adduct.adduct_name
-                )
-                .join(schema.RetentionTime, schema.MeasuredCompound.retention_time_id == schema.RetentionTime.retention_time_id)
-                .join(schema.Compound, schema.MeasuredCompound.compound_id == schema.Compound.compound_id)
-                .join(schema.Adduct, schema.MeasuredCompound.adduct_id == schema.Adduct.adduct_id)
-                .all()
+    return [
+        measured_compound
+        for batch in iter_measured_compounds(db, skip, limit)
+        for measured_compound in batch
+    ]
+
+
+def count_measured_compounds(db: Session) -> int:
+    """
+    Count the measured compounds in the database.
+    """
+    return db.scalar(
+        select(func.count()).select_from(schema.MeasuredCompound)
     )
-    return result
 
 
 def get_measured_compound_by_ids(
@@ -367,6 +995,74 @@ def get_measured_compounds_by_rt_type_ion_mode(
     return result
 
 
+def lookup_measured_compounds(
+    db: Session,
+    queries: list[pydantic_models.MeasuredCompoundQuery]
+    ) -> list[list]:
+    """
+    Resolves many (retention time, ion mode, type) queries with one joined
+    query. The queries are bound as a single JSON parameter, expanded with
+    SQLite's `json_each` and joined to the retention times by range, so
+    every query is an index range scan instead of a request of its own and
+    the statement does not grow with the number of queries.
+
+    Args:
+        db (Session): The database session to use for the query.
+        queries (list[pydantic_models.MeasuredCompoundQuery]): The queries.
+        A type of None matches compounds without type, as in
+        `get_measured_compounds_by_rt_type_ion_mode`.
+
+    Returns:
+        list[list]: For every query, rows with the compound ID, compound
+        name, retention time, retention time comment, adduct name and
+        molecular formula of the matching measured compounds.
+    """
+    results = [[] for _ in queries]
+    if not queries:
+        return results
+    query_table = func.json_each(bindparam("queries", json.dumps([
+        [q.retention_time - q.rt_tolerance,
+         q.retention_time + q.rt_tolerance,
+         q.ion_mode,
+         q.type]
+        for q in queries
+    ]))).table_valued("key", "value", name="queries")
+    query_index = query_table.c.key
+    rt_low, rt_high, ion_mode, type_ = (
+        func.json_extract(query_table.c.value, f"$[{i}]") for i in range(4)
+    )
+    rows = db.execute(
+        select(
+            query_index.label("query_index"),
+            schema.MeasuredCompound.compound_id,
+            schema.Compound.compound_name,
+            schema.RetentionTime.retention_time,
+            schema.RetentionTime.comment.label("retention_time_comment"),
+            schema.Adduct.adduct_name,
+            schema.Compound.molecular_formula
+        )
+        .select_from(query_table)
+        .join(schema.RetentionTime, schema.RetentionTime.retention_time
+              .between(rt_low, rt_high))
+        .join(schema.MeasuredCompound,
+              schema.MeasuredCompound.retention_time_id
+              == schema.RetentionTime.retention_time_id)
+        .join(schema.Compound,
+              schema.MeasuredCompound.compound_id
+              == schema.Compound.compound_id)
+        .join(schema.Adduct,
+              schema.MeasuredCompound.adduct_id == schema.Adduct.adduct_id)
+        .where(
+            schema.Adduct.ion_mode == ion_mode,
+            schema.Compound.type.is_not_distinct_from(type_)
+        )
+        .order_by(query_index, schema.MeasuredCompound.measured_compound_id)
+    )
+    for row in rows:
+        results[row.query_index].append(row)
+    return results
+
+
 def create_retention_times(
     db: Session, 
     retention_times: list[pydantic_models.RetentionTimeCreate]
@@ -381,10 +1077,12 @@ def create_retention_times(
         list[schema.RetentionTime]: A list of the created retention time 
         objects with refreshed state from the database.
     """
+    row_version = next_row_version(db)
     db_rts = [
         schema.RetentionTime(
             retention_time=rt.retention_time,
-            comment=rt.comment
+            comment=rt.comment,
+            row_version=row_version
         )
         for rt in retention_times
     ]
@@ -395,7 +1093,36 @@ def create_retention_times(
     
     return db_rts
 
-def get_retention_times(db: Session, skip: int = 0, limit: int = 100):
+def iter_retention_times(
+    db: Session,
+    skip: int = 0,
+    limit: int | None = 100,
+    batch_size: int = config.READ_BATCH_SIZE
+    ) -> Iterator[list[dict]]:
+    """
+    Streams the retention times of `get_retention_times` in batches.
+
+    Yields:
+        list[dict]: Retention times with the fields of
+        `pydantic_models.RetentionTime`, ordered by retention time ID.
+    """
+    query = (select(
+                 schema.RetentionTime.retention_time_id,
+                 schema.RetentionTime.retention_time,
+                 schema.RetentionTime.comment
+             )
+             .order_by(schema.RetentionTime.retention_time_id)
+             .offset(skip)
+             .limit(limit)
+    )
+    yield from _stream_rows(db, query, batch_size)
+
+
+def get_retention_times(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100
+    ) -> list[dict]:
     """
     Retrieve retention times from the database with optional pagination.
 
@@ -406,9 +1133,12 @@ def get_retention_times(db: Session, skip: int = 0, limit: int = 100):
         Defaults to 100.
 
     Returns:
-        List[RetentionTime]: A list of retention time records.
+        list[dict]: Retention times with the fields of
+        `pydantic_models.RetentionTime`.
     """
-    return db.query(schema.RetentionTime).offset(skip).limit(limit).all()
+    return [
+        rt for batch in iter_retention_times(db, skip, limit) for rt in batch
+    ]
 
 def get_retention_time_by_value_comment(
     db: Session, 
@@ -434,4 +1164,114 @@ def get_retention_time_by_value_comment(
                 )
                 .first()
     )
-    return result
\ No newline at end of file
+    return result
+
+
+def create_spectra(db: Session, spectra_in: list[pydantic_models.SpectrumCreate]):
+    """
+    Create and add multiple MS/MS spectra to the database in one statement.
+
+    Spectra without precursor m/z get the theoretical m/z of their measured
+    compound, the compound mass plus the mass adjustment of the adduct.
+
+    Args:
+        db (Session): SQLAlchemy database session.
+        spectra_in (list[pydantic_models.SpectrumCreate]): The spectra.
+
+    Returns:
+        list[dict]: The created spectra without peaks.
+
+    Raises:
+        ValueError: If a measured compound does not exist, its precursor m/z
+        is unknown or the peaks are invalid.
+    """
+    ids = {s.measured_compound_id for s in spectra_in}
+    precursors = dict(db.execute(
+        select(
+            schema.MeasuredCompound.measured_compound_id,
+            schema.Compound.monoisotopic_mass + schema.Adduct.mass_adjustment
+        )
+        .join(schema.Compound, schema.MeasuredCompound.compound_id
+              == schema.Compound.compound_id)
+        .join(schema.Adduct, schema.MeasuredCompound.adduct_id
+              == schema.Adduct.adduct_id)
+        .where(schema.MeasuredCompound.measured_compound_id.in_(ids))
+    ).all())
+    missing = ids - precursors.keys()
+    if missing:
+        raise ValueError(f"Unknown measured compounds: {sorted(missing)}")
+
+    rows = []
+    for i, spectrum in enumerate(spectra_in):
+        precursor_mz = spectrum.precursor_mz
+        if precursor_mz is None:
+            precursor_mz = precursors[spectrum.measured_compound_id]
+        if precursor_mz is None:
+            raise ValueError(
+                f"Spectrum {i}: the precursor m/z is unknown, the formula of "
+                f"measured compound {spectrum.measured_compound_id} could not "
+                "be parsed."
+            )
+        try:
+            mz, intensity = spectra.encode_peaks(
+                spectrum.mz, spectrum.intensity
+            )
+        except ValueError as e:
+            raise ValueError(f"Spectrum {i}: {e}")
+        rows.append({
+            "measured_compound_id": spectrum.measured_compound_id,
+            "precursor_mz": precursor_mz,
+            "collision_energy": spectrum.collision_energy,
+            "n_peaks": len(spectrum.mz),
+            "mz": mz,
+            "intensity": intensity,
+        })
+    if not rows:
+        return []
+
+    table = schema.Spectrum.__table__
+    spectrum_ids = db.scalars(
+        insert(table).returning(table.c.spectrum_id,
+                                sort_by_parameter_order=True),
+        rows
+    ).all()
+    db.commit()
+    return [
+        {
+            "spectrum_id": spectrum_id,
+            "measured_compound_id": row["measured_compound_id"],
+            "precursor_mz": row["precursor_mz"],
+            "collision_energy": row["collision_energy"],
+            "n_peaks": row["n_peaks"],
+        }
+        for spectrum_id, row in zip(spectrum_ids, rows)
+    ]
+
+
+def get_spectra(
+    db: Session,
+    measured_compound_id: int | None = None,
+    skip: int = 0,
+    limit: int = 100
+    ):
+    """
+    Retrieve MS/MS spectra with their peaks from the database.
+
+    Args:
+        db (Session): The database session to use for the query.
+        measured_compound_id (int | None, optional): Only return spectra of
+        this measured compound. Defaults to None.
+        skip (int, optional): The number of records to skip. Defaults to 0.
+        limit (int, optional): The maximum number of records to return. 
+        Defaults to 100.
+
+    Returns:
+        list[schema.Spectrum]: The spectra ordered by spectrum ID.
+    """
+    query = db.query(schema.Spectrum)
+    if measured_compound_id is not None:
+        query = query.filter(
+            schema.Spectrum.measured_compound_id == measured_compound_id
+        )
+    return (query.order_by(schema.Spectrum.spectrum_id)
+                 .offset(skip).limit(limit).all())
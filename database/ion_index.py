@@ -0,0 +1,291 @@
+"""
+In-memory index of the (m/z, retention time) of all measured compounds of the
+API, kept up to date with the database.
+
+The index itself, `MeasuredIonIndex` over one `GridIndex` per ion mode, is in
+`database.grid_index`. The API keeps the index of all measured compounds in
+`measured_ion_index`, which `database.io` updates with every write instead of
+rebuilding it.
+"""
+import threading
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from . import config, library
+from .grid_index import MeasuredIonIndex, concat_ions, take_ions
+
+
+class LiveMeasuredIonIndex:
+    """
+    `MeasuredIonIndex` of the API that is kept up to date with the database
+    without rebuilding it.
+
+    The index consists of immutable segments: a base segment built from the
+    database at startup and a small delta segment per write, added by
+    `database.io` after the write committed. Queries search all segments.
+    When there are more than `max_segments`, a background thread merges them
+    into a new base segment, which replaces the merged segments atomically;
+    writes arriving meanwhile stay in their own segments. With a library
+    snapshot, the base segment is loaded from it and replaced whenever
+    another process publishes a new snapshot, see `rebase`.
+
+    Attributes:
+        ready (threading.Event): Set once the initial build finished.
+        version (int): Incremented with every change of the segments.
+    """
+    def __init__(self, mz_bin: float = 1.0, max_segments: int = 8):
+        self.mz_bin = mz_bin
+        self.max_segments = max_segments
+        self.ready = threading.Event()
+        self.version = 0
+        self._segments = ()
+        self._pending = []
+        self._started = False
+        self._merging = False
+        self._lock = threading.Lock()
+
+    def start(
+        self,
+        session_factory,
+        background: bool = True,
+        loader=None
+        ):
+        """
+        Builds the base segment from the database, in a background thread by
+        default. Writes during the build are applied after it.
+
+        Args:
+            session_factory (callable): Returns a new database session.
+            background (bool, optional): Whether to return immediately.
+            Defaults to True.
+            loader (callable, optional): Returns the columns of the base
+            segment instead of reading them from the database, e.g. from a
+            library snapshot.
+        """
+        with self._lock:
+            self._started = True
+            self._segments = ()
+            self._pending = []
+            self.ready.clear()
+        if background:
+            threading.Thread(
+                target=self._build, args=(session_factory, loader),
+                name="ion-index-build", daemon=True
+            ).start()
+        else:
+            self._build(session_factory, loader)
+
+    def stop(self):
+        with self._lock:
+            self._started = False
+            self._segments = ()
+            self._pending = []
+            self.ready.clear()
+
+    def _build(self, session_factory, loader=None):
+        if loader is not None:
+            ions = loader()
+        else:
+            with session_factory() as db:
+                ions = library.measured_ion_arrays(db)
+        base = MeasuredIonIndex(ions, mz_bin=self.mz_bin)
+        with self._lock:
+            # The build may have read writes that were also queued
+            self._segments = (base,) + self._missing_from(
+                ions["measured_compound_id"], self._pending
+            )
+            self._pending = []
+            self.version += 1
+            self.ready.set()
+        self._maybe_merge()
+
+    def _missing_from(self, known: np.ndarray, parts: list[dict]) -> tuple:
+        segments = []
+        for ions in parts:
+            rows = np.flatnonzero(
+                ~np.isin(ions["measured_compound_id"], known)
+            )
+            if len(rows):
+                segments.append(MeasuredIonIndex(
+                    take_ions(ions, rows), mz_bin=self.mz_bin
+                ))
+        return tuple(segments)
+
+    def rebase(self, ions: dict):
+        """
+        Replaces the segments with a new base segment, e.g. from a library
+        snapshot that includes the writes of other processes. Rows of the
+        current segments that `ions` lacks are kept. Does nothing before the
+        initial build finished.
+
+        Args:
+            ions (dict): The columns of the new base segment.
+        """
+        if not self.ready.is_set():
+            return
+        base = MeasuredIonIndex(ions, mz_bin=self.mz_bin)
+        with self._lock:
+            if not self.ready.is_set():
+                return
+            self._segments = (base,) + self._missing_from(
+                ions["measured_compound_id"],
+                [segment.ions for segment in self._segments]
+            )
+            self.version += 1
+        self._maybe_merge()
+
+    def add(self, ions: dict):
+        """
+        Adds new measured compounds as a delta segment, skipping those
+        already indexed: a write committed before the build read the
+        database may only be added after the build.
+
+        Args:
+            ions (dict): Their columns as returned by
+            `library.measured_ion_arrays`.
+        """
+        if len(ions["measured_compound_id"]) == 0:
+            return
+        with self._lock:
+            if not self._started:
+                return
+            if not self.ready.is_set():
+                self._pending.append(ions)
+                return
+            ids = np.asarray(ions["measured_compound_id"])
+            indexed = np.zeros(len(ids), dtype=bool)
+            for segment in self._segments:
+                indexed |= segment.contains(ids)
+            if indexed.all():
+                return
+            if indexed.any():
+                ions = take_ions(ions, np.flatnonzero(~indexed))
+            self._segments = self._segments + (
+                MeasuredIonIndex(ions, mz_bin=self.mz_bin),
+            )
+            self.version += 1
+        self._maybe_merge()
+
+    def add_measured_compounds(self, db: Session, measured_compound_ids):
+        """
+        Loads the ions of newly committed measured compounds and adds them.
+        Does nothing if the index was not started.
+        """
+        if not self._started or not measured_compound_ids:
+            return
+        self.add(library.measured_ion_arrays(
+            db, measured_compound_ids=measured_compound_ids
+        ))
+
+    def _maybe_merge(self):
+        with self._lock:
+            if self._merging or len(self._segments) <= self.max_segments:
+                return
+            self._merging = True
+            merged = self._segments
+        threading.Thread(
+            target=self._merge, args=(merged,), name="ion-index-merge",
+            daemon=True
+        ).start()
+
+    def _merge(self, merged: tuple):
+        try:
+            base = MeasuredIonIndex(
+                concat_ions([segment.ions for segment in merged]),
+                mz_bin=self.mz_bin
+            )
+            with self._lock:
+                # Segments may only have been appended since the snapshot,
+                # unless the index was restarted
+                if self._segments[:len(merged)] == merged:
+                    self._segments = (base,) + self._segments[len(merged):]
+                    self.version += 1
+        finally:
+            with self._lock:
+                self._merging = False
+
+    def segments(self) -> tuple:
+        return self._segments
+
+    def __len__(self):
+        return sum(len(segment) for segment in self._segments)
+
+    def ions(self) -> dict:
+        """
+        Returns the columns of all indexed measured compounds.
+        """
+        segments = self._segments
+        if not segments:
+            return library.empty_measured_ion_arrays()
+        return concat_ions([segment.ions for segment in segments])
+
+    def match(
+        self,
+        ion_mode: str,
+        mz: np.ndarray,
+        retention_time: np.ndarray,
+        ppm: float = 5.0,
+        mz_tolerance: float | None = None,
+        rt_tolerance: float | None = None
+        ) -> tuple[np.ndarray, dict]:
+        """
+        Matches features against all segments, see `MeasuredIonIndex.match`.
+
+        Returns:
+            tuple[np.ndarray, dict]: The feature index of every match and the
+            columns of the matched measured compounds, ordered by feature.
+        """
+        features, parts = [], []
+        for segment in self._segments:
+            f, rows = segment.match(
+                ion_mode, mz, retention_time, ppm=ppm,
+                mz_tolerance=mz_tolerance, rt_tolerance=rt_tolerance
+            )
+            features.append(f)
+            parts.append(take_ions(segment.ions, rows))
+        if not parts:
+            return (np.empty(0, dtype=np.int64),
+                    library.empty_measured_ion_arrays())
+        features = np.concatenate(features)
+        matched = concat_ions(parts)
+        order = np.lexsort((matched["measured_compound_id"], features))
+        return features[order], take_ions(matched, order)
+
+    def check_consistency(self, db: Session, tolerance: float = 1e-9) -> dict:
+        """
+        Compares the index with the measured compounds in the database.
+
+        Returns:
+            dict: The numbers of "indexed" and "database" rows and the ids
+            "missing" from the index, "unexpected" in the index, "duplicated"
+            in the index and "mismatched" in m/z, retention time or ion mode.
+        """
+        indexed = self.ions()
+        stored = library.measured_ion_arrays(db)
+        indexed_ids = indexed["measured_compound_id"]
+        stored_ids = stored["measured_compound_id"]
+        unique_ids, counts = np.unique(indexed_ids, return_counts=True)
+
+        common, i, j = np.intersect1d(indexed_ids, stored_ids,
+                                      return_indices=True)
+        mismatched = (
+            (np.abs(indexed["mz"][i] - stored["mz"][j]) > tolerance)
+            | (np.abs(indexed["retention_time"][i]
+                      - stored["retention_time"][j]) > tolerance)
+            | (np.array(indexed["ion_mode"], dtype=object)[i]
+               != np.array(stored["ion_mode"], dtype=object)[j])
+        )
+        return {
+            "indexed": len(indexed_ids),
+            "database": len(stored_ids),
+            "missing": np.setdiff1d(stored_ids, indexed_ids).tolist(),
+            "unexpected": np.setdiff1d(indexed_ids, stored_ids).tolist(),
+            "duplicated": unique_ids[counts > 1].tolist(),
+            "mismatched": common[mismatched].tolist(),
+        }
+
+
+measured_ion_index = LiveMeasuredIonIndex(
+    max_segments=config.ION_INDEX_MAX_SEGMENTS
+)
@@ -0,0 +1,397 @@
+"""
+Background jobs for imports too large for a single request.
+
+A job stores the submitted rows in the `jobs` table of the database, so no
+broker is needed. Every API process runs a `JobRunner` thread that claims
+queued jobs with a conditional UPDATE, so each job is processed by one
+process only. A job is processed in chunks of `config.JOB_CHUNK_SIZE` rows;
+each chunk is imported with the same functions as the synchronous endpoints
+and its progress and invalid rows are committed before the next one starts.
+If a process dies, the job stops making progress and is taken over by
+another runner after `config.JOB_STALE_AFTER_S` seconds, resuming after the
+last committed chunk. A job hitting a database error such as a lock timeout
+is queued again and resumed the same way; other errors fail the job.
+"""
+import json
+import os
+import socket
+import threading
+import time
+import zlib
+
+import pydantic
+from sqlalchemy import delete, func, insert, or_, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from . import config, io, pydantic_models, schema
+
+
+def _import_compounds(db: Session, rows: list) -> tuple[int, list]:
+    new = [
+        compound for compound in rows
+        if not io.get_compound_by_compound_name(db, compound.compound_name)
+    ]
+    return len(io.create_compounds(db, new)), []
+
+
+def _import_adducts(db: Session, rows: list) -> tuple[int, list]:
+    new = [
+        adduct for adduct in rows
+        if not io.get_adduct_by_adduct_name(db, adduct.adduct_name)
+    ]
+    return len(io.create_adducts(db, new)), []
+
+
+def _import_measured_compounds(db: Session, rows: list) -> tuple[int, list]:
+    error = "The compound or adduct does not exist."
+    try:
+        prepared = io.prepare_measured_compounds_create(db, rows)
+    except ValueError:
+        return 0, [(row, error) for row in rows]
+    return (
+        len(io.create_measured_compounds(db, prepared["valid"])),
+        [(row, error) for row in prepared["invalid"]]
+    )
+
+
+# The model of the rows and the function importing a chunk of them, which
+# returns the number of created rows and the rejected rows with the reason
+JOB_KINDS = {
+    "compounds": (pydantic_models.CompoundCreate, _import_compounds),
+    "adducts": (pydantic_models.AdductCreate, _import_adducts),
+    "measured_compounds": (
+        pydantic_models.MeasuredCompoundClient, _import_measured_compounds
+    ),
+}
+
+
+def import_chunk(
+    db: Session,
+    kind: str,
+    rows: list,
+    offset: int = 0
+    ) -> tuple[int, list[tuple[int, object, str]]]:
+    """
+    Validates and imports a chunk of rows of a job or upload.
+
+    Args:
+        db (Session): The database session to use for the operation.
+        kind (str): One of `JOB_KINDS`.
+        rows (list): The rows as parsed from JSON.
+        offset (int, optional): The position of the first row, used for the
+        row indices of the invalid rows. Defaults to 0.
+
+    Returns:
+        tuple[int, list[tuple[int, object, str]]]: The number of created rows
+        and the row index, row and error of every invalid row.
+    """
+    model, import_rows = JOB_KINDS[kind]
+    valid, positions, invalid = [], {}, []
+    for row_index, row in enumerate(rows, start=offset):
+        try:
+            parsed = model.model_validate(row)
+        except pydantic.ValidationError as e:
+            invalid.append((row_index, row, str(e)))
+            continue
+        positions[id(parsed)] = row_index
+        valid.append(parsed)
+
+    n_created, rejected = import_rows(db, valid) if valid else (0, [])
+    for parsed, error in rejected:
+        row_index = positions[id(parsed)]
+        invalid.append((row_index, rows[row_index - offset], error))
+    invalid.sort(key=lambda item: item[0])
+    return n_created, invalid
+
+
+def submit_job(db: Session, kind: str, body: bytes) -> schema.Job:
+    """
+    Stores a JSON list of rows as a queued job.
+
+    Args:
+        db (Session): The database session to use for the operation.
+        kind (str): One of `JOB_KINDS`.
+        body (bytes): The rows as JSON list.
+
+    Returns:
+        schema.Job: The queued job.
+
+    Raises:
+        ValueError: If the kind is unknown or the body is not a JSON list.
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind '{kind}'.")
+    try:
+        rows = json.loads(body)
+    except ValueError:
+        raise ValueError("The body is not valid JSON.")
+    if not isinstance(rows, list):
+        raise ValueError("The body must be a JSON list of rows.")
+    now = time.time()
+    job = schema.Job(
+        kind=kind,
+        status="queued",
+        payload=zlib.compress(body),
+        total_rows=len(rows),
+        processed_rows=0,
+        created_rows=0,
+        invalid_count=0,
+        created_at=now,
+        updated_at=now
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def get_job_status(
+    db: Session,
+    job_id: int,
+    invalid_limit: int = 1000
+    ) -> dict | None:
+    """
+    Returns the progress of a job.
+
+    Args:
+        db (Session): The database session to use for the query.
+        job_id (int): The job.
+        invalid_limit (int, optional): The maximum number of invalid rows to
+        return. Defaults to 1000.
+
+    Returns:
+        dict | None: The fields of `pydantic_models.JobStatus`, None if the
+        job does not exist.
+    """
+    job = db.get(schema.Job, job_id)
+    if job is None:
+        return None
+    invalid_rows = db.execute(
+        select(
+            schema.JobInvalidRow.row_index,
+            schema.JobInvalidRow.data,
+            schema.JobInvalidRow.error
+        )
+        .where(schema.JobInvalidRow.job_id == job_id)
+        .order_by(schema.JobInvalidRow.row_index)
+        .limit(invalid_limit)
+    ).all()
+    end = job.finished_at or job.updated_at
+    elapsed = end - job.started_at if job.started_at and end else None
+    return {
+        "job_id": job.job_id,
+        "kind": job.kind,
+        "status": job.status,
+        "total_rows": job.total_rows,
+        "processed_rows": job.processed_rows,
+        "created_rows": job.created_rows,
+        "invalid_count": job.invalid_count,
+        "progress": (
+            job.processed_rows / job.total_rows if job.total_rows else 1.0
+        ),
+        "rows_per_second": (
+            job.processed_rows / elapsed if elapsed else None
+        ),
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "error": job.error,
+        "invalid_rows": [
+            {"row_index": row_index, "row": json.loads(data), "error": error}
+            for row_index, data, error in invalid_rows
+        ],
+    }
+
+
+class JobRunner:
+    """
+    Thread processing the queued jobs of the database one at a time.
+
+    Attributes:
+        chunk_size (int): The number of rows committed at once.
+        poll_interval (float): Seconds between looking for new jobs.
+        stale_after (float): Seconds without progress after which a running
+        job is taken over.
+        worker (str): Identifies this process in the jobs it claims.
+    """
+    def __init__(
+        self,
+        chunk_size: int = config.JOB_CHUNK_SIZE,
+        poll_interval: float = config.JOB_POLL_INTERVAL_S,
+        stale_after: float = config.JOB_STALE_AFTER_S
+        ):
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._session_factory = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    def start(self, session_factory):
+        """
+        Starts the thread. It also resumes jobs left running by a process
+        that died, once they are stale.
+        """
+        if self._thread is not None:
+            return
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._session_factory = session_factory
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._loop, name="job-runner", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None):
+        """
+        Stops the thread after the current chunk. The job continues in the
+        next process that starts a runner.
+        """
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def wake(self):
+        """
+        Looks for jobs immediately, e.g. after a submission.
+        """
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            try:
+                job_id = self._claim()
+            except OperationalError:
+                # E.g. the database stayed locked by a long write; the
+                # runner must not die, so try again after the interval
+                job_id = None
+            if job_id is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            self._run(job_id)
+
+    def _claim(self) -> int | None:
+        jobs = schema.Job.__table__
+        now = time.time()
+        claimable = or_(
+            jobs.c.status == "queued",
+            (jobs.c.status == "running")
+            & (jobs.c.updated_at < now - self.stale_after)
+        )
+        with self._session_factory() as db:
+            job_id = db.execute(
+                select(jobs.c.job_id).where(claimable)
+                .order_by(jobs.c.job_id).limit(1)
+            ).scalar()
+            if job_id is None:
+                return None
+            # Only one process wins the update
+            claimed = db.execute(
+                update(jobs)
+                .where(jobs.c.job_id == job_id, claimable)
+                .values(
+                    status="running", worker=self.worker, updated_at=now,
+                    started_at=func.coalesce(jobs.c.started_at, now)
+                )
+            ).rowcount
+            db.commit()
+        return job_id if claimed else None
+
+    def _run(self, job_id: int):
+        with self._session_factory() as db:
+            try:
+                self._process(db, db.get(schema.Job, job_id))
+            except OperationalError:
+                # E.g. a chunk commit found the database locked: keep the
+                # payload and queue the job again, so the next poll resumes
+                # it after the last committed chunk
+                db.rollback()
+                self._set_status(db, job_id, status="queued")
+            except Exception as e:
+                db.rollback()
+                self._set_status(
+                    db, job_id, status="failed", error=str(e),
+                    finished_at=time.time(), payload=None
+                )
+
+    def _set_status(self, db: Session, job_id: int, **values):
+        try:
+            db.execute(
+                update(schema.Job)
+                .where(schema.Job.job_id == job_id,
+                       schema.Job.worker == self.worker)
+                .values(**values)
+            )
+            db.commit()
+        except OperationalError:
+            # The job stays running and is taken over once it is stale
+            db.rollback()
+
+    def _process(self, db: Session, job: schema.Job):
+        rows = json.loads(zlib.decompress(job.payload))
+        job_id, start = job.job_id, job.processed_rows
+        for chunk_start in range(start, len(rows), self.chunk_size):
+            if self._stopped.is_set():
+                # Hand the job to the next runner without waiting until it
+                # is stale
+                db.execute(
+                    update(schema.Job)
+                    .where(schema.Job.job_id == job_id,
+                           schema.Job.worker == self.worker)
+                    .values(status="queued")
+                )
+                db.commit()
+                return
+            chunk = rows[chunk_start:chunk_start + self.chunk_size]
+            n_created, invalid = import_chunk(db, job.kind, chunk, chunk_start)
+
+            # A chunk processed again after a takeover replaces its rows
+            db.execute(
+                delete(schema.JobInvalidRow).where(
+                    schema.JobInvalidRow.job_id == job_id,
+                    schema.JobInvalidRow.row_index >= chunk_start,
+                    schema.JobInvalidRow.row_index
+                    < chunk_start + len(chunk)
+                )
+            )
+            if invalid:
+                db.execute(insert(schema.JobInvalidRow), [
+                    {"job_id": job_id, "row_index": row_index,
+                     "data": json.dumps(row), "error": error}
+                    for row_index, row, error in invalid
+                ])
+            still_ours = db.execute(
+                update(schema.Job)
+                .where(schema.Job.job_id == job_id,
+                       schema.Job.worker == self.worker)
+                .values(
+                    processed_rows=chunk_start + len(chunk),
+                    created_rows=schema.Job.created_rows + n_created,
+                    invalid_count=schema.Job.invalid_count + len(invalid),
+                    updated_at=time.time()
+                )
+            ).rowcount
+            if not still_ours:
+                # Another process took the job over
+                db.rollback()
+                return
+            db.commit()
+
+        db.execute(
+            update(schema.Job)
+            .where(schema.Job.job_id == job_id,
+                   schema.Job.worker == self.worker)
+            .values(status="succeeded", finished_at=time.time(),
+                    payload=None)
+        )
+        db.commit()
+
+
+job_runner = JobRunner()
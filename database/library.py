@@ -0,0 +1,217 @@
+"""
+Columnar (NumPy) views of the compound library for vectorized computations.
+"""
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import schema
+
+
+def compound_arrays(db: Session, compound_type: str | None = None) -> dict:
+    """
+    Loads the compounds with a known monoisotopic mass as columns.
+
+    Args:
+        db (Session): The database session to use for the query.
+        compound_type (str | None, optional): Only load compounds of this type.
+
+    Returns:
+        dict: Arrays "compound_id" and "mass" and lists "compound_name",
+        "type" and "molecular_formula", all in the same order.
+    """
+    query = (
+        select(
+            schema.Compound.compound_id,
+            schema.Compound.compound_name,
+            schema.Compound.type,
+            schema.Compound.monoisotopic_mass,
+            schema.Compound.molecular_formula
+        )
+        .where(schema.Compound.monoisotopic_mass.is_not(None))
+        .order_by(schema.Compound.compound_id)
+    )
+    if compound_type:
+        query = query.where(schema.Compound.type == compound_type)
+    rows = db.execute(query).all()
+    return {
+        "compound_id": np.array([r[0] for r in rows], dtype=np.int64),
+        "compound_name": [r[1] for r in rows],
+        "type": [r[2] for r in rows],
+        "mass": np.array([r[3] for r in rows], dtype=np.float64),
+        "molecular_formula": [r[4] for r in rows],
+    }
+
+
+def adduct_arrays(db: Session, ion_mode: str | None = None) -> dict:
+    """
+    Loads the adducts as columns.
+
+    Returns:
+        dict: Arrays "adduct_id" and "mass_adjustment" and lists 
+        "adduct_name" and "ion_mode", all in the same order.
+    """
+    query = select(
+        schema.Adduct.adduct_id,
+        schema.Adduct.adduct_name,
+        schema.Adduct.ion_mode,
+        schema.Adduct.mass_adjustment
+    ).order_by(schema.Adduct.adduct_id)
+    if ion_mode:
+        query = query.where(schema.Adduct.ion_mode == ion_mode)
+    rows = db.execute(query).all()
+    return {
+        "adduct_id": np.array([r[0] for r in rows], dtype=np.int64),
+        "adduct_name": [r[1] for r in rows],
+        "ion_mode": [r[2] for r in rows],
+        "mass_adjustment": np.array([r[3] for r in rows], dtype=np.float64),
+    }
+
+
+def library_ions(
+    db: Session,
+    ion_mode: str | None = None,
+    compound_type: str | None = None
+    ) -> dict:
+    """
+    Builds the theoretical ions of every compound with every adduct.
+
+    Args:
+        db (Session): The database session to use for the query.
+        ion_mode (str | None, optional): Only use adducts of this ion mode.
+        compound_type (str | None, optional): Only use compounds of this type.
+
+    Returns:
+        dict: "compounds" and "adducts" as returned by `compound_arrays` and
+        `adduct_arrays` and the flat ion arrays "compound_index" and 
+        "adduct_index" (positions in these) and "mz".
+    """
+    return combine_ions(
+        compound_arrays(db, compound_type), adduct_arrays(db, ion_mode)
+    )
+
+
+def combine_ions(compounds: dict, adducts: dict) -> dict:
+    """
+    Combines every compound with every adduct, see `library_ions`.
+    """
+    n_compounds = len(compounds["compound_id"])
+    n_adducts = len(adducts["adduct_id"])
+    compound_index = np.repeat(np.arange(n_compounds), n_adducts)
+    adduct_index = np.tile(np.arange(n_adducts), n_compounds)
+    mz = compounds["mass"][compound_index] \
+        + adducts["mass_adjustment"][adduct_index]
+    return {
+        "compounds": compounds,
+        "adducts": adducts,
+        "compound_index": compound_index,
+        "adduct_index": adduct_index,
+        "mz": mz,
+    }
+
+
+def measured_ion_arrays(
+    db: Session,
+    ion_mode: str | None = None,
+    measured_compound_ids: list[int] | None = None
+    ) -> dict:
+    """
+    Loads the measured compounds with the theoretical m/z of their ion, the
+    compound mass plus the mass adjustment of the adduct, as columns.
+
+    Args:
+        db (Session): The database session to use for the query.
+        ion_mode (str | None, optional): Only load measured compounds with
+        adducts of this ion mode.
+        measured_compound_ids (list[int] | None, optional): Only load these
+        measured compounds.
+
+    Returns:
+        dict: Arrays "measured_compound_id", "compound_id", "adduct_id",
+        "retention_time_id", "mz" and "retention_time" and lists
+        "compound_name", "adduct_name", "ion_mode" and
+        "retention_time_comment", all in the same order.
+    """
+    query = (
+        select(
+            schema.MeasuredCompound.measured_compound_id,
+            schema.MeasuredCompound.compound_id,
+            schema.Compound.compound_name,
+            schema.Adduct.adduct_name,
+            schema.Adduct.ion_mode,
+            (
+                schema.Compound.monoisotopic_mass
+                + schema.Adduct.mass_adjustment
+            ),
+            schema.RetentionTime.retention_time,
+            schema.RetentionTime.comment,
+            schema.MeasuredCompound.adduct_id,
+            schema.MeasuredCompound.retention_time_id
+        )
+        .join(schema.Compound, schema.MeasuredCompound.compound_id
+              == schema.Compound.compound_id)
+        .join(schema.Adduct, schema.MeasuredCompound.adduct_id
+              == schema.Adduct.adduct_id)
+        .join(schema.RetentionTime, schema.MeasuredCompound.retention_time_id
+              == schema.RetentionTime.retention_time_id)
+        .where(schema.Compound.monoisotopic_mass.is_not(None))
+        .order_by(schema.MeasuredCompound.measured_compound_id)
+    )
+    if ion_mode:
+        query = query.where(schema.Adduct.ion_mode == ion_mode)
+    if measured_compound_ids is not None:
+        query = query.where(
+            schema.MeasuredCompound.measured_compound_id.in_(
+                measured_compound_ids
+            )
+        )
+    rows = db.execute(query).all()
+    return {
+        "measured_compound_id": np.array([r[0] for r in rows], dtype=np.int64),
+        "compound_id": np.array([r[1] for r in rows], dtype=np.int64),
+        "compound_name": [r[2] for r in rows],
+        "adduct_name": [r[3] for r in rows],
+        "ion_mode": [r[4] for r in rows],
+        "mz": np.array([r[5] for r in rows], dtype=np.float64),
+        "retention_time": np.array([r[6] for r in rows], dtype=np.float64),
+        "retention_time_comment": [r[7] for r in rows],
+        "adduct_id": np.array([r[8] for r in rows], dtype=np.int64),
+        "retention_time_id": np.array([r[9] for r in rows], dtype=np.int64),
+    }
+
+
+def empty_measured_ion_arrays() -> dict:
+    return {
+        "measured_compound_id": np.empty(0, dtype=np.int64),
+        "compound_id": np.empty(0, dtype=np.int64),
+        "compound_name": [],
+        "adduct_name": [],
+        "ion_mode": [],
+        "mz": np.empty(0, dtype=np.float64),
+        "retention_time": np.empty(0, dtype=np.float64),
+        "retention_time_comment": [],
+        "adduct_id": np.empty(0, dtype=np.int64),
+        "retention_time_id": np.empty(0, dtype=np.int64),
+    }
+
+
+def retention_time_arrays(db: Session) -> dict:
+    """
+    Loads the retention times as columns.
+
+    Returns:
+        dict: Arrays "retention_time_id" and "retention_time" and the list
+        "comment", all in the same order.
+    """
+    rows = db.execute(
+        select(
+            schema.RetentionTime.retention_time_id,
+            schema.RetentionTime.retention_time,
+            schema.RetentionTime.comment
+        ).order_by(schema.RetentionTime.retention_time_id)
+    ).all()
+    return {
+        "retention_time_id": np.array([r[0] for r in rows], dtype=np.int64),
+        "retention_time": np.array([r[1] for r in rows], dtype=np.float64),
+        "comment": [r[2] for r in rows],
+    }
@@ -0,0 +1,137 @@
+"""
+Creates and upgrades the database schema.
+
+The API runs this at startup. It can also be run on its own before starting
+the workers:
+
+    python -m database.migrate
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from . import io, schema
+from .database import engine
+
+
+def add_missing_columns(bind: Engine):
+    """
+    Adds columns that were added to the models after their tables had been
+    created. Only nullable columns without server defaults can be added this
+    way, which is what all later additions to the schema are.
+    """
+    inspector = inspect(bind)
+    with bind.begin() as connection:
+        for table in schema.Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=bind.dialect)
+                connection.execute(text(
+                    f'ALTER TABLE {table.name} '
+                    f'ADD COLUMN {column.name} {column_type}'
+                ))
+
+
+def create_missing_indexes(bind: Engine):
+    for table in schema.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+
+# Indexes of the compound names for `io.search_compounds`: a NOCASE index for
+# prefixes and a trigram full-text index for any part of a name. The latter
+# stores no copy of the names; triggers keep it in sync with every insert,
+# update and delete of a compound, whichever code path writes it
+NAME_INDEX_DDL = (
+    """
+    CREATE INDEX IF NOT EXISTS ix_compounds_compound_name_nocase
+    ON compounds (compound_name COLLATE NOCASE)
+    """,
+    """
+    CREATE VIRTUAL TABLE compound_names_fts USING fts5(
+        compound_name, content='compounds', content_rowid='compound_id',
+        tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS compound_names_fts_insert
+    AFTER INSERT ON compounds BEGIN
+        INSERT INTO compound_names_fts(rowid, compound_name)
+        VALUES (new.compound_id, new.compound_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS compound_names_fts_delete
+    AFTER DELETE ON compounds BEGIN
+        INSERT INTO compound_names_fts(
+            compound_names_fts, rowid, compound_name
+        ) VALUES ('delete', old.compound_id, old.compound_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS compound_names_fts_update
+    AFTER UPDATE OF compound_name ON compounds BEGIN
+        INSERT INTO compound_names_fts(
+            compound_names_fts, rowid, compound_name
+        ) VALUES ('delete', old.compound_id, old.compound_name);
+        INSERT INTO compound_names_fts(rowid, compound_name)
+        VALUES (new.compound_id, new.compound_name);
+    END
+    """,
+)
+
+
+def create_name_index(bind: Engine) -> bool:
+    """
+    Creates the indexes of the compound names and fills them with the
+    existing compounds. Without SQLite or its FTS5 extension, the name
+    search falls back to LIKE queries.
+
+    Returns:
+        bool: Whether the indexes exist.
+    """
+    if bind.dialect.name != "sqlite":
+        return False
+    if inspect(bind).has_table("compound_names_fts"):
+        return True
+    try:
+        with bind.begin() as connection:
+            for statement in NAME_INDEX_DDL:
+                connection.execute(text(statement))
+            connection.execute(text(
+                "INSERT INTO compound_names_fts(compound_names_fts) "
+                "VALUES ('rebuild')"
+            ))
+    except OperationalError:
+        # SQLite was built without FTS5 or is older than 3.34 (trigrams)
+        return False
+    return True
+
+
+def init_db(bind: Engine = engine):
+    """
+    Creates all tables and indexes of the schema that do not exist yet, adds
+    new columns to existing tables, creates the compound name index and
+    backfills derived data and row versions.
+
+    Args:
+        bind (Engine, optional): The engine of the database. Defaults to the
+        engine of `database.database`.
+    """
+    schema.Base.metadata.create_all(bind=bind)
+    add_missing_columns(bind)
+    create_missing_indexes(bind)
+    create_name_index(bind)
+    with Session(bind=bind) as db:
+        io.backfill_compositions(db)
+        io.backfill_mass_defects(db)
+        io.backfill_row_versions(db)
+
+
+if __name__ == "__main__":
+    init_db()
@@ -0,0 +1,232 @@
+import asyncio
+import collections
+import contextvars
+import functools
+import inspect
+import itertools
+import sys
+import threading
+import time
+
+from fastapi.routing import APIRoute
+
+from . import config
+
+_active_profile = contextvars.ContextVar("active_profile", default=None)
+_profile_ids = itertools.count(1)
+
+
+class RequestProfile:
+    """
+    Sampling call-stack profile of a single request.
+
+    A background thread periodically snapshots the stacks of all threads that
+    work on the request (the threadpool thread running a sync endpoint, or
+    the event loop thread running an async endpoint) and counts identical
+    stacks. The event loop thread also runs the other requests, so it is
+    only sampled while it runs the task of the endpoint.
+
+    Attributes:
+        profile_id (int): Sequential identifier of the profile.
+        method (str): HTTP method of the request.
+        path (str): URL path of the request.
+        duration_s (float | None): Wall-clock duration once stopped.
+        stacks (collections.Counter): Sample counts per stack, each stack being
+        a tuple of frame labels from the outermost to the innermost frame.
+    """
+    def __init__(self, method: str, path: str, interval_s: float):
+        self.profile_id = next(_profile_ids)
+        self.method = method
+        self.path = path
+        self.interval_s = interval_s
+        self.started_at = time.time()
+        self.duration_s = None
+        self.stacks = collections.Counter()
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(
+            target=self._run, name=f"profiler-{self.profile_id}", daemon=True
+        )
+        self._t0 = time.perf_counter()
+
+    def add_thread(self, thread_id: int, task: asyncio.Task | None = None):
+        """
+        Samples a thread, only while it runs `task` if given.
+        """
+        with self._lock:
+            self._threads[thread_id] = task
+
+    def remove_thread(self, thread_id: int):
+        with self._lock:
+            self._threads.pop(thread_id, None)
+
+    def start(self):
+        self._sampler.start()
+
+    def stop(self):
+        self.duration_s = time.perf_counter() - self._t0
+        self._stop.set()
+        self._sampler.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self._threads.items())
+            for thread_id, task in threads:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                if task is not None \
+                        and asyncio.current_task(task.get_loop()) is not task:
+                    continue
+                self.stacks[_stack_labels(frame)] += 1
+
+    @property
+    def n_samples(self) -> int:
+        return sum(self.stacks.values())
+
+    def summary(self) -> dict:
+        return {
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "duration_s": self.duration_s,
+            "n_samples": self.n_samples,
+        }
+
+    def collapsed(self) -> str:
+        """
+        Returns the profile in the collapsed stack format understood by
+        flamegraph.pl, speedscope and inferno: one line per unique stack with
+        semicolon separated frames followed by the sample count.
+        """
+        lines = [
+            f"{';'.join(stack)} {count}"
+            for stack, count in self.stacks.most_common()
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _stack_labels(frame) -> tuple:
+    labels = []
+    while frame is not None:
+        code = frame.f_code
+        module = frame.f_globals.get("__name__", "?")
+        labels.append(f"{module}:{code.co_qualname}")
+        frame = frame.f_back
+    return tuple(reversed(labels))
+
+
+class ProfileStore:
+    """
+    Bounded ring buffer holding the most recent slow request profiles.
+    """
+    def __init__(self, max_profiles: int):
+        self._profiles = collections.deque(maxlen=max_profiles)
+        self._lock = threading.Lock()
+
+    def add(self, profile: RequestProfile):
+        with self._lock:
+            self._profiles.append(profile)
+
+    def list(self) -> list[RequestProfile]:
+        with self._lock:
+            return list(self._profiles)
+
+    def get(self, profile_id: int) -> RequestProfile | None:
+        with self._lock:
+            for profile in self._profiles:
+                if profile.profile_id == profile_id:
+                    return profile
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+
+profile_store = ProfileStore(config.PROFILING_MAX_PROFILES)
+
+
+def profiling_requested(headers) -> bool:
+    """
+    Checks whether a request should be profiled, either because profiling is
+    enabled in the configuration or because the client opted in with the
+    profiling header.
+    """
+    if config.PROFILING_ENABLED:
+        return True
+    value = headers.get(config.PROFILING_HEADER, "")
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+async def profile_requests(request, call_next):
+    """
+    HTTP middleware sampling the call stacks of profiled requests and keeping
+    the profile of every request slower than the configured threshold.
+    """
+    if not profiling_requested(request.headers):
+        return await call_next(request)
+
+    profile = RequestProfile(
+        request.method, request.url.path, config.PROFILING_INTERVAL_S
+    )
+    token = _active_profile.set(profile)
+    profile.start()
+    try:
+        response = await call_next(request)
+    finally:
+        profile.stop()
+        _active_profile.reset(token)
+
+    if profile.duration_s >= config.PROFILING_THRESHOLD_S:
+        profile_store.add(profile)
+        response.headers["X-Profile-Id"] = str(profile.profile_id)
+    return response
+
+
+def _profiled(endpoint):
+    """
+    Wraps an endpoint so that the thread executing it is sampled by the
+    profile of the current request.
+    """
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            profile = _active_profile.get()
+            if profile is None:
+                return await endpoint(*args, **kwargs)
+            thread_id = threading.get_ident()
+            profile.add_thread(thread_id, asyncio.current_task())
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                profile.remove_thread(thread_id)
+
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        profile = _active_profile.get()
+        if profile is None:
+            return endpoint(*args, **kwargs)
+        thread_id = threading.get_ident()
+        profile.add_thread(thread_id)
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            profile.remove_thread(thread_id)
+
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """
+    APIRoute whose sync endpoints are sampled by the request profiler while
+    they run in the threadpool.
+    """
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _profiled(endpoint), **kwargs)
@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from . import config
 
 
 class CompoundBase(BaseModel):
@@ -177,4 +179,757 @@ class RetentionTime(RetentionTimeBase):
     retention_time_id: int
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+
+class MassQuery(BaseModel):
+    """
+    MassQuery is a Pydantic model representing a molecular formula whose mass
+    is to be computed, optionally as an ion with an adduct.
+
+    Attributes:
+        molecular_formula (str): The molecular formula.
+        adduct_name (Optional[str]): The name of an adduct in the database.
+    """
+    molecular_formula: str
+    adduct_name: str | None = None
+
+class MassResult(MassQuery):
+    """
+    MassResult is a Pydantic model holding the computed masses of a MassQuery.
+
+    Attributes:
+        mass (float): The monoisotopic mass of the molecular formula.
+        mz (float): The mass plus the mass adjustment of the adduct.
+    """
+    mass: float
+    mz: float
+
+class IsotopePeak(BaseModel):
+    """
+    IsotopePeak is a Pydantic model representing a peak of an isotope pattern.
+
+    Attributes:
+        mz (float): The mass of the peak including the adduct.
+        abundance (float): The abundance relative to the most abundant peak.
+    """
+    mz: float
+    abundance: float
+
+class IsotopePattern(MassQuery):
+    """
+    IsotopePattern is a Pydantic model holding the isotope pattern of a 
+    MassQuery.
+
+    Attributes:
+        peaks (list[IsotopePeak]): The peaks in order of increasing mass.
+    """
+    peaks: list[IsotopePeak]
+
+
+class CompoundMassDefect(Compound):
+    """
+    CompoundMassDefect extends Compound with its mass defects.
+
+    Attributes:
+        mass_defect (float): The mass defect of the monoisotopic mass.
+        kendrick_mass_defect (float): The Kendrick mass defect of the 
+        monoisotopic mass for the requested base.
+    """
+    mass_defect: float
+    kendrick_mass_defect: float
+
+class FeatureScreen(BaseModel):
+    """
+    FeatureScreen is a Pydantic model representing a mass defect screening
+    of a feature list.
+
+    Attributes:
+        mz (list[float]): The m/z values of the features.
+        base (str): The formula of the Kendrick base, e.g. "CH2" or "CF2".
+        min_mass_defect, max_mass_defect (Optional[float]): Mass defect bounds.
+        min_kmd, max_kmd (Optional[float]): Kendrick mass defect bounds.
+        min_mz, max_mz (Optional[float]): m/z bounds.
+    """
+    mz: list[float]
+    base: str = "CH2"
+    min_mass_defect: float | None = None
+    max_mass_defect: float | None = None
+    min_kmd: float | None = None
+    max_kmd: float | None = None
+    min_mz: float | None = None
+    max_mz: float | None = None
+
+class FeatureScreenResult(BaseModel):
+    """
+    FeatureScreenResult is a Pydantic model holding the features inside the
+    window of a FeatureScreen as parallel lists.
+
+    Attributes:
+        indices (list[int]): The positions of the features in the input.
+        mz (list[float]): The m/z values of the features.
+        mass_defect (list[float]): The mass defects of the features.
+        kendrick_mass_defect (list[float]): The Kendrick mass defects.
+    """
+    indices: list[int]
+    mz: list[float]
+    mass_defect: list[float]
+    kendrick_mass_defect: list[float]
+
+class LibraryIon(BaseModel):
+    """
+    LibraryIon is a Pydantic model representing the theoretical ion of a 
+    compound with an adduct.
+
+    Attributes:
+        compound_id (int): The unique identifier for the compound.
+        compound_name (str): The name of the compound.
+        adduct_name (str): The name of the adduct.
+        ion_mode (str): The ion mode of the adduct.
+        mz (float): The m/z of the ion.
+        mass_defect (float): The mass defect of the ion.
+        kendrick_mass_defect (float): The Kendrick mass defect of the ion.
+    """
+    compound_id: int
+    compound_name: str
+    adduct_name: str
+    ion_mode: str
+    mz: float
+    mass_defect: float
+    kendrick_mass_defect: float
+
+
+class MeasuredIon(BaseModel):
+    """
+    MeasuredIon is a Pydantic model representing the theoretical ion of a
+    measured compound.
+
+    Attributes:
+        measured_compound_id (int): The identifier of the measured compound.
+        compound_id (int): The unique identifier for the compound.
+        compound_name (str): The name of the compound.
+        adduct_name (str): The name of the adduct.
+        ion_mode (str): The ion mode of the adduct.
+        mz (float): The compound mass plus the mass adjustment of the adduct.
+        retention_time (float): The retention time of the measured compound.
+    """
+    measured_compound_id: int
+    compound_id: int
+    compound_name: str
+    adduct_name: str
+    ion_mode: str
+    mz: float
+    retention_time: float
+
+class FeatureMatchQuery(BaseModel):
+    """
+    FeatureMatchQuery is a Pydantic model representing a feature table to be 
+    matched against the measured compounds by m/z and retention time.
+
+    Attributes:
+        ion_mode (str): The ion mode of the features.
+        mz (list[float]): The m/z values of the features.
+        retention_time (list[float]): The retention times of the features.
+        ppm (float): The m/z tolerance in ppm.
+        mz_tolerance (Optional[float]): An absolute m/z tolerance in Da used
+        instead of `ppm`.
+        rt_tolerance (Optional[float]): The retention time tolerance, None to
+        match by m/z only.
+
+    The tolerances are limited by `config.MATCH_MAX_PPM`,
+    `config.MATCH_MAX_MZ_TOLERANCE` and `config.MATCH_MAX_RT_TOLERANCE`.
+    """
+    ion_mode: str
+    mz: list[float]
+    retention_time: list[float]
+    ppm: float = 5.0
+    mz_tolerance: float | None = None
+    rt_tolerance: float | None = 0.1
+
+class FeatureMatch(BaseModel):
+    """
+    FeatureMatch is a Pydantic model representing a measured compound inside
+    the window of a feature.
+
+    Attributes:
+        feature_index (int): The position of the feature in the query.
+        measured_compound_id (int): The identifier of the measured compound.
+        compound_id (int): The unique identifier for the compound.
+        compound_name (str): The name of the compound.
+        adduct_name (str): The name of the adduct.
+        mz (float): The theoretical m/z of the measured compound.
+        retention_time (float): The retention time of the measured compound.
+        ppm_error (float): The m/z deviation of the feature in ppm.
+        rt_error (float): The retention time deviation of the feature.
+    """
+    feature_index: int
+    measured_compound_id: int
+    compound_id: int
+    compound_name: str
+    adduct_name: str
+    mz: float
+    retention_time: float
+    ppm_error: float
+    rt_error: float
+
+class SpectrumBase(BaseModel):
+    """
+    SpectrumBase is a Pydantic model representing the metadata of a 
+    reference MS/MS spectrum.
+
+    Attributes:
+        measured_compound_id (int): The measured compound of the spectrum.
+        precursor_mz (Optional[float]): The precursor m/z, defaults to the
+        theoretical m/z of the measured compound.
+        collision_energy (Optional[float]): The collision energy.
+    """
+    measured_compound_id: int
+    precursor_mz: float | None = None
+    collision_energy: float | None = None
+
+class SpectrumCreate(SpectrumBase):
+    """
+    SpectrumCreate is a Pydantic model representing a spectrum to be 
+    uploaded.
+
+    Attributes:
+        mz (list[float]): The peak m/z values.
+        intensity (list[float]): The peak intensities.
+    """
+    mz: list[float]
+    intensity: list[float]
+
+class Spectrum(SpectrumBase):
+    """
+    Spectrum is a Pydantic model representing a stored spectrum without
+    peaks.
+
+    Attributes:
+        spectrum_id (int): The unique identifier for the spectrum.
+        precursor_mz (float): The precursor m/z.
+        n_peaks (int): The number of peaks.
+    """
+    spectrum_id: int
+    precursor_mz: float
+    n_peaks: int
+
+    class Config:
+        orm_mode = True
+
+class SpectrumPeaks(Spectrum):
+    """
+    SpectrumPeaks extends Spectrum with its peaks sorted by m/z.
+
+    Attributes:
+        mz (list[float]): The peak m/z values.
+        intensity (list[float]): The peak intensities.
+    """
+    mz: list[float]
+    intensity: list[float]
+
+class QuerySpectrum(BaseModel):
+    """
+    QuerySpectrum is a Pydantic model representing a measured MS/MS spectrum
+    to be searched against the reference spectra.
+
+    Attributes:
+        precursor_mz (float): The precursor m/z.
+        mz (list[float]): The peak m/z values.
+        intensity (list[float]): The peak intensities.
+    """
+    precursor_mz: float
+    mz: list[float]
+    intensity: list[float]
+
+class SpectrumSearch(BaseModel):
+    """
+    SpectrumSearch is a Pydantic model representing a batch of query spectra
+    and the search settings.
+
+    Attributes:
+        spectra (list[QuerySpectrum]): The query spectra.
+        method (str): "cosine" or "modified_cosine".
+        precursor_tolerance (float): The precursor m/z window in Da.
+        fragment_tolerance (float): The fragment m/z tolerance in Da.
+        top_k (int): The maximum number of hits per query.
+        min_score (float): The minimum similarity of a hit.
+        min_matched_peaks (int): The minimum number of matched peaks of a hit.
+    """
+    spectra: list[QuerySpectrum]
+    method: str = "cosine"
+    precursor_tolerance: float = Field(
+        0.02, ge=0, le=config.SPECTRUM_SEARCH_MAX_PRECURSOR_TOLERANCE
+    )
+    fragment_tolerance: float = 0.01
+    top_k: int = Field(5, ge=1, le=config.SPECTRUM_SEARCH_MAX_TOP_K)
+    min_score: float = 0.0
+    min_matched_peaks: int = 1
+
+class SpectrumHit(BaseModel):
+    """
+    SpectrumHit is a Pydantic model representing a reference spectrum
+    similar to a query spectrum.
+
+    Attributes:
+        spectrum_id (int): The identifier of the reference spectrum.
+        measured_compound_id (int): The measured compound of the spectrum.
+        compound_id (int): The compound of the measured compound.
+        compound_name (str): The name of the compound.
+        adduct_name (str): The name of the adduct.
+        precursor_mz (float): The precursor m/z of the reference spectrum.
+        score (float): The similarity between 0 and 1.
+        matched_peaks (int): The number of matched peaks.
+    """
+    spectrum_id: int
+    measured_compound_id: int
+    compound_id: int
+    compound_name: str
+    adduct_name: str
+    precursor_mz: float
+    score: float
+    matched_peaks: int
+
+class SpectrumSearchResult(BaseModel):
+    """
+    SpectrumSearchResult is a Pydantic model holding the hits of a query 
+    spectrum, best first.
+
+    Attributes:
+        query_index (int): The position of the query spectrum in the request.
+        hits (list[SpectrumHit]): The hits.
+    """
+    query_index: int
+    hits: list[SpectrumHit]
+
+class FormulaQuery(BaseModel):
+    """
+    FormulaQuery is a Pydantic model representing a measured m/z for which
+    candidate molecular formulas are to be generated.
+
+    Attributes:
+        mz (float): The measured m/z.
+        adduct_name (Optional[str]): The name of an adduct in the database,
+        None if `mz` is a neutral mass.
+        ppm (float): The mass tolerance in ppm.
+        element_bounds (Optional[dict[str, tuple[int, int]]]): Minimum and
+        maximum count per element, e.g. {"C": (0, 50), "Cl": (0, 4)}.
+        min_rdbe, max_rdbe (float): Ring and double bond equivalent bounds.
+        senior_rules (bool): Whether to apply the Senior rules.
+        heuristics (bool): Whether to apply element ratio heuristics.
+        max_candidates (int): The maximum number of candidates.
+    """
+    mz: float
+    adduct_name: str | None = None
+    ppm: float = 5.0
+    element_bounds: dict[str, tuple[int, int]] | None = None
+    min_rdbe: float = -0.5
+    max_rdbe: float = 40.0
+    senior_rules: bool = True
+    heuristics: bool = True
+    max_candidates: int = 20
+
+class FormulaCandidate(BaseModel):
+    """
+    FormulaCandidate is a Pydantic model representing a candidate molecular 
+    formula of a FormulaQuery.
+
+    Attributes:
+        molecular_formula (str): The molecular formula.
+        mass (float): The monoisotopic mass of the molecular formula.
+        mz (float): The mass plus the mass adjustment of the adduct.
+        ppm_error (float): The deviation of the measured m/z in ppm.
+        rdbe (float): The ring and double bond equivalent.
+    """
+    molecular_formula: str
+    mass: float
+    mz: float
+    ppm_error: float
+    rdbe: float
+
+class FormulaCandidates(BaseModel):
+    """
+    FormulaCandidates is a Pydantic model holding the candidates of a
+    FormulaQuery ordered by absolute mass error.
+
+    Attributes:
+        mz (float): The measured m/z.
+        adduct_name (Optional[str]): The name of the adduct.
+        candidates (list[FormulaCandidate]): The candidates.
+    """
+    mz: float
+    adduct_name: str | None = None
+    candidates: list[FormulaCandidate]
+
+
+class RequestProfileSummary(BaseModel):
+    """
+    RequestProfileSummary is a Pydantic model describing a captured profile of
+    a slow request.
+
+    Attributes:
+        profile_id (int): The identifier of the profile.
+        method (str): The HTTP method of the request.
+        path (str): The URL path of the request.
+        started_at (float): Unix timestamp of the request start.
+        duration_s (float): The duration of the request in seconds.
+        n_samples (int): The number of stack samples taken.
+    """
+    profile_id: int
+    method: str
+    path: str
+    started_at: float
+    duration_s: float
+    n_samples: int
+
+
+class IonIndexStatus(BaseModel):
+    """
+    IonIndexStatus is a Pydantic model describing the in-memory index of the
+    measured compound ions.
+
+    Attributes:
+        ready (bool): Whether the initial build finished.
+        version (int): Incremented with every update of the index.
+        segments (int): The number of segments not merged yet.
+        rows (int): The number of indexed measured compounds.
+    """
+    ready: bool
+    version: int
+    segments: int
+    rows: int
+
+class IonIndexConsistency(BaseModel):
+    """
+    IonIndexConsistency is a Pydantic model holding the differences between 
+    the ion index and the database.
+
+    Attributes:
+        indexed (int): The number of indexed measured compounds.
+        database (int): The number of measured compounds in the database.
+        missing (list[int]): Measured compounds missing from the index.
+        unexpected (list[int]): Indexed measured compounds not in the 
+        database.
+        duplicated (list[int]): Measured compounds indexed more than once.
+        mismatched (list[int]): Measured compounds whose m/z, retention time
+        or ion mode differ.
+    """
+    indexed: int
+    database: int
+    missing: list[int]
+    unexpected: list[int]
+    duplicated: list[int]
+    mismatched: list[int]
+
+class LibrarySnapshotStatus(BaseModel):
+    """
+    LibrarySnapshotStatus is a Pydantic model for the library snapshot mapped
+    by the worker process.
+
+    Attributes:
+        enabled (bool): Whether snapshots are enabled.
+        version (int): Incremented whenever another snapshot was mapped.
+        fingerprint (str | None): The fingerprint of the library tables the
+        snapshot was built from, None if no current snapshot is mapped.
+        path (str | None): The snapshot file.
+        bytes (int | None): The size of the snapshot file.
+        compounds (int | None): The number of compounds.
+        adducts (int | None): The number of adducts.
+        measured_ions (int | None): The number of measured compounds.
+    """
+    enabled: bool
+    version: int
+    fingerprint: str | None = None
+    path: str | None = None
+    bytes: int | None = None
+    compounds: int | None = None
+    adducts: int | None = None
+    measured_ions: int | None = None
+
+class Changes(BaseModel):
+    """
+    Changes is a Pydantic model holding the rows of the reference tables 
+    inserted or updated after a version.
+
+    Attributes:
+        since (int): The version the changes start after.
+        version (int): The version the changes include; pass it as `since` 
+        to get the next changes.
+        compounds (list[Compound]): The changed compounds.
+        adducts (list[Adduct]): The changed adducts.
+        retention_times (list[RetentionTime]): The changed retention times.
+        measured_compounds (list[MeasuredCompound]): The changed measured 
+        compounds.
+    """
+    since: int
+    version: int
+    compounds: list[Compound]
+    adducts: list[Adduct]
+    retention_times: list[RetentionTime]
+    measured_compounds: list[MeasuredCompound]
+
+class Job(BaseModel):
+    """
+    Job is a Pydantic model for a submitted background import.
+
+    Attributes:
+        job_id (int): The unique identifier of the job.
+        kind (str): The rows of the job, "compounds", "adducts" or 
+        "measured_compounds".
+        status (str): "queued", "running", "succeeded" or "failed".
+        total_rows (int): The number of submitted rows.
+    """
+    job_id: int
+    kind: str
+    status: str
+    total_rows: int
+
+    class Config:
+        orm_mode = True
+
+class JobInvalidRow(BaseModel):
+    """
+    JobInvalidRow is a Pydantic model for a row a job did not import.
+
+    Attributes:
+        row_index (int): The position of the row in the submitted list.
+        row (dict | list | str | int | float | bool | None): The submitted row.
+        error (str): Why the row was not imported.
+    """
+    row_index: int
+    row: dict | list | str | int | float | bool | None
+    error: str
+
+class JobStatus(Job):
+    """
+    JobStatus is a Pydantic model for the progress of a background import.
+
+    Attributes:
+        processed_rows (int): The number of rows processed so far.
+        created_rows (int): The number of rows added to the database.
+        invalid_count (int): The number of rows not imported.
+        progress (float): processed_rows / total_rows.
+        rows_per_second (float | None): The throughput since the job started.
+        created_at (float): When the job was submitted, as Unix time.
+        started_at (float | None): When the job started.
+        finished_at (float | None): When the job succeeded or failed.
+        error (str | None): Why the job failed.
+        invalid_rows (list[JobInvalidRow]): The first invalid rows.
+    """
+    processed_rows: int
+    created_rows: int
+    invalid_count: int
+    progress: float
+    rows_per_second: float | None = None
+    created_at: float
+    started_at: float | None = None
+    finished_at: float | None = None
+    error: str | None = None
+    invalid_rows: list[JobInvalidRow]
+
+class UploadCreate(BaseModel):
+    """
+    UploadCreate is a Pydantic model for opening a resumable upload.
+
+    Attributes:
+        kind (str): The rows of the upload, "compounds", "adducts" or 
+        "measured_compounds".
+        total_chunks (int): The number of chunks that will be sent, at most
+        `config.UPLOAD_MAX_CHUNKS`.
+    """
+    kind: str
+    total_chunks: int = Field(ge=1, le=config.UPLOAD_MAX_CHUNKS)
+
+class Upload(UploadCreate):
+    """
+    Upload is a Pydantic model for an opened resumable upload.
+
+    Attributes:
+        upload_id (int): The unique identifier of the upload.
+    """
+    upload_id: int
+
+    class Config:
+        orm_mode = True
+
+class UploadChunkResult(BaseModel):
+    """
+    UploadChunkResult is a Pydantic model for the import of one chunk of an
+    upload.
+
+    Attributes:
+        upload_id (int): The upload.
+        chunk_index (int): The number of the chunk.
+        status (str): "completed".
+        row_count (int): The number of rows of the chunk.
+        created_rows (int): The number of rows added to the database.
+        invalid_count (int): The number of rows not imported.
+        invalid_rows (list[JobInvalidRow]): The rows not imported, with their
+        position in the chunk.
+        replayed (bool): Whether the chunk was imported by an earlier request
+        with the same idempotency key.
+    """
+    upload_id: int
+    chunk_index: int
+    status: str
+    row_count: int
+    created_rows: int
+    invalid_count: int
+    invalid_rows: list[JobInvalidRow]
+    replayed: bool
+
+class UploadStatus(BaseModel):
+    """
+    UploadStatus is a Pydantic model for the progress of an upload, used to
+    resume it.
+
+    Attributes:
+        upload_id (int): The upload.
+        kind (str): The rows of the upload.
+        total_chunks (int): The number of chunks of the upload.
+        completed_chunks (list[int]): The imported chunks.
+        processing_chunks (list[int]): The chunks being imported.
+        missing_chunks (list[int]): The chunks not received yet.
+        complete (bool): Whether all chunks were imported.
+        created_rows (int): The number of rows added to the database.
+        invalid_count (int): The number of rows not imported.
+    """
+    upload_id: int
+    kind: str
+    total_chunks: int
+    completed_chunks: list[int]
+    processing_chunks: list[int]
+    missing_chunks: list[int]
+    complete: bool
+    created_rows: int
+    invalid_count: int
+
+class AdmissionClassStatus(BaseModel):
+    """
+    AdmissionClassStatus is a Pydantic model for the load of an endpoint 
+    class limited by admission control.
+
+    Attributes:
+        name (str): The endpoint class, "heavy" or "write".
+        limit (int): The number of requests running at once.
+        queue_size (int): The number of requests waiting at most.
+        active (int): The number of running requests.
+        waiting (int): The number of waiting requests.
+        admitted (int): The number of admitted requests.
+        rejected (int): The number of requests rejected with 503 because the
+        queue was full.
+        timed_out (int): The number of requests rejected with 503 after 
+        waiting too long.
+        mean_duration_s (float): Moving average of the run time of a request.
+    """
+    name: str
+    limit: int
+    queue_size: int
+    active: int
+    waiting: int
+    admitted: int
+    rejected: int
+    timed_out: int
+    mean_duration_s: float
+
+class MeasuredCompoundQuery(BaseModel):
+    """
+    MeasuredCompoundQuery is a Pydantic model for one query of a batched 
+    measured compound lookup.
+
+    Attributes:
+        retention_time (float): The retention time.
+        ion_mode (str): The ion mode of the adducts.
+        type (Optional[str]): The type of the compounds; None matches
+        compounds without type, as in `GET /measured_compounds/`.
+        rt_tolerance (float): Also match retention times up to this far 
+        away. Defaults to 0, an exact match.
+    """
+    retention_time: float
+    ion_mode: str
+    type: str | None = None
+    rt_tolerance: float = 0.0
+
+class MeasuredCompoundLookup(BaseModel):
+    """
+    MeasuredCompoundLookup is a Pydantic model for the result of one query
+    of a batched measured compound lookup.
+
+    Attributes:
+        query (MeasuredCompoundQuery): The query.
+        measured_compounds (list[MeasuredCompoundClient]): The matching
+        measured compounds.
+    """
+    query: MeasuredCompoundQuery
+    measured_compounds: list[MeasuredCompoundClient]
+
+class ConflictIon(BaseModel):
+    """
+    ConflictIon is a Pydantic model representing one of two conflicting 
+    library ions.
+
+    Attributes:
+        compound_id (int): The unique identifier for the compound.
+        compound_name (str): The name of the compound.
+        adduct_name (str): The name of the adduct.
+        mz (float): The theoretical m/z of the ion.
+        measured_compound_id (Optional[int]): The measured compound, for
+        measured ions.
+        retention_time (Optional[float]): The retention time, for measured
+        ions.
+    """
+    compound_id: int
+    compound_name: str
+    adduct_name: str
+    mz: float
+    measured_compound_id: int | None = None
+    retention_time: float | None = None
+
+class IonConflict(BaseModel):
+    """
+    IonConflict is a Pydantic model representing two ions of different 
+    compounds that a feature cannot tell apart.
+
+    Attributes:
+        kind (str): "isomer" for ions of the same adduct and composition,
+        otherwise "isobar".
+        ion_mode (str): The ion mode of both ions.
+        ppm (float): The m/z difference relative to the lower m/z in ppm.
+        a (ConflictIon): The ion with the lower m/z.
+        b (ConflictIon): The ion with the higher m/z.
+    """
+    kind: str
+    ion_mode: str
+    ppm: float
+    a: ConflictIon
+    b: ConflictIon
+
+class ConflictReport(BaseModel):
+    """
+    ConflictReport is a Pydantic model representing the conflicting ions of
+    the library.
+
+    Attributes:
+        source (str): "measured" for the measured compounds, "library" for
+        every compound with every adduct.
+        ppm (float): The m/z window in ppm.
+        rt_tolerance (Optional[float]): The retention time window, None if 
+        the retention time was ignored.
+        n_ions (int): The number of compared ions.
+        n_pairs (int): The number of conflicting pairs.
+        n_isomer_pairs (int): The number of pairs of isomers.
+        n_conflicting_ions (int): The number of ions in at least one pair.
+        truncated (bool): Whether the search stopped after the maximum
+        number of pairs; the counts are then lower bounds and the pairs
+        those of the lowest m/z.
+        conflicts (list[IonConflict]): The pairs with the smallest m/z
+        difference first, at most `limit` of them.
+    """
+    source: str
+    ppm: float
+    rt_tolerance: float | None = None
+    n_ions: int
+    n_pairs: int
+    n_isomer_pairs: int
+    n_conflicting_ions: int
+    truncated: bool = False
+    conflicts: list[IonConflict]
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Float
+from sqlalchemy import Column, ForeignKey, Index, Integer, LargeBinary, \
+    String, Float
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.hybrid import hybrid_property
 
@@ -15,7 +16,14 @@ class Compound(Base):
         compound_name (str): The name of the compound.
         molecular_formula (str): The molecular formula of the compound.
         type (str): The type/category of the compound.
+        monoisotopic_mass (float): The monoisotopic mass stored at insert.
+        mass_defect (float): The mass defect of the monoisotopic mass.
+        kendrick_mass_defect (float): The Kendrick mass defect of the 
+        monoisotopic mass with CH2 as base.
+        row_version (int): The change version of the last insert or update.
         measured_compound_c (relationship): Relationship to the MeasuredCompound model.
+        composition (relationship): Relationship to the CompoundComposition 
+        model.
     Properties:
         computed_mass (float): The computed mass of the compound based on its 
         molecular formula.
@@ -26,18 +34,58 @@ class Compound(Base):
     compound_name = Column(String, index=True, nullable=False)
     molecular_formula = Column(String, nullable=False)
     type = Column(String)
+    monoisotopic_mass = Column(Float, index=True)
+    mass_defect = Column(Float, index=True)
+    kendrick_mass_defect = Column(Float, index=True)
+    row_version = Column(Integer, index=True)
     
     measured_compound_c = relationship(
         "MeasuredCompound", back_populates="compound"
     )
+    composition = relationship(
+        "CompoundComposition", back_populates="compound"
+    )
 
     @hybrid_property # For computing on the Compound instance
     def computed_mass(self):
+        if self.monoisotopic_mass is not None:
+            return self.monoisotopic_mass
         return parse_and_compute_mass(self.molecular_formula)
 
     @computed_mass.expression
     def computed_mass(cls):
-        return parse_and_compute_mass(cls.molecular_formula)
+        return cls.monoisotopic_mass
+
+
+class CompoundComposition(Base):
+    """
+    Represents the elemental composition of a compound, one row per element
+    and isotope label.
+    Attributes:
+        compound_id (int): Foreign key referencing the compound.
+        element (str): The element symbol, e.g. "Cl".
+        isotope (int): The mass number of a labelled isotope, e.g. 2 for 
+        deuterium, or 0 for the natural element.
+        count (int): The number of atoms.
+        compound (relationship): Relationship to the Compound model.
+    """
+    __tablename__ = "compound_compositions"
+
+    compound_id = Column(
+        Integer, ForeignKey("compounds.compound_id"), primary_key=True
+    )
+    element = Column(String, primary_key=True)
+    isotope = Column(Integer, primary_key=True, default=0)
+    count = Column(Integer, nullable=False)
+
+    compound = relationship("Compound", back_populates="composition")
+
+    __table_args__ = (
+        Index(
+            "ix_compound_compositions_element_compound", 
+            "element", "compound_id", "count"
+        ),
+    )
     
 
 class Adduct(Base):
@@ -48,6 +96,7 @@ class Adduct(Base):
         adduct_name (str): The name of the adduct.
         mass_adjustment (float): The mass adjustment value for the adduct.
         ion_mode (str): The ion mode associated with the adduct.
+        row_version (int): The change version of the last insert or update.
         measured_compound_a (relationship): Relationship to the MeasuredCompound model.
     """
     __tablename__ = "adducts"
@@ -56,6 +105,7 @@ class Adduct(Base):
     adduct_name = Column(String, index=True, nullable=False)
     mass_adjustment = Column(Float, nullable=False)
     ion_mode = Column(String, nullable=False)
+    row_version = Column(Integer, index=True)
     
     measured_compound_a = relationship(
         "MeasuredCompound", back_populates="adduct"
@@ -72,10 +122,12 @@ class MeasuredCompound(Base):
         retention_time_id (int): Foreign key referencing the retention time.
         adduct_id (int): Foreign key referencing the adduct.
         molecular_formula_c (str): Computed molecular formula of the compound.
+        row_version (int): The change version of the last insert or update.
     Relationships:
         compound (Compound): Relationship to the Compound model.
         retention_time (RetentionTime): Relationship to the RetentionTime model.
         adduct (Adduct): Relationship to the Adduct model.
+        spectra (list[Spectrum]): Relationship to the Spectrum model.
     Properties:
         molecular_formula_c (str): Hybrid property to get the molecular formula
         from the compound.
@@ -96,15 +148,19 @@ class MeasuredCompound(Base):
 
     measured_compound_id = Column(Integer, primary_key=True, index=True)
     compound_id = Column(Integer, ForeignKey("compounds.compound_id"))
-    retention_time_id = Column(Integer, ForeignKey("retention_times.retention_time_id"))
+    retention_time_id = Column(
+        Integer, ForeignKey("retention_times.retention_time_id"), index=True
+    )
     adduct_id = Column(Integer, ForeignKey("adducts.adduct_id"))
     #_measured_mass = Column("measured_mass", Float)
     molecular_formula_c = Column("molecular_formula_c", String)  # Store the computed value
+    row_version = Column(Integer, index=True)
 
     compound = relationship("Compound", back_populates="measured_compound_c")
     retention_time = relationship("RetentionTime")
     adduct = relationship("Adduct", back_populates="measured_compound_a"
     )
+    spectra = relationship("Spectrum", back_populates="measured_compound")
     
     @hybrid_property
     def molecular_formula_c(self):
@@ -151,9 +207,181 @@ class RetentionTime(Base):
         retention_time_id (int): The primary key for the retention time entry.
         retention_time (float): The retention time value.
         comment (str): An optional comment about the retention time.
+        row_version (int): The change version of the last insert or update.
     """
     __tablename__ = "retention_times"
 
     retention_time_id = Column(Integer, primary_key=True, index=True)
-    retention_time = Column(Float, nullable=False)
-    comment = Column(String)
\ No newline at end of file
+    retention_time = Column(Float, nullable=False, index=True)
+    comment = Column(String)
+    row_version = Column(Integer, index=True)
+
+
+class ChangeCounter(Base):
+    """
+    The single row counter of change versions. Every write to compounds,
+    adducts, retention times and measured compounds increments it in its
+    transaction and stores the new value as row_version of the written rows,
+    so that clients can fetch the rows changed after a version.
+
+    Attributes:
+        counter_id (int): The primary key, always 1.
+        version (int): The version of the last write.
+    """
+    __tablename__ = "change_counter"
+
+    counter_id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class Spectrum(Base):
+    """
+    Represents a reference MS/MS spectrum of a measured compound. The peaks
+    are stored as two binary blobs of little-endian float32 values sorted by
+    m/z instead of one row per peak.
+    Attributes:
+        spectrum_id (int): The primary key for the spectrum.
+        measured_compound_id (int): Foreign key referencing the measured 
+        compound.
+        precursor_mz (float): The m/z of the precursor ion.
+        collision_energy (float): The collision energy, if known.
+        n_peaks (int): The number of peaks.
+        mz (bytes): The peak m/z values as float32 array.
+        intensity (bytes): The peak intensities as float32 array.
+        measured_compound (relationship): Relationship to the 
+        MeasuredCompound model.
+    """
+    __tablename__ = "spectra"
+
+    spectrum_id = Column(Integer, primary_key=True, index=True)
+    measured_compound_id = Column(
+        Integer, ForeignKey("measured_compounds.measured_compound_id"),
+        index=True, nullable=False
+    )
+    precursor_mz = Column(Float, index=True, nullable=False)
+    collision_energy = Column(Float)
+    n_peaks = Column(Integer, nullable=False)
+    mz = Column(LargeBinary, nullable=False)
+    intensity = Column(LargeBinary, nullable=False)
+
+    measured_compound = relationship(
+        "MeasuredCompound", back_populates="spectra"
+    )
+
+
+class Job(Base):
+    """
+    Represents a background job importing a large list of rows, see
+    `database.jobs`. The rows are kept as compressed JSON until the job has
+    finished.
+    Attributes:
+        job_id (int): The primary key for the job.
+        kind (str): What the rows are, e.g. "measured_compounds".
+        status (str): "queued", "running", "succeeded" or "failed".
+        payload (bytes): The submitted JSON rows, zlib compressed.
+        total_rows (int): The number of submitted rows.
+        processed_rows (int): The number of rows processed and committed.
+        created_rows (int): The number of rows created.
+        invalid_count (int): The number of invalid rows.
+        worker (str): The process working on the job.
+        error (str): Why the job failed.
+        created_at, started_at, updated_at, finished_at (float): Unix times
+        of the submission, the start, the last progress and the end.
+        invalid_rows (relationship): Relationship to the JobInvalidRow model.
+    """
+    __tablename__ = "jobs"
+
+    job_id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    status = Column(String, index=True, nullable=False)
+    payload = Column(LargeBinary)
+    total_rows = Column(Integer, nullable=False)
+    processed_rows = Column(Integer, nullable=False, default=0)
+    created_rows = Column(Integer, nullable=False, default=0)
+    invalid_count = Column(Integer, nullable=False, default=0)
+    worker = Column(String)
+    error = Column(String)
+    created_at = Column(Float, nullable=False)
+    started_at = Column(Float)
+    updated_at = Column(Float)
+    finished_at = Column(Float)
+
+    invalid_rows = relationship("JobInvalidRow", back_populates="job")
+
+
+class JobInvalidRow(Base):
+    """
+    Represents a submitted row of a job that could not be imported.
+    Attributes:
+        job_id (int): Foreign key referencing the job.
+        row_index (int): The position of the row in the submitted list.
+        data (str): The row as JSON.
+        error (str): Why the row is invalid.
+        job (relationship): Relationship to the Job model.
+    """
+    __tablename__ = "job_invalid_rows"
+
+    job_id = Column(Integer, ForeignKey("jobs.job_id"), primary_key=True)
+    row_index = Column(Integer, primary_key=True)
+    data = Column(String, nullable=False)
+    error = Column(String)
+
+    job = relationship("Job", back_populates="invalid_rows")
+
+
+class UploadSession(Base):
+    """
+    Represents a resumable upload of a large list of rows in numbered
+    chunks, see `database.uploads`.
+    Attributes:
+        upload_id (int): The primary key for the upload.
+        kind (str): What the rows are, e.g. "measured_compounds".
+        total_chunks (int): The number of chunks the client will send.
+        created_at, updated_at (float): Unix times of the opening and the
+        last received chunk.
+        chunks (relationship): Relationship to the UploadChunk model.
+    """
+    __tablename__ = "upload_sessions"
+
+    upload_id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    total_chunks = Column(Integer, nullable=False)
+    created_at = Column(Float, nullable=False)
+    updated_at = Column(Float)
+
+    chunks = relationship("UploadChunk", back_populates="upload")
+
+
+class UploadChunk(Base):
+    """
+    Represents a received chunk of an upload and the result of importing it.
+    Attributes:
+        upload_id (int): Foreign key referencing the upload.
+        chunk_index (int): The number of the chunk, from 0.
+        idempotency_key (str): Identifies the content of the chunk, retries
+        of the chunk send the same key.
+        status (str): "processing" or "completed".
+        row_count (int): The number of rows of the chunk.
+        created_rows (int): The number of rows created.
+        invalid_count (int): The number of invalid rows.
+        invalid_rows (str): The invalid rows as JSON list.
+        started_at, finished_at (float): Unix times of the start and the end
+        of the import.
+        upload (relationship): Relationship to the UploadSession model.
+    """
+    __tablename__ = "upload_chunks"
+
+    upload_id = Column(
+        Integer, ForeignKey("upload_sessions.upload_id"), primary_key=True
+    )
+    chunk_index = Column(Integer, primary_key=True)
+    idempotency_key = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    created_rows = Column(Integer)
+    invalid_count = Column(Integer)
+    invalid_rows = Column(String)
+    started_at = Column(Float, nullable=False)
+    finished_at = Column(Float)
+
+    upload = relationship("UploadSession", back_populates="chunks")
@@ -0,0 +1,100 @@
+import numpy as np
+
+from . import chem
+
+DEFAULT_KENDRICK_BASE = "CH2"
+
+
+def nominal_mass(masses):
+    """
+    Rounds masses to the nearest integer, halves rounding up. The same rule is
+    used by the SQL expressions of `database.io`, so that stored and computed
+    values agree.
+    """
+    return np.floor(np.asarray(masses, dtype=np.float64) + 0.5)
+
+
+def kendrick_factor(base: str = DEFAULT_KENDRICK_BASE) -> float:
+    """
+    Returns the factor converting masses to the Kendrick mass scale of a base
+    unit given as formula, e.g. "CH2", "CF2" or "H".
+
+    Raises:
+        ValueError: If the base is not a valid formula.
+    """
+    try:
+        exact = chem.parse_and_compute_mass(base)
+    except Exception:
+        raise ValueError(f"Invalid Kendrick base '{base}'.")
+    if not base or exact <= 0:
+        raise ValueError(f"Invalid Kendrick base '{base}'.")
+    return round(exact) / exact
+
+
+def mass_defect(masses):
+    """
+    Computes the mass defect, the exact mass minus the nominal mass.
+    Args:
+        masses (array_like): Exact masses or m/z values.
+    Returns:
+        np.ndarray: The mass defects.
+    """
+    masses = np.asarray(masses, dtype=np.float64)
+    return masses - nominal_mass(masses)
+
+
+def kendrick_mass_defect(masses, base: str = DEFAULT_KENDRICK_BASE):
+    """
+    Computes the Kendrick mass defect, the nominal Kendrick mass minus the
+    Kendrick mass. Homologues differing by the base unit share the same value.
+    Args:
+        masses (array_like): Exact masses or m/z values.
+        base (str, optional): The formula of the base unit. Defaults to "CH2".
+    Returns:
+        np.ndarray: The Kendrick mass defects.
+    """
+    kendrick_masses = np.asarray(masses, dtype=np.float64) \
+        * kendrick_factor(base)
+    return nominal_mass(kendrick_masses) - kendrick_masses
+
+
+def _in_range(values, low, high):
+    mask = np.ones(values.shape, dtype=bool)
+    if low is not None:
+        mask &= values >= low
+    if high is not None:
+        mask &= values <= high
+    return mask
+
+
+def screen(
+    masses,
+    base: str = DEFAULT_KENDRICK_BASE,
+    min_mass_defect: float | None = None,
+    max_mass_defect: float | None = None,
+    min_kmd: float | None = None,
+    max_kmd: float | None = None,
+    min_mass: float | None = None,
+    max_mass: float | None = None
+    ) -> dict:
+    """
+    Selects the masses inside a mass, mass defect and Kendrick mass defect
+    window. Bounds that are None are open.
+    Returns:
+        dict: The indices of the selected masses and their mass and Kendrick
+        mass defects as arrays.
+    """
+    masses = np.asarray(masses, dtype=np.float64)
+    md = mass_defect(masses)
+    kmd = kendrick_mass_defect(masses, base)
+    mask = (
+        _in_range(masses, min_mass, max_mass)
+        & _in_range(md, min_mass_defect, max_mass_defect)
+        & _in_range(kmd, min_kmd, max_kmd)
+    )
+    indices = np.flatnonzero(mask)
+    return {
+        "indices": indices,
+        "mass_defect": md[indices],
+        "kendrick_mass_defect": kmd[indices],
+    }
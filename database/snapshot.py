@@ -0,0 +1,640 @@
+"""
+Immutable, memory-mapped snapshot of the compound library shared by all
+worker processes of the API.
+
+A snapshot file holds the compounds, adducts and measured ions as columns:
+masses, m/z and retention times as float64, ids as int64, types and ion modes
+as small integer codes into category lists, and names as int32 codes into a
+string table (UTF-8 bytes plus offsets). The file is a short binary header, a
+JSON description of the arrays and the 64 byte aligned raw arrays, so that
+`np.frombuffer` over a read-only `mmap` gives zero-copy arrays. Every worker
+maps the same file and the operating system keeps a single copy of its pages.
+
+Snapshots are named after a fingerprint of the library tables. The file
+`CURRENT` in the snapshot directory names the snapshot in use; a new snapshot
+is written to a temporary file and published by renaming it and then
+`CURRENT`, both atomic. A file lock ensures that only one worker builds a
+snapshot at a time. Workers check `CURRENT` at most every `check_interval`
+seconds and swap to a new snapshot by replacing a single reference; readers
+holding the old snapshot keep a valid mapping until they release it.
+"""
+import contextlib
+import copy
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections.abc import Sequence
+
+import numpy as np
+from sqlalchemy import func, make_url, select
+from sqlalchemy.orm import Session
+
+from . import config, library, schema
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+MAGIC = b"MSLIBSNP"
+FORMAT_VERSION = 3
+ALIGNMENT = 64
+POINTER = "CURRENT"
+LOCK = "snapshot.lock"
+_PREFIX = struct.Struct("<8sIQ")
+
+
+def library_fingerprint(db: Session) -> str:
+    """
+    Returns a fingerprint of the library tables that changes with every
+    insert, delete or change of a mass, mass adjustment or retention time.
+    """
+    tables = [
+        (schema.Compound.compound_id, schema.Compound.monoisotopic_mass),
+        (schema.Adduct.adduct_id, schema.Adduct.mass_adjustment),
+        (schema.RetentionTime.retention_time_id,
+         schema.RetentionTime.retention_time),
+        (schema.MeasuredCompound.measured_compound_id,
+         schema.MeasuredCompound.adduct_id),
+    ]
+    values = [
+        db.execute(
+            select(func.count(key), func.max(key), func.total(value))
+        ).one()
+        for key, value in tables
+    ]
+    return hashlib.sha1(repr(values).encode()).hexdigest()[:16]
+
+
+def snapshot_name(fingerprint: str) -> str:
+    """
+    Returns the file name of the snapshot of a library fingerprint, which
+    doubles as its version.
+    """
+    return f"library-{fingerprint}-v{FORMAT_VERSION}.snap"
+
+
+class _CodedColumn(Sequence):
+    """
+    Read-only sequence of strings decoded on access from integer codes.
+    """
+    def __init__(self, codes: np.ndarray):
+        self.codes = codes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._decode(code) for code in self.codes[i].tolist()]
+        return self._decode(int(self.codes[i]))
+
+    def __iter__(self):
+        return (self._decode(code) for code in self.codes.tolist())
+
+    def take(self, rows: np.ndarray) -> "_CodedColumn":
+        column = copy.copy(self)
+        column.codes = self.codes[rows]
+        return column
+
+    def _decode(self, code: int) -> str | None:
+        raise NotImplementedError
+
+
+class StringColumn(_CodedColumn):
+    """
+    Strings stored in the string table of a snapshot, -1 for None.
+    """
+    def __init__(self, codes: np.ndarray, offsets: np.ndarray,
+                 data: np.ndarray):
+        super().__init__(codes)
+        self._offsets = offsets
+        self._data = data
+
+    def _decode(self, code: int) -> str | None:
+        if code < 0:
+            return None
+        start, end = self._offsets[code], self._offsets[code + 1]
+        return self._data[start:end].tobytes().decode("utf-8")
+
+
+class CategoryColumn(_CodedColumn):
+    """
+    Values of a small category list, -1 for None.
+    """
+    def __init__(self, codes: np.ndarray, categories: list[str]):
+        super().__init__(codes)
+        self.categories = categories
+
+    def _decode(self, code: int) -> str | None:
+        return None if code < 0 else self.categories[code]
+
+
+def _encode_strings(values: list, table: dict) -> np.ndarray:
+    return np.array(
+        [-1 if value is None else table.setdefault(value, len(table))
+         for value in values],
+        dtype=np.int32
+    )
+
+
+def _encode_categories(values: list) -> tuple[np.ndarray, list[str]]:
+    categories = sorted({value for value in values if value is not None})
+    codes = {value: i for i, value in enumerate(categories)}
+    return np.array(
+        [codes.get(value, -1) for value in values], dtype=np.int16
+    ), categories
+
+
+def _string_table(table: dict) -> tuple[np.ndarray, np.ndarray]:
+    encoded = [value.encode("utf-8") for value in table]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return offsets, data
+
+
+def _select(columns: dict, name: str, value: str | None) -> dict:
+    """
+    Selects the rows of a column dict whose category column `name` equals
+    `value`, or all rows if `value` is empty.
+    """
+    if not value:
+        return columns
+    categories = columns[name].categories
+    code = categories.index(value) if value in categories else -2
+    rows = np.flatnonzero(columns[name].codes == code)
+    return {
+        key: column[rows] if isinstance(column, np.ndarray)
+        else column.take(rows)
+        for key, column in columns.items()
+    }
+
+
+def _align(n: int) -> int:
+    return -(-n // ALIGNMENT) * ALIGNMENT
+
+
+def compile_library(db: Session) -> tuple[dict, dict]:
+    """
+    Reads the library into the arrays and the metadata of a snapshot.
+
+    Returns:
+        tuple[dict, dict]: The arrays by name and the JSON serializable
+        metadata, including the category lists.
+    """
+    # Read before the tables, so that clients syncing changes from it get
+    # rows written meanwhile again rather than miss them
+    row_version = db.execute(
+        select(schema.ChangeCounter.version)
+    ).scalar() or 0
+    fingerprint = library_fingerprint(db)
+    compounds = library.compound_arrays(db)
+    adducts = library.adduct_arrays(db)
+    retention_times = library.retention_time_arrays(db)
+    ions = library.measured_ion_arrays(db)
+
+    strings = {}
+    compound_type, types = _encode_categories(compounds["type"])
+    # Adducts and ions share the codes of the ion modes
+    ion_mode, ion_modes = _encode_categories(
+        adducts["ion_mode"] + ions["ion_mode"]
+    )
+    n_adducts = len(adducts["adduct_id"])
+    arrays = {
+        "compounds/compound_id": compounds["compound_id"],
+        "compounds/compound_name": _encode_strings(
+            compounds["compound_name"], strings
+        ),
+        "compounds/type": compound_type,
+        "compounds/mass": compounds["mass"],
+        "compounds/molecular_formula": _encode_strings(
+            compounds["molecular_formula"], strings
+        ),
+        "adducts/adduct_id": adducts["adduct_id"],
+        "adducts/adduct_name": _encode_strings(
+            adducts["adduct_name"], strings
+        ),
+        "adducts/ion_mode": ion_mode[:n_adducts],
+        "adducts/mass_adjustment": adducts["mass_adjustment"],
+        "retention_times/retention_time_id":
+            retention_times["retention_time_id"],
+        "retention_times/retention_time": retention_times["retention_time"],
+        "retention_times/comment": _encode_strings(
+            retention_times["comment"], strings
+        ),
+        "ions/measured_compound_id": ions["measured_compound_id"],
+        "ions/compound_id": ions["compound_id"],
+        "ions/adduct_id": ions["adduct_id"],
+        "ions/retention_time_id": ions["retention_time_id"],
+        "ions/compound_name": _encode_strings(ions["compound_name"], strings),
+        "ions/adduct_name": _encode_strings(ions["adduct_name"], strings),
+        "ions/ion_mode": ion_mode[n_adducts:],
+        "ions/mz": ions["mz"],
+        "ions/retention_time": ions["retention_time"],
+        "ions/retention_time_comment": _encode_strings(
+            ions["retention_time_comment"], strings
+        ),
+    }
+    arrays["strings/offsets"], arrays["strings/data"] = _string_table(strings)
+    metadata = {
+        "fingerprint": fingerprint,
+        "format": FORMAT_VERSION,
+        "row_version": row_version,
+        "created_at": time.time(),
+        "categories": {"type": types, "ion_mode": ion_modes},
+    }
+    return arrays, metadata
+
+
+def write_snapshot(path: str, arrays: dict, metadata: dict):
+    """
+    Writes arrays and metadata into a snapshot file. The file is written
+    under a temporary name and renamed, so readers never see it partially.
+    """
+    layout, position = {}, 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        layout[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": position,
+        }
+        position = _align(position + array.nbytes)
+    header = json.dumps({"metadata": metadata, "arrays": layout}).encode()
+    data_start = _align(_PREFIX.size + len(header))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+            f.write(header)
+            for name, array in arrays.items():
+                f.seek(data_start + layout[name]["offset"])
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.truncate(data_start + position)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def export_snapshot(arrays: dict, metadata: dict) -> bytes:
+    """
+    Serializes the arrays and metadata of a snapshot as compressed npz file
+    for clients. The metadata is stored as the UTF-8 JSON array "metadata".
+    """
+    buffer = io.BytesIO()
+    np.savez_compressed(
+        buffer,
+        metadata=np.frombuffer(json.dumps(metadata).encode(), dtype=np.uint8),
+        **arrays
+    )
+    return buffer.getvalue()
+
+
+class LibrarySnapshot:
+    """
+    A memory-mapped snapshot file. All arrays are read-only views of the
+    mapping.
+
+    Attributes:
+        path (str): The snapshot file.
+        metadata (dict): The metadata written with the snapshot.
+        arrays (dict): The arrays by name.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_size = _PREFIX.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a library snapshot.")
+        header = json.loads(
+            self._mmap[_PREFIX.size:_PREFIX.size + header_size]
+        )
+        data_start = _align(_PREFIX.size + header_size)
+        self.metadata = header["metadata"]
+        self._export = None
+        self.arrays = {}
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"], dtype=np.int64))
+            self.arrays[name] = np.frombuffer(
+                self._mmap, dtype=dtype, count=count,
+                offset=data_start + spec["offset"]
+            ).reshape(spec["shape"])
+
+    @property
+    def fingerprint(self) -> str:
+        return self.metadata["fingerprint"]
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._mmap)
+
+    def export(self) -> bytes:
+        """
+        Returns the snapshot as compressed npz file, see `export_snapshot`.
+        """
+        if self._export is None:
+            self._export = export_snapshot(self.arrays, self.metadata)
+        return self._export
+
+    def _strings(self, name: str) -> StringColumn:
+        return StringColumn(
+            self.arrays[name], self.arrays["strings/offsets"],
+            self.arrays["strings/data"]
+        )
+
+    def _categories(self, name: str, category: str) -> CategoryColumn:
+        return CategoryColumn(
+            self.arrays[name], self.metadata["categories"][category]
+        )
+
+    def compound_arrays(self, compound_type: str | None = None) -> dict:
+        """
+        Same as `library.compound_arrays`, with lazily decoded strings.
+        """
+        return _select({
+            "compound_id": self.arrays["compounds/compound_id"],
+            "compound_name": self._strings("compounds/compound_name"),
+            "type": self._categories("compounds/type", "type"),
+            "mass": self.arrays["compounds/mass"],
+            "molecular_formula": self._strings("compounds/molecular_formula"),
+        }, "type", compound_type)
+
+    def adduct_arrays(self, ion_mode: str | None = None) -> dict:
+        """
+        Same as `library.adduct_arrays`, with lazily decoded strings.
+        """
+        return _select({
+            "adduct_id": self.arrays["adducts/adduct_id"],
+            "adduct_name": self._strings("adducts/adduct_name"),
+            "ion_mode": self._categories("adducts/ion_mode", "ion_mode"),
+            "mass_adjustment": self.arrays["adducts/mass_adjustment"],
+        }, "ion_mode", ion_mode)
+
+    def measured_ion_arrays(self, ion_mode: str | None = None) -> dict:
+        """
+        Same as `library.measured_ion_arrays`, with lazily decoded strings.
+        """
+        return _select({
+            "measured_compound_id": self.arrays["ions/measured_compound_id"],
+            "compound_id": self.arrays["ions/compound_id"],
+            "adduct_id": self.arrays["ions/adduct_id"],
+            "retention_time_id": self.arrays["ions/retention_time_id"],
+            "compound_name": self._strings("ions/compound_name"),
+            "adduct_name": self._strings("ions/adduct_name"),
+            "ion_mode": self._categories("ions/ion_mode", "ion_mode"),
+            "mz": self.arrays["ions/mz"],
+            "retention_time": self.arrays["ions/retention_time"],
+            "retention_time_comment": self._strings(
+                "ions/retention_time_comment"
+            ),
+        }, "ion_mode", ion_mode)
+
+    def library_ions(
+        self,
+        ion_mode: str | None = None,
+        compound_type: str | None = None
+        ) -> dict:
+        """
+        Same as `library.library_ions`, without querying the database.
+        """
+        return library.combine_ions(
+            self.compound_arrays(compound_type), self.adduct_arrays(ion_mode)
+        )
+
+
+def default_directory(database_url) -> str | None:
+    """
+    Returns the directory "<database file>.snapshots" for SQLite databases
+    stored in a file, None otherwise.
+    """
+    url = make_url(str(database_url))
+    if url.get_backend_name() != "sqlite" or url.database in (None, "",
+                                                              ":memory:"):
+        return None
+    return os.path.abspath(url.database) + ".snapshots"
+
+
+@contextlib.contextmanager
+def _file_lock(path: str):
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class SnapshotManager:
+    """
+    Keeps the library snapshot of a worker process current.
+
+    `start` builds a snapshot if the published one does not match the
+    database, and maps it. A watcher thread maps newly published snapshots
+    and calls the subscribers with them. Writes call `mark_stale`, which
+    rebuilds and publishes a snapshot after `rebuild_delay` seconds, so that
+    bursts of writes result in a single rebuild. Until then, `current`
+    returns None in the writing process, so that it falls back to the
+    database; other processes see the new snapshot at most `check_interval`
+    seconds after it was published.
+
+    Attributes:
+        directory (str | None): The snapshot directory, None to disable
+        snapshots.
+        version (int): Incremented whenever another snapshot was mapped.
+    """
+    def __init__(
+        self,
+        directory: str | None = None,
+        check_interval: float = 1.0,
+        rebuild_delay: float = 0.5,
+        keep: int = 2
+        ):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.rebuild_delay = rebuild_delay
+        self.keep = keep
+        self.version = 0
+        self._snapshot = None
+        self._session_factory = None
+        self._stale = False
+        self._timer = None
+        self._stopped = threading.Event()
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def start(self, session_factory, directory: str | None = None):
+        """
+        Makes sure the published snapshot matches the database, maps it and
+        starts watching for new snapshots. Does nothing without a directory.
+
+        Args:
+            session_factory (callable): Returns a new database session.
+            directory (str | None, optional): Overrides the directory.
+        """
+        if directory is not None:
+            self.directory = directory
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._session_factory = session_factory
+        self._stopped.clear()
+        self.refresh()
+        threading.Thread(
+            target=self._watch, name="library-snapshot-watch", daemon=True
+        ).start()
+
+    def stop(self):
+        self._stopped.set()
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._session_factory = None
+            self._snapshot = None
+            self._stale = False
+
+    def subscribe(self, callback):
+        """
+        Calls `callback(snapshot)` in the watcher thread whenever a newly
+        published snapshot was mapped.
+        """
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def current(self) -> LibrarySnapshot | None:
+        """
+        Returns the mapped snapshot, or None if snapshots are disabled or this
+        process changed the library since the snapshot was built.
+        """
+        if self._stale:
+            return None
+        return self._snapshot
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _published(self) -> str | None:
+        try:
+            with open(self._path(POINTER)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _publish(self, name: str):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(name)
+        os.replace(tmp_path, self._path(POINTER))
+
+    def _remove_old(self, current: str):
+        snapshots = sorted(
+            (entry for entry in os.scandir(self.directory)
+             if entry.name.endswith(".snap") and entry.name != current),
+            key=lambda entry: entry.stat().st_mtime, reverse=True
+        )
+        for entry in snapshots[self.keep - 1:]:
+            try:
+                # Processes still mapping the file keep their pages
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def _map(self) -> bool:
+        name = self._published()
+        snapshot = self._snapshot
+        if name is None or (
+            snapshot is not None and os.path.basename(snapshot.path) == name
+        ):
+            return False
+        try:
+            mapped = LibrarySnapshot(self._path(name))
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            if self._session_factory is None:
+                return False
+            self._snapshot = mapped
+            self.version += 1
+        return True
+
+    def refresh(self) -> LibrarySnapshot | None:
+        """
+        Builds and publishes a snapshot unless the published one matches the
+        database, and maps it.
+        """
+        session_factory = self._session_factory
+        if session_factory is None:
+            return None
+        # Writes committed from here on mark the snapshot stale again
+        self._stale = False
+        try:
+            with _file_lock(self._path(LOCK)), session_factory() as db:
+                name = snapshot_name(library_fingerprint(db))
+                if self._published() != name \
+                        or not os.path.exists(self._path(name)):
+                    arrays, metadata = compile_library(db)
+                    name = snapshot_name(metadata["fingerprint"])
+                    write_snapshot(self._path(name), arrays, metadata)
+                    self._publish(name)
+                    self._remove_old(name)
+        except BaseException:
+            self._stale = True
+            raise
+        self._map()
+        return self._snapshot
+
+    def mark_stale(self):
+        """
+        Schedules a rebuild after a write to the library. Does nothing if the
+        manager was not started.
+        """
+        with self._lock:
+            if self._session_factory is None:
+                return
+            self._stale = True
+            if self._timer is None:
+                self._timer = threading.Timer(self.rebuild_delay, self._rebuild)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _rebuild(self):
+        with self._lock:
+            self._timer = None
+        version = self.version
+        self.refresh()
+        if self.version != version:
+            self._notify()
+
+    def _notify(self):
+        snapshot = self._snapshot
+        for callback in self._subscribers:
+            callback(snapshot)
+
+    def _watch(self):
+        while not self._stopped.wait(self.check_interval):
+            if self._map():
+                self._notify()
+
+
+library_snapshot = SnapshotManager(
+    config.SNAPSHOT_DIR,
+    check_interval=config.SNAPSHOT_CHECK_INTERVAL_S,
+    rebuild_delay=config.SNAPSHOT_REBUILD_DELAY_S
+)
@@ -0,0 +1,418 @@
+"""
+Compact storage and vectorized similarity search of MS/MS spectra.
+
+Peaks are stored as float32 blobs. For searching, all library spectra are
+held in one columnar `SpectrumLibrary` with concatenated peak arrays. A batch
+of query spectra is scored against the library spectra in its precursor m/z
+window at once: matching peaks are found with binary searches over a
+composite (spectrum, m/z) key, and the greedy one-to-one assignment of peaks
+is made in rounds that accept every peak pair with the highest score among
+all pairs sharing one of its peaks, which gives the same assignment as
+greedily accepting pairs in order of decreasing score.
+"""
+import threading
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from . import schema
+
+PEAK_DTYPE = np.dtype("<f4")
+METHODS = ("cosine", "modified_cosine")
+
+
+def encode_peaks(mz, intensity) -> tuple[bytes, bytes]:
+    """
+    Sorts peaks by m/z and encodes them as float32 blobs.
+
+    Raises:
+        ValueError: If the arrays differ in length or contain negative or
+        non-finite values.
+    """
+    mz = np.asarray(mz, dtype=PEAK_DTYPE)
+    intensity = np.asarray(intensity, dtype=PEAK_DTYPE)
+    if mz.shape != intensity.shape or mz.ndim != 1:
+        raise ValueError("mz and intensity must have the same length.")
+    if not (np.isfinite(mz).all() and np.isfinite(intensity).all()) \
+            or (mz < 0).any() or (intensity < 0).any():
+        raise ValueError("Peaks must be finite and non-negative.")
+    order = np.argsort(mz, kind="stable")
+    return mz[order].tobytes(), intensity[order].tobytes()
+
+
+def decode_peaks(mz: bytes, intensity: bytes) -> tuple[np.ndarray, np.ndarray]:
+    return (
+        np.frombuffer(mz, dtype=PEAK_DTYPE),
+        np.frombuffer(intensity, dtype=PEAK_DTYPE)
+    )
+
+
+def _expand_ranges(starts: np.ndarray, ends: np.ndarray) -> tuple:
+    lengths = np.maximum(ends - starts, 0)
+    owner = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.cumsum(lengths) - lengths
+    positions = starts[owner] + np.arange(len(owner)) - offsets[owner]
+    return owner, positions
+
+
+class PeakTable:
+    """
+    Spectra as concatenated peak arrays sorted by m/z within every spectrum.
+
+    Attributes:
+        mz (np.ndarray): The peak m/z values as float64.
+        intensity (np.ndarray): The transformed peak intensities.
+        offsets (np.ndarray): Spectrum i holds peaks offsets[i]:offsets[i+1].
+        norms (np.ndarray): The Euclidean norm of the intensities per spectrum.
+    """
+    def __init__(
+        self,
+        peaks: list[tuple[np.ndarray, np.ndarray]],
+        intensity_power: float = 1.0
+        ):
+        lengths = np.array([len(mz) for mz, _ in peaks], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)])
+        if peaks:
+            self.mz = np.concatenate([mz for mz, _ in peaks]).astype(np.float64)
+            intensity = np.concatenate([i for _, i in peaks])
+        else:
+            self.mz = np.empty(0)
+            intensity = np.empty(0)
+        self.intensity = intensity.astype(np.float64) ** intensity_power
+        owner = np.repeat(np.arange(len(peaks)), lengths)
+        self.norms = np.sqrt(np.bincount(
+            owner, weights=self.intensity ** 2, minlength=len(peaks)
+        ))
+
+        # Composite key spectrum * span + m/z, sorted since the peaks of every
+        # spectrum are sorted by m/z
+        self.span = (float(self.mz.max()) if len(self.mz) else 0.0) + 1.0
+        self._composite = owner * self.span + self.mz
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def peaks_within(
+        self,
+        spectra: np.ndarray,
+        mz: np.ndarray,
+        tolerance: float
+        ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the peaks of `spectra[k]` within `tolerance` of `mz[k]` for
+        every k.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: k and the peak position of every
+            match.
+        """
+        low = np.clip(mz - tolerance, 0.0, self.span)
+        high = np.clip(mz + tolerance, 0.0, self.span)
+        starts = np.searchsorted(self._composite, spectra * self.span + low,
+                                 side="left")
+        ends = np.searchsorted(self._composite, spectra * self.span + high,
+                               side="right")
+        starts = np.clip(starts, self.offsets[spectra],
+                         self.offsets[spectra + 1])
+        ends = np.clip(ends, self.offsets[spectra], self.offsets[spectra + 1])
+        owner, positions = _expand_ranges(starts, ends)
+        inside = np.abs(self.mz[positions] - mz[owner]) <= tolerance
+        return owner[inside], positions[inside]
+
+
+def _greedy_assignment(
+    pairs: np.ndarray,
+    query_peaks: np.ndarray,
+    library_peaks: np.ndarray,
+    scores: np.ndarray
+    ) -> np.ndarray:
+    """
+    Assigns peaks one-to-one per spectrum pair in order of decreasing score.
+
+    Args:
+        pairs (np.ndarray): The spectrum pair of every candidate peak pair.
+        query_peaks, library_peaks (np.ndarray): The peak positions.
+        scores (np.ndarray): The scores of the candidate peak pairs.
+
+    Returns:
+        np.ndarray: Mask of the accepted candidates.
+    """
+    accepted = np.zeros(len(scores), dtype=bool)
+    # Unique rank for ties, so that exactly one pair per peak is the best
+    rank = np.empty(len(scores), dtype=np.int64)
+    rank[np.lexsort((library_peaks, query_peaks, -scores))] = \
+        np.arange(len(scores))
+    n_query = int(query_peaks.max()) + 1 if len(scores) else 1
+    n_library = int(library_peaks.max()) + 1 if len(scores) else 1
+    query_node = pairs * n_query + query_peaks
+    library_node = pairs * n_library + library_peaks
+
+    remaining = np.arange(len(scores))
+    while len(remaining):
+        best = np.ones(len(remaining), dtype=bool)
+        for node in (query_node[remaining], library_node[remaining]):
+            order = np.lexsort((rank[remaining], node))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = node[order][1:] != node[order][:-1]
+            is_first = np.zeros(len(order), dtype=bool)
+            is_first[order[first]] = True
+            best &= is_first
+        chosen = remaining[best]
+        accepted[chosen] = True
+        used = np.isin(query_node[remaining], query_node[chosen]) \
+            | np.isin(library_node[remaining], library_node[chosen])
+        remaining = remaining[~used]
+    return accepted
+
+
+def similarity(
+    queries: PeakTable,
+    library: PeakTable,
+    query_index: np.ndarray,
+    library_index: np.ndarray,
+    query_precursors: np.ndarray,
+    library_precursors: np.ndarray,
+    tolerance: float = 0.01,
+    method: str = "cosine"
+    ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the cosine or modified cosine similarity of spectrum pairs.
+
+    Args:
+        queries, library (PeakTable): The spectra.
+        query_index, library_index (np.ndarray): The spectra of every pair.
+        query_precursors, library_precursors (np.ndarray): The precursor m/z
+        of all spectra, used for the shifted matches of the modified cosine.
+        tolerance (float, optional): The fragment m/z tolerance in Da.
+        Defaults to 0.01.
+        method (str, optional): "cosine" or "modified_cosine". Defaults to
+        "cosine".
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The score and the number of matched
+        peaks of every pair.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method '{method}', use one of {METHODS}.")
+
+    # Every query peak of every pair
+    pairs, query_peaks = _expand_ranges(
+        queries.offsets[query_index], queries.offsets[query_index + 1]
+    )
+    shifts = [0.0]
+    if method == "modified_cosine":
+        shifts.append(
+            query_precursors[query_index] - library_precursors[library_index]
+        )
+
+    candidates = []
+    for shift in shifts:
+        shift = shift[pairs] if isinstance(shift, np.ndarray) else shift
+        owner, library_peaks = library.peaks_within(
+            library_index[pairs], queries.mz[query_peaks] - shift, tolerance
+        )
+        candidates.append(np.stack(
+            [pairs[owner], query_peaks[owner], library_peaks]
+        ))
+    candidates = np.unique(np.concatenate(candidates, axis=1), axis=1)
+    pair_of, query_peaks, library_peaks = candidates
+
+    scores = queries.intensity[query_peaks] * library.intensity[library_peaks]
+    accepted = _greedy_assignment(pair_of, query_peaks, library_peaks, scores)
+    n_pairs = len(query_index)
+    total = np.bincount(pair_of[accepted], weights=scores[accepted],
+                        minlength=n_pairs)
+    matched = np.bincount(pair_of[accepted], minlength=n_pairs)
+    norms = queries.norms[query_index] * library.norms[library_index]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        score = np.where(norms > 0, total / norms, 0.0)
+    return score, matched
+
+
+class SpectrumLibrary:
+    """
+    All reference spectra as columns, sorted by precursor m/z.
+
+    Attributes:
+        spectrum_id, measured_compound_id, compound_id (np.ndarray): The
+        identifiers of the spectra.
+        compound_name, adduct_name (list[str]): The compound and adduct.
+        precursor_mz (np.ndarray): The precursor m/z values, sorted.
+        peaks (PeakTable): The peaks.
+    """
+    def __init__(self, rows: list, intensity_power: float = 1.0):
+        rows = sorted(rows, key=lambda r: (r.precursor_mz, r.spectrum_id))
+        self.spectrum_id = np.array([r.spectrum_id for r in rows],
+                                    dtype=np.int64)
+        self.measured_compound_id = np.array(
+            [r.measured_compound_id for r in rows], dtype=np.int64
+        )
+        self.compound_id = np.array([r.compound_id for r in rows],
+                                    dtype=np.int64)
+        self.compound_name = [r.compound_name for r in rows]
+        self.adduct_name = [r.adduct_name for r in rows]
+        self.precursor_mz = np.array([r.precursor_mz for r in rows],
+                                     dtype=np.float64)
+        self.intensity_power = intensity_power
+        self.peaks = PeakTable(
+            [decode_peaks(r.mz, r.intensity) for r in rows],
+            intensity_power=intensity_power
+        )
+
+    @classmethod
+    def from_db(cls, db: Session, intensity_power: float = 1.0):
+        query = (
+            select(
+                schema.Spectrum.spectrum_id,
+                schema.Spectrum.measured_compound_id,
+                schema.Spectrum.precursor_mz,
+                schema.Spectrum.mz,
+                schema.Spectrum.intensity,
+                schema.MeasuredCompound.compound_id,
+                schema.Compound.compound_name,
+                schema.Adduct.adduct_name
+            )
+            .join(schema.MeasuredCompound, schema.Spectrum.measured_compound_id
+                  == schema.MeasuredCompound.measured_compound_id)
+            .join(schema.Compound, schema.MeasuredCompound.compound_id
+                  == schema.Compound.compound_id)
+            .join(schema.Adduct, schema.MeasuredCompound.adduct_id
+                  == schema.Adduct.adduct_id)
+        )
+        return cls(db.execute(query).all(), intensity_power=intensity_power)
+
+    def __len__(self):
+        return len(self.spectrum_id)
+
+    def search(
+        self,
+        precursor_mz: list[float],
+        peaks: list[tuple[np.ndarray, np.ndarray]],
+        precursor_tolerance: float = 0.02,
+        fragment_tolerance: float = 0.01,
+        method: str = "cosine",
+        top_k: int = 5,
+        min_score: float = 0.0,
+        min_matched_peaks: int = 1,
+        batch_size: int = 1000
+        ) -> list[list[tuple[int, float, int]]]:
+        """
+        Scores query spectra against the library spectra whose precursor m/z
+        lies within `precursor_tolerance` of theirs.
+
+        Args:
+            precursor_mz (list[float]): The precursor m/z of the queries.
+            peaks (list[tuple[np.ndarray, np.ndarray]]): The m/z and intensity
+            arrays of the queries.
+            precursor_tolerance (float, optional): In Da. Defaults to 0.02.
+            fragment_tolerance (float, optional): In Da. Defaults to 0.01.
+            method (str, optional): "cosine" or "modified_cosine". Defaults to
+            "cosine".
+            top_k (int, optional): The number of hits per query. Defaults to 5.
+            min_score (float, optional): The minimum score. Defaults to 0.
+            min_matched_peaks (int, optional): The minimum number of matched
+            peaks. Defaults to 1.
+            batch_size (int, optional): The number of queries scored at once.
+            Defaults to 1000.
+
+        Returns:
+            list[list[tuple[int, float, int]]]: Per query the library position,
+            score and matched peaks of the hits, best first.
+        """
+        if method not in METHODS:
+            raise ValueError(
+                f"Unknown method '{method}', use one of {METHODS}."
+            )
+        results = []
+        for start in range(0, len(peaks), batch_size):
+            results.extend(self._search_batch(
+                np.asarray(precursor_mz[start:start + batch_size],
+                           dtype=np.float64),
+                [
+                    (np.asarray(mz, dtype=np.float64),
+                     np.asarray(intensity, dtype=np.float64))
+                    for mz, intensity in peaks[start:start + batch_size]
+                ],
+                precursor_tolerance, fragment_tolerance, method, top_k,
+                min_score, min_matched_peaks
+            ))
+        return results
+
+    def _search_batch(self, precursor_mz, peaks, precursor_tolerance,
+                      fragment_tolerance, method, top_k, min_score,
+                      min_matched_peaks):
+        sorted_peaks = []
+        for mz, intensity in peaks:
+            order = np.argsort(mz, kind="stable")
+            sorted_peaks.append((mz[order], intensity[order]))
+        queries = PeakTable(sorted_peaks, intensity_power=self.intensity_power)
+
+        starts = np.searchsorted(
+            self.precursor_mz, precursor_mz - precursor_tolerance, side="left"
+        )
+        ends = np.searchsorted(
+            self.precursor_mz, precursor_mz + precursor_tolerance,
+            side="right"
+        )
+        query_index, library_index = _expand_ranges(starts, ends)
+        score, matched = similarity(
+            queries, self.peaks, query_index, library_index,
+            precursor_mz, self.precursor_mz,
+            tolerance=fragment_tolerance, method=method
+        )
+
+        keep = (score >= min_score) & (matched >= min_matched_peaks)
+        query_index, library_index = query_index[keep], library_index[keep]
+        score, matched = score[keep], matched[keep]
+        order = np.lexsort((library_index, -score, query_index))
+        hits = [[] for _ in range(len(peaks))]
+        for q, i, s, m in zip(
+            query_index[order].tolist(), library_index[order].tolist(),
+            score[order].tolist(), matched[order].tolist()
+        ):
+            if len(hits[q]) < top_k:
+                hits[q].append((i, s, m))
+        return hits
+
+
+def library_version(db: Session) -> tuple:
+    """
+    Returns a version of the spectra table that changes with every insert or
+    delete and every change of a precursor m/z, read with one aggregate
+    query.
+    """
+    return tuple(db.execute(
+        select(
+            func.count(), func.max(schema.Spectrum.spectrum_id),
+            func.total(schema.Spectrum.precursor_mz)
+        )
+    ).one())
+
+
+class SpectrumLibraryCache:
+    """
+    Holds the `SpectrumLibrary` of the API, loaded on first use and reloaded
+    whenever `library_version` changed, so every worker process sees the
+    spectra added through the others.
+    """
+    def __init__(self):
+        self._library = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, db: Session) -> SpectrumLibrary:
+        # Read before loading: spectra added meanwhile trigger another load
+        version = library_version(db)
+        with self._lock:
+            if self._library is None or self._version != version:
+                self._library = SpectrumLibrary.from_db(db)
+                self._version = version
+            return self._library
+
+    def invalidate(self):
+        with self._lock:
+            self._library = None
+
+
+spectrum_library = SpectrumLibraryCache()
@@ -0,0 +1,262 @@
+"""
+Resumable uploads of large lists of rows in numbered chunks.
+
+The client opens an upload with the number of chunks it will send and puts
+every chunk with an idempotency key, e.g. a hash of its content. A chunk is
+claimed by inserting its row into `upload_chunks` before it is imported, so
+a chunk sent twice, in parallel or as a retry, is imported only once; the
+retry gets the stored result. `get_upload_status` lists the chunks still
+missing, so after a failure the client only resends those.
+"""
+import hashlib
+import json
+import time
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import config, jobs, schema
+
+
+class ChunkConflict(Exception):
+    """
+    Raised if a chunk is sent with another idempotency key than before, or
+    while it is still being imported by another request.
+
+    Attributes:
+        retry_after (float | None): Seconds after which the chunk can be
+        sent again, None if a retry will not succeed.
+    """
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def open_upload(
+    db: Session,
+    kind: str,
+    total_chunks: int
+    ) -> schema.UploadSession:
+    """
+    Opens an upload.
+
+    Args:
+        db (Session): The database session to use for the operation.
+        kind (str): One of `database.jobs.JOB_KINDS`.
+        total_chunks (int): The number of chunks the client will send.
+
+    Returns:
+        schema.UploadSession: The upload.
+
+    Raises:
+        ValueError: If the kind is unknown or total_chunks is not between 1
+        and `config.UPLOAD_MAX_CHUNKS`.
+    """
+    if kind not in jobs.JOB_KINDS:
+        raise ValueError(f"Unknown upload kind '{kind}'.")
+    if not 1 <= total_chunks <= config.UPLOAD_MAX_CHUNKS:
+        raise ValueError(
+            f"total_chunks must be between 1 and {config.UPLOAD_MAX_CHUNKS}."
+        )
+    upload = schema.UploadSession(
+        kind=kind, total_chunks=total_chunks, created_at=time.time()
+    )
+    db.add(upload)
+    db.commit()
+    db.refresh(upload)
+    return upload
+
+
+def _chunk_result(chunk: schema.UploadChunk, replayed: bool) -> dict:
+    return {
+        "upload_id": chunk.upload_id,
+        "chunk_index": chunk.chunk_index,
+        "status": chunk.status,
+        "row_count": chunk.row_count,
+        "created_rows": chunk.created_rows,
+        "invalid_count": chunk.invalid_count,
+        "invalid_rows": json.loads(chunk.invalid_rows or "[]"),
+        "replayed": replayed,
+    }
+
+
+def _claim_chunk(
+    db: Session,
+    upload_id: int,
+    chunk_index: int,
+    key: str,
+    row_count: int
+    ) -> schema.UploadChunk | None:
+    """
+    Inserts the chunk as "processing". Returns the chunk if it was already
+    completed, None if this request has to import it.
+    """
+    now = time.time()
+    db.add(schema.UploadChunk(
+        upload_id=upload_id, chunk_index=chunk_index, idempotency_key=key,
+        status="processing", row_count=row_count, started_at=now
+    ))
+    try:
+        db.commit()
+        return None
+    except IntegrityError:
+        db.rollback()
+
+    chunk = db.get(schema.UploadChunk, (upload_id, chunk_index))
+    if chunk.idempotency_key != key:
+        raise ChunkConflict(
+            f"Chunk {chunk_index} was sent with another idempotency key."
+        )
+    if chunk.status == "completed":
+        return chunk
+    stale_after = config.UPLOAD_STALE_AFTER_S
+    if chunk.started_at > now - stale_after:
+        raise ChunkConflict(
+            f"Chunk {chunk_index} is being imported.", retry_after=1.0
+        )
+    # The request importing the chunk died; only one retry takes it over
+    taken_over = db.execute(
+        update(schema.UploadChunk)
+        .where(
+            schema.UploadChunk.upload_id == upload_id,
+            schema.UploadChunk.chunk_index == chunk_index,
+            schema.UploadChunk.started_at == chunk.started_at
+        )
+        .values(started_at=now, row_count=row_count)
+    ).rowcount
+    db.commit()
+    if not taken_over:
+        raise ChunkConflict(
+            f"Chunk {chunk_index} is being imported.", retry_after=1.0
+        )
+    return None
+
+
+def upload_chunk(
+    db: Session,
+    upload_id: int,
+    chunk_index: int,
+    body: bytes,
+    idempotency_key: str | None = None
+    ) -> dict | None:
+    """
+    Imports a chunk of an upload, unless it was imported before.
+
+    Args:
+        db (Session): The database session to use for the operation.
+        upload_id (int): The upload.
+        chunk_index (int): The number of the chunk, from 0.
+        body (bytes): The rows of the chunk as JSON list.
+        idempotency_key (str | None, optional): Identifies the content of
+        the chunk. Defaults to None, using the SHA-256 of the body.
+
+    Returns:
+        dict | None: The fields of `pydantic_models.UploadChunkResult`, None
+        if the upload does not exist. The row indices of the invalid rows
+        are positions in the chunk.
+
+    Raises:
+        ValueError: If the chunk index is out of range or the body is not a
+        JSON list.
+        ChunkConflict: If the chunk was sent with another key or is being
+        imported by another request.
+    """
+    upload = db.get(schema.UploadSession, upload_id)
+    if upload is None:
+        return None
+    if not 0 <= chunk_index < upload.total_chunks:
+        raise ValueError(
+            f"chunk_index must be between 0 and {upload.total_chunks - 1}."
+        )
+    try:
+        rows = json.loads(body)
+    except ValueError:
+        raise ValueError("The body is not valid JSON.")
+    if not isinstance(rows, list):
+        raise ValueError("The body must be a JSON list of rows.")
+    key = idempotency_key or hashlib.sha256(body).hexdigest()
+    kind = upload.kind
+
+    completed = _claim_chunk(db, upload_id, chunk_index, key, len(rows))
+    if completed is not None:
+        return _chunk_result(completed, replayed=True)
+
+    chunk_id = dict(upload_id=upload_id, chunk_index=chunk_index)
+    try:
+        n_created, invalid = jobs.import_chunk(db, kind, rows)
+    except Exception:
+        # Let a retry import the chunk again
+        db.rollback()
+        db.execute(delete(schema.UploadChunk).filter_by(**chunk_id))
+        db.commit()
+        raise
+    now = time.time()
+    db.execute(
+        update(schema.UploadChunk).filter_by(**chunk_id).values(
+            status="completed",
+            created_rows=n_created,
+            invalid_count=len(invalid),
+            invalid_rows=json.dumps([
+                {"row_index": row_index, "row": row, "error": error}
+                for row_index, row, error in invalid
+            ]),
+            finished_at=now
+        )
+    )
+    db.execute(
+        update(schema.UploadSession)
+        .where(schema.UploadSession.upload_id == upload_id)
+        .values(updated_at=now)
+    )
+    db.commit()
+    return _chunk_result(
+        db.get(schema.UploadChunk, (upload_id, chunk_index)), replayed=False
+    )
+
+
+def get_upload_status(db: Session, upload_id: int) -> dict | None:
+    """
+    Returns which chunks of an upload were imported and which are missing.
+
+    Args:
+        db (Session): The database session to use for the query.
+        upload_id (int): The upload.
+
+    Returns:
+        dict | None: The fields of `pydantic_models.UploadStatus`, None if
+        the upload does not exist.
+    """
+    upload = db.get(schema.UploadSession, upload_id)
+    if upload is None:
+        return None
+    chunks = db.execute(
+        select(
+            schema.UploadChunk.chunk_index,
+            schema.UploadChunk.status
+        )
+        .where(schema.UploadChunk.upload_id == upload_id)
+    ).all()
+    completed = sorted(i for i, status in chunks if status == "completed")
+    processing = sorted(i for i, status in chunks if status != "completed")
+    received = set(completed) | set(processing)
+    created_rows, invalid_count = db.execute(
+        select(
+            func.coalesce(func.sum(schema.UploadChunk.created_rows), 0),
+            func.coalesce(func.sum(schema.UploadChunk.invalid_count), 0)
+        )
+        .where(schema.UploadChunk.upload_id == upload_id)
+    ).one()
+    return {
+        "upload_id": upload.upload_id,
+        "kind": upload.kind,
+        "total_chunks": upload.total_chunks,
+        "completed_chunks": completed,
+        "processing_chunks": processing,
+        "missing_chunks": [
+            i for i in range(upload.total_chunks) if i not in received
+        ],
+        "complete": len(completed) == upload.total_chunks,
+        "created_rows": created_rows,
+        "invalid_count": invalid_count,
+    }
@@ -1,26 +1,35 @@
+import hashlib
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import json
 import openpyxl
 import pandas as pd
 import requests
 
-from .utils import is_valid_json, check_unique_cols
+from .offline import OfflineLibrary
+from .utils import is_valid_json, check_unique_cols, retry_delay, \
+    send_with_retry
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from database.pydantic_models import CompoundCreate, AdductCreate, \
     MeasuredCompoundClient
 
 class DataHolder:
-    def __init__(self, api_url: str):
+    def __init__(self, api_url: str, session: requests.Session | None = None):
         """
         Initializes the instance with the given API URL.
 
         Args:
           api_url (str): The URL of the API to connect to.
+          session (requests.Session, optional): A session whose connection 
+          pool is reused for all requests. Defaults to None, opening a new
+          connection per request.
         """
         self.api_url =  api_url
+        self.session = session
         self.data = None
         
     def read_in(
@@ -216,26 +225,101 @@ class DataHolder:
         self.data = [mc]
         
     
-    def insert_compounds_in_db(self):
+    def insert_compounds_in_db(self, chunk_size: int | None = None):
         assert all([isinstance(model, CompoundCreate) for model in self.data])
         dicts = [model.model_dump() for model in self.data]
-        insert_db(self.api_url, "/compounds/", dicts)
+        insert_db(
+          self.api_url, "/compounds/", dicts, self.session, chunk_size
+        )
         
-    def insert_adducts_in_db(self):
+    def insert_adducts_in_db(self, chunk_size: int | None = None):
         assert all([isinstance(model, AdductCreate) for model in self.data])
         dicts = [model.model_dump() for model in self.data]
-        insert_db(self.api_url, "/adducts/", dicts)
+        insert_db(
+          self.api_url, "/adducts/", dicts, self.session, chunk_size
+        )
         
-    def insert_measured_compounds_in_db(self):
+    def insert_measured_compounds_in_db(self, chunk_size: int | None = None):
         assert all([
           isinstance(model, MeasuredCompoundClient) for model in self.data
         ])
         dicts = [model.model_dump() for model in self.data]
-        insert_db(self.api_url, "/measured_compounds/", dicts)
+        insert_db(
+          self.api_url, "/measured_compounds/", dicts, self.session, chunk_size
+        )
+
+    def insert_in_db_as_job(
+      self,
+      wait: bool = True,
+      poll_interval: float = 1.0
+      ) -> dict:
+      """
+      Imports the compounds, adducts or measured compounds of `self.data` 
+      as background job, for files too large for a single request.
+
+      Args:
+        wait (bool, optional): Wait until the job succeeded or failed. 
+        Defaults to True.
+        poll_interval (float, optional): Seconds between polling the job.
+        Defaults to 1.0.
+
+      Returns:
+        dict: The status of the job, including its invalid rows.
+      """
+      for kind, model in JOB_KINDS.items():
+        if all(isinstance(item, model) for item in self.data):
+          break
+      else:
+        raise ValueError(
+          "The data must be compounds, adducts or measured compounds."
+        )
+      dicts = [item.model_dump() for item in self.data]
+      job = submit_job(self.api_url, kind, dicts, self.session)
+      if not wait:
+        return get_job(self.api_url, job["job_id"], self.session)
+      return wait_for_job(
+        self.api_url, job["job_id"], poll_interval, self.session
+      )
         
     def get_compounds_from_db(self):
-        return get_from_db(self.api_url, "/compounds/")
+        return get_from_db(self.api_url, "/compounds/", session=self.session)
+    
+    def get_compounds_page_from_db(
+      self,
+      skip: int = 0,
+      limit: int = 100,
+      name: str | None = None,
+      type: str | None = None
+      ) -> tuple[list[dict], int]:
+      """
+      Fetches one page of compounds, optionally filtered by a name substring
+      and type.
+
+      Returns:
+        tuple[list[dict], int]: The compounds of the page and the total 
+        number of compounds matching the filters.
+      """
+      params = {
+        "skip": skip, "limit": limit, "name": name, "type": type,
+        "with_total": True
+      }
+      return get_page_from_db(
+        self.api_url, "/compounds/", params, session=self.session
+      )
     
+    def search_compounds_from_db(
+      self,
+      query: str,
+      limit: int = 10
+      ) -> list[dict]:
+      """
+      Fetches the compounds whose name contains `query`, best matches first.
+      """
+      params = {"q": query, "limit": limit}
+      return get_from_db(
+        self.api_url, "/compounds/search/", params, session=self.session
+      )
+
     def get_measured_compounds_from_db(
       self, 
       retention_time: float | None = None, 
@@ -248,35 +332,312 @@ class DataHolder:
         "ion_mode": ion_mode
       }
       
-      return get_from_db(self.api_url, "/measured_compounds/", params)
+      return get_from_db(
+        self.api_url, "/measured_compounds/", params, session=self.session
+      )
+
+    def lookup_measured_compounds_from_db(
+      self,
+      queries: list[dict]
+      ) -> list[dict]:
+      """
+      Fetches the measured compounds of many queries with one request
+      instead of one `get_measured_compounds_from_db` call per query.
+
+      Args:
+        queries (list[dict]): Queries with "retention_time", "ion_mode" and
+        optionally "type" and "rt_tolerance".
+
+      Returns:
+        list[dict]: For every query, in order, the query and its
+        "measured_compounds".
+      """
+      url = f"{self.api_url}/measured_compounds/lookup/"
+      response = send_with_retry(
+        lambda: (self.session or requests).post(url, json=queries)
+      )
+      if response.status_code != 200:
+        raise Exception(f"Failed to look up data: {response.text}")
+      return response.json()
+
+    def get_measured_compounds_page_from_db(
+      self,
+      skip: int = 0,
+      limit: int = 100
+      ) -> tuple[list[dict], int]:
+      """
+      Fetches one page of all measured compounds.
+
+      Returns:
+        tuple[list[dict], int]: The measured compounds of the page and the 
+        total number of measured compounds.
+      """
+      params = {"skip": skip, "limit": limit, "with_total": True}
+      return get_page_from_db(
+        self.api_url, "/measured_compounds/", params, session=self.session
+      )
+
+    def get_measured_ions_from_db(
+      self,
+      ion_mode: str | None = None
+      ) -> list[dict]:
+      """
+      Fetches the theoretical m/z and the retention time of all measured 
+      compounds, optionally of one ion mode only.
+      """
+      return get_from_db(
+        self.api_url, "/screening/measured_ions/", {"ion_mode": ion_mode},
+        session=self.session
+      )
+
+    def get_conflicts_from_db(
+      self,
+      source: str = "measured",
+      ion_mode: str | None = None,
+      compound_type: str | None = None,
+      ppm: float = 5.0,
+      rt_tolerance: float | None = None,
+      kind: str | None = None,
+      limit: int = 1000
+      ) -> dict:
+      """
+      Fetches the report of ions of different compounds within `ppm`, and 
+      `rt_tolerance` for measured compounds, of each other: the counts and
+      the closest `limit` pairs. `source` is "measured" for the measured 
+      compounds or "library" for every compound with every adduct, `kind`
+      "isomer" or "isobar" to report only these pairs.
+      """
+      return get_from_db(
+        self.api_url, "/screening/conflicts/",
+        {"source": source, "ion_mode": ion_mode, "type": compound_type,
+         "ppm": ppm, "rt_tolerance": rt_tolerance, "kind": kind,
+         "limit": limit},
+        session=self.session
+      )
+
+    def get_changes_from_db(self, since: int = 0) -> dict:
+      """
+      Fetches the compounds, adducts, retention times and measured compounds
+      inserted or updated after the change version `since`. Pass the 
+      returned "version" as `since` of the next call.
+      """
+      return get_from_db(
+        self.api_url, "/changes/", {"since": since}, session=self.session
+      )
+
+    def offline_library(
+      self,
+      cache_dir: str | None = None,
+      refresh: bool = False
+      ) -> OfflineLibrary:
+      """
+      Loads the library for offline queries and matching from the on-disk 
+      cache, downloading it if it is not cached yet. With `refresh`, the 
+      changes since the cached version are fetched and applied. See 
+      `ms.offline`.
+      """
+      return OfflineLibrary.load(
+        self.api_url, cache_dir, session=self.session, refresh=refresh
+      )
 
 
 # Client db api
-def insert_db(api_url, endpoint, dicts = list[dict]):
+def insert_db(
+    api_url,
+    endpoint,
+    dicts = list[dict],
+    session=None,
+    chunk_size=None,
+    max_workers=4,
+    upload_id=None
+    ):
     """
     Inserts a list of dictionaries into a database via a POST request to the specified API endpoint.
     Args:
       api_url (str): The base URL of the API.
       endpoint (str): The specific endpoint to which the data should be posted.
       dicts (list[dict]): A list of dictionaries containing the data to be inserted.
+      session (requests.Session, optional): Session to send the request with. Defaults to None.
+      chunk_size (int, optional): Send the data as resumable upload in chunks of this many rows, see `upload_db`. Defaults to None, sending a single request.
+      max_workers (int, optional): The number of chunks sent in parallel. Defaults to 4.
+      upload_id (int, optional): Resume this upload, sending only its missing chunks. Defaults to None.
     Returns:
-      dict: The JSON response from the API if the request is successful.
+      dict: The JSON response from the API if the request is successful, or the status of the upload if sent in chunks.
     Raises:
       Exception: If the POST request fails (i.e., the status code is not 200), an exception is raised with the error message from the response.
     """
     assert all([type(x) == dict for x in dicts])
     assert type(api_url) == str
     assert type(endpoint) == str
+
+    if chunk_size is not None:
+        return upload_db(
+            api_url, endpoint.strip("/"), dicts, chunk_size, max_workers,
+            upload_id, session
+        )
     
     url = api_url + endpoint
     print(url)
-    response = requests.post(url, json=dicts)
+    response = send_with_retry(
+        lambda: (session or requests).post(url, json=dicts)
+    )
     if response.status_code != 200:
         raise Exception(f"Failed to insert {endpoint}: {response.text}")
     return response.json()
 
 
-def get_from_db(base_url, endpoint, params=None):
+def chunk_key(chunk):
+    """
+    Returns the idempotency key of a chunk, the SHA-256 of its rows, so that
+    a resumed upload sends the same keys as the original one.
+    """
+    content = json.dumps(chunk, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def upload_db(
+    api_url,
+    kind,
+    dicts,
+    chunk_size=5000,
+    max_workers=4,
+    upload_id=None,
+    session=None,
+    retries=3
+    ):
+    """
+    Uploads a large list of rows in chunks, several in parallel. Chunks that
+    fail are retried; chunks the server already imported are not sent again.
+    If chunks are still missing at the end, call again with the upload id of
+    the raised exception to send only those.
+
+    Args:
+      api_url (str): The base URL of the API.
+      kind (str): "compounds", "adducts" or "measured_compounds".
+      dicts (list[dict]): The rows.
+      chunk_size (int, optional): The number of rows per chunk. Resuming needs the same chunk size. Defaults to 5000.
+      max_workers (int, optional): The number of chunks sent in parallel. Defaults to 4.
+      upload_id (int, optional): Resume this upload. Defaults to None, opening a new one.
+      session (requests.Session, optional): Session to send the requests with. Defaults to None.
+      retries (int, optional): How often a failed chunk is sent again. Defaults to 3.
+
+    Returns:
+      dict: The status of the upload, see `GET /uploads/{upload_id}`.
+
+    Raises:
+      Exception: If chunks are missing after all retries.
+    """
+    http = session or requests
+    chunks = [
+        dicts[i:i + chunk_size] for i in range(0, len(dicts), chunk_size)
+    ] or [[]]
+    if upload_id is None:
+        response = send_with_retry(lambda: http.post(
+            f"{api_url}/uploads/",
+            json={"kind": kind, "total_chunks": len(chunks)}
+        ))
+        if response.status_code != 200:
+            raise Exception(f"Failed to open upload: {response.text}")
+        upload_id = response.json()["upload_id"]
+    status = get_from_db(api_url, f"/uploads/{upload_id}", session=session)
+    if status["total_chunks"] != len(chunks):
+        raise Exception(
+            f"Upload {upload_id} has {status['total_chunks']} chunks, not "
+            f"{len(chunks)}; resume it with the same data and chunk size."
+        )
+
+    def send(chunk_index):
+        chunk = chunks[chunk_index]
+        url = f"{api_url}/uploads/{upload_id}/chunks/{chunk_index}"
+        headers = {"Idempotency-Key": chunk_key(chunk)}
+        for attempt in range(retries + 1):
+            try:
+                response = http.put(url, json=chunk, headers=headers)
+            except requests.RequestException:
+                response = None
+            if response is not None and response.status_code == 200:
+                return response.json()
+            # A conflict without Retry-After means the chunk was sent with
+            # other rows before, which a retry cannot fix
+            retryable = response is None or response.status_code in (
+                429, 500, 502, 503, 504
+            ) or "Retry-After" in response.headers
+            if not retryable:
+                raise Exception(
+                    f"Failed to upload chunk {chunk_index}: {response.text}"
+                )
+            if attempt < retries:
+                time.sleep(retry_delay(response, attempt))
+        return None
+
+    pending = status["missing_chunks"] + status["processing_chunks"]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(send, pending))
+
+    status = get_from_db(api_url, f"/uploads/{upload_id}", session=session)
+    if not status["complete"]:
+        raise Exception(
+            f"Upload {upload_id} is missing chunks "
+            f"{status['missing_chunks'] + status['processing_chunks']}; "
+            f"call again with upload_id={upload_id} to resume."
+        )
+    return status
+
+
+JOB_KINDS = {
+    "compounds": CompoundCreate,
+    "adducts": AdductCreate,
+    "measured_compounds": MeasuredCompoundClient,
+}
+
+
+def submit_job(api_url, kind, dicts, session=None):
+    """
+    Submits rows for import in the background.
+
+    Args:
+      api_url (str): The base URL of the API.
+      kind (str): "compounds", "adducts" or "measured_compounds".
+      dicts (list[dict]): The rows.
+      session (requests.Session, optional): Session to send the request with. Defaults to None.
+
+    Returns:
+      dict: The queued job.
+
+    Raises:
+      Exception: If the job was not accepted.
+    """
+    url = f"{api_url}/jobs/{kind}/"
+    response = send_with_retry(
+        lambda: (session or requests).post(url, json=dicts)
+    )
+    if response.status_code != 202:
+        raise Exception(f"Failed to submit {kind}: {response.text}")
+    return response.json()
+
+
+def get_job(api_url, job_id, session=None):
+    """
+    Fetches the status of a background job.
+    """
+    return get_from_db(api_url, f"/jobs/{job_id}", session=session)
+
+
+def wait_for_job(api_url, job_id, poll_interval=1.0, session=None):
+    """
+    Polls a background job until it succeeded or failed.
+
+    Returns:
+      dict: The final status of the job.
+    """
+    while True:
+        job = get_job(api_url, job_id, session)
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(poll_interval)
+
+
+def get_from_db(base_url, endpoint, params=None, session=None):
     """
     Fetch data from a database endpoint.
 
@@ -284,6 +645,7 @@ def get_from_db(base_url, endpoint, params=None):
       base_url (str): The base URL of the database.
       endpoint (str): The specific endpoint to query.
       params (dict, optional): A dictionary of query parameters to include in the request. Defaults to None.
+      session (requests.Session, optional): Session to send the request with. Defaults to None.
 
     Returns:
       dict: The JSON response from the database.
@@ -291,10 +653,38 @@ def get_from_db(base_url, endpoint, params=None):
     Raises:
       Exception: If the request fails or the response status code is not 200.
     """
+    return _get(base_url, endpoint, params, session).json()
+
+
+def get_page_from_db(base_url, endpoint, params=None, session=None):
+    """
+    Fetch one page of data from a paginated database endpoint.
+
+    Args:
+      base_url (str): The base URL of the database.
+      endpoint (str): The specific endpoint to query.
+      params (dict, optional): Query parameters including skip and limit. Defaults to None.
+      session (requests.Session, optional): Session to send the request with. Defaults to None.
+
+    Returns:
+      tuple[list, int]: The JSON response and the total number of records reported in the X-Total-Count header.
+
+    Raises:
+      Exception: If the request fails or the response status code is not 200.
+    """
+    response = _get(base_url, endpoint, params, session)
+    items = response.json()
+    total = int(response.headers.get("X-Total-Count", len(items)))
+    return items, total
+
+
+def _get(base_url, endpoint, params=None, session=None):
     assert [type(x) == str for x in [base_url, endpoint]]
     url = base_url + endpoint
-    response = requests.get(url, params=params)
+    response = send_with_retry(
+        lambda: (session or requests).get(url, params=params)
+    )
     if response.status_code != 200:
         raise Exception(f"Failed to get data: {response.text}")
-    return response.json()
+    return response
   
\ No newline at end of file
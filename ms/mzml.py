@@ -0,0 +1,414 @@
+"""
+Streaming annotation of raw mzML runs with the ions of the library.
+
+The run is parsed scan by scan with pyteomics, so that only one scan is held
+in memory at a time. Profile scans are centroided into preallocated buffers,
+the peaks are matched against the m/z and retention time windows of the
+targets, and the annotations are written to a Parquet file in row groups.
+
+Example:
+
+    from ms.io import DataHolder
+    from ms.mzml import TargetList, annotate_mzml
+
+    ions = DataHolder(api_url).get_measured_ions_from_db("positive")
+    targets = TargetList.from_records(ions)
+    annotate_mzml("run.mzML", targets, "run-annotations.parquet")
+"""
+import numpy as np
+
+ANNOTATION_COLUMNS = [
+    "scan_index", "scan_id", "retention_time", "target_index",
+    "measured_compound_id", "compound_id", "compound_name", "adduct_name",
+    "target_mz", "peak_mz", "intensity", "ppm_error",
+]
+
+
+class Scan:
+    """
+    A scan of an mzML file.
+
+    Attributes:
+        index (int): The position of the scan in the file.
+        scan_id (str): The native id of the scan.
+        ms_level (int): The MS level.
+        retention_time (float): The scan start time in minutes.
+        polarity (str | None): "positive", "negative" or None if unknown.
+        centroided (bool): Whether the peaks are centroided.
+        mz (np.ndarray): The m/z array.
+        intensity (np.ndarray): The intensity array.
+    """
+    __slots__ = ("index", "scan_id", "ms_level", "retention_time", "polarity",
+                 "centroided", "mz", "intensity")
+
+    def __init__(self, index, scan_id, ms_level, retention_time, polarity,
+                 centroided, mz, intensity):
+        self.index = index
+        self.scan_id = scan_id
+        self.ms_level = ms_level
+        self.retention_time = retention_time
+        self.polarity = polarity
+        self.centroided = centroided
+        self.mz = mz
+        self.intensity = intensity
+
+
+def _retention_time(spectrum: dict) -> float:
+    scan = spectrum.get("scanList", {}).get("scan", [{}])[0]
+    value = scan.get("scan start time", float("nan"))
+    unit = getattr(value, "unit_info", "minute")
+    return float(value) / 60.0 if unit == "second" else float(value)
+
+
+def iter_scans(path: str, ms_level: int | None = 1):
+    """
+    Iterates over the scans of an mzML file without loading the file.
+
+    Args:
+        path (str): The path of the mzML file.
+        ms_level (int | None, optional): Only yield scans of this MS level,
+        None for all. Defaults to 1.
+
+    Yields:
+        Scan: The scans in file order.
+    """
+    from pyteomics import mzml
+
+    with mzml.MzML(path, use_index=False, decode_binary=True) as reader:
+        for index, spectrum in enumerate(reader):
+            level = spectrum.get("ms level")
+            if ms_level is not None and level != ms_level:
+                continue
+            if "positive scan" in spectrum:
+                polarity = "positive"
+            elif "negative scan" in spectrum:
+                polarity = "negative"
+            else:
+                polarity = None
+            yield Scan(
+                index=index,
+                scan_id=spectrum.get("id"),
+                ms_level=level,
+                retention_time=_retention_time(spectrum),
+                polarity=polarity,
+                centroided="profile spectrum" not in spectrum,
+                mz=np.asarray(spectrum["m/z array"], dtype=np.float64),
+                intensity=np.asarray(
+                    spectrum["intensity array"], dtype=np.float64
+                )
+            )
+
+
+def centroid(
+    mz: np.ndarray,
+    intensity: np.ndarray,
+    out_mz: np.ndarray,
+    out_intensity: np.ndarray,
+    centroided: bool = False,
+    min_intensity: float = 0.0
+    ) -> int:
+    """
+    Picks the peaks of a scan into fixed-size buffers, keeping the most
+    intense ones if the buffers are too small.
+
+    Profile data is reduced to its local intensity maxima with the m/z
+    interpolated as intensity weighted mean of the maximum and its two
+    neighbours.
+
+    Args:
+        mz, intensity (np.ndarray): The scan, sorted by m/z.
+        out_mz, out_intensity (np.ndarray): The buffers the peaks are written
+        to, sorted by m/z.
+        centroided (bool, optional): Whether the scan is already centroided.
+        Defaults to False.
+        min_intensity (float, optional): Peaks below are dropped. Defaults to
+        0.
+
+    Returns:
+        int: The number of peaks written to the buffers.
+    """
+    if centroided or len(mz) < 3:
+        peak_mz, peak_intensity = mz, intensity
+    else:
+        left, center, right = intensity[:-2], intensity[1:-1], intensity[2:]
+        apex = np.flatnonzero((center > left) & (center >= right)) + 1
+        weights = (
+            intensity[apex - 1], intensity[apex], intensity[apex + 1]
+        )
+        total = weights[0] + weights[1] + weights[2]
+        peak_mz = (
+            mz[apex - 1] * weights[0] + mz[apex] * weights[1]
+            + mz[apex + 1] * weights[2]
+        ) / total
+        peak_intensity = intensity[apex]
+
+    keep = peak_intensity > min_intensity
+    peak_mz, peak_intensity = peak_mz[keep], peak_intensity[keep]
+    capacity = len(out_mz)
+    if len(peak_mz) > capacity:
+        top = np.argpartition(peak_intensity, -capacity)[-capacity:]
+        top.sort()
+        peak_mz, peak_intensity = peak_mz[top], peak_intensity[top]
+    n = len(peak_mz)
+    out_mz[:n] = peak_mz
+    out_intensity[:n] = peak_intensity
+    return n
+
+
+class TargetList:
+    """
+    Target ions as columns, sorted by m/z.
+
+    Attributes:
+        mz (np.ndarray): The theoretical m/z values.
+        retention_time (np.ndarray): The expected retention times, NaN if
+        unknown.
+        ion_mode (np.ndarray): The ion mode of every target.
+        columns (dict): Further columns such as "compound_name", in the same
+        order.
+    """
+    def __init__(
+        self,
+        mz,
+        retention_time=None,
+        ion_mode=None,
+        columns: dict | None = None
+        ):
+        mz = np.asarray(mz, dtype=np.float64)
+        order = np.argsort(mz, kind="stable")
+        self.mz = mz[order]
+        if retention_time is None:
+            retention_time = np.full(len(mz), np.nan)
+        self.retention_time = np.asarray(
+            retention_time, dtype=np.float64
+        )[order]
+        if ion_mode is None:
+            ion_mode = [None] * len(mz)
+        self.ion_mode = np.asarray(ion_mode, dtype=object)[order]
+        self.columns = {
+            name: [values[i] for i in order.tolist()]
+            for name, values in (columns or {}).items()
+        }
+
+    @classmethod
+    def from_records(cls, records: list[dict]) -> "TargetList":
+        """
+        Builds the targets from the measured ions returned by
+        `ms.io.DataHolder.get_measured_ions_from_db`.
+        """
+        return cls(
+            [r["mz"] for r in records],
+            [r.get("retention_time") for r in records],
+            [r.get("ion_mode") for r in records],
+            {
+                name: [r.get(name) for r in records]
+                for name in ("measured_compound_id", "compound_id",
+                             "compound_name", "adduct_name")
+            }
+        )
+
+    def __len__(self):
+        return len(self.mz)
+
+    def match(
+        self,
+        peak_mz: np.ndarray,
+        retention_time: float,
+        polarity: str | None = None,
+        ppm: float = 5.0,
+        rt_tolerance: float | None = 0.2
+        ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the targets whose windows contain the peaks of a scan.
+
+        Args:
+            peak_mz (np.ndarray): The peak m/z values of the scan.
+            retention_time (float): The retention time of the scan.
+            polarity (str | None, optional): The polarity of the scan; targets
+            of the other ion mode are skipped. Defaults to None.
+            ppm (float, optional): The m/z tolerance relative to the target
+            m/z. Defaults to 5.0.
+            rt_tolerance (float | None, optional): The retention time
+            tolerance, None to ignore retention times. Defaults to 0.2.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The peak and target index of every
+            match.
+        """
+        # Peak p matches target t if |p - t| <= t * ppm, that is
+        # p / (1 + ppm) <= t <= p / (1 - ppm)
+        factor = ppm * 1e-6
+        starts = np.searchsorted(self.mz, peak_mz / (1 + factor), side="left")
+        ends = np.searchsorted(self.mz, peak_mz / (1 - factor), side="right")
+        lengths = ends - starts
+        peaks = np.repeat(np.arange(len(peak_mz)), lengths)
+        offsets = np.cumsum(lengths) - lengths
+        targets = starts[peaks] + np.arange(len(peaks)) - offsets[peaks]
+
+        keep = np.abs(peak_mz[peaks] - self.mz[targets]) \
+            <= self.mz[targets] * factor
+        if rt_tolerance is not None:
+            target_rt = self.retention_time[targets]
+            keep &= np.isnan(target_rt) \
+                | (np.abs(target_rt - retention_time) <= rt_tolerance)
+        if polarity is not None:
+            target_mode = self.ion_mode[targets]
+            keep &= (target_mode == polarity) | (target_mode == None)  # noqa
+        return peaks[keep], targets[keep]
+
+
+class _AnnotationWriter:
+    """
+    Collects annotations in column buffers and writes them to a Parquet file
+    in row groups of `row_group_size` rows.
+    """
+    def __init__(self, path: str, row_group_size: int):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self.schema = pa.schema([
+            ("scan_index", pa.int64()),
+            ("scan_id", pa.string()),
+            ("retention_time", pa.float64()),
+            ("target_index", pa.int64()),
+            ("measured_compound_id", pa.int64()),
+            ("compound_id", pa.int64()),
+            ("compound_name", pa.string()),
+            ("adduct_name", pa.string()),
+            ("target_mz", pa.float64()),
+            ("peak_mz", pa.float64()),
+            ("intensity", pa.float64()),
+            ("ppm_error", pa.float64()),
+        ])
+        self._writer = pq.ParquetWriter(path, self.schema)
+        self.row_group_size = row_group_size
+        self._chunks = []
+        self._n_buffered = 0
+        self.n_rows = 0
+
+    def add(self, chunk: dict):
+        n = len(chunk["scan_index"])
+        if n == 0:
+            return
+        self._chunks.append(chunk)
+        self._n_buffered += n
+        if self._n_buffered >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self._chunks:
+            return
+        table = self._pa.table({
+            name: np.concatenate([c[name] for c in self._chunks])
+            if isinstance(self._chunks[0][name], np.ndarray)
+            else [v for c in self._chunks for v in c[name]]
+            for name in ANNOTATION_COLUMNS
+        }, schema=self.schema)
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+        self.n_rows += table.num_rows
+        self._chunks = []
+        self._n_buffered = 0
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+
+def annotate_mzml(
+    path: str,
+    targets: TargetList,
+    output_path: str,
+    ppm: float = 5.0,
+    rt_tolerance: float | None = 0.2,
+    min_intensity: float = 0.0,
+    max_peaks: int = 20000,
+    ms_level: int = 1,
+    row_group_size: int = 100_000
+    ) -> dict:
+    """
+    Annotates the peaks of an mzML run with the targets and writes the
+    annotations as Parquet table. Per scan and target only the most intense
+    matching peak is kept.
+
+    Memory use is bounded by one scan, the peak buffers of `max_peaks` peaks
+    and one row group of annotations, independent of the file size.
+
+    Args:
+        path (str): The path of the mzML file.
+        targets (TargetList): The library ions.
+        output_path (str): The path of the Parquet file.
+        ppm (float, optional): The m/z tolerance. Defaults to 5.0.
+        rt_tolerance (float | None, optional): The retention time tolerance
+        in minutes, None to match by m/z only. Defaults to 0.2.
+        min_intensity (float, optional): Peaks below are ignored. Defaults to
+        0.
+        max_peaks (int, optional): The maximum number of peaks per scan.
+        Defaults to 20000.
+        ms_level (int, optional): The MS level of the annotated scans.
+        Defaults to 1.
+        row_group_size (int, optional): The rows per Parquet row group.
+        Defaults to 100000.
+
+    Returns:
+        dict: The numbers of "scans", "peaks" and "annotations".
+    """
+    out_mz = np.empty(max_peaks, dtype=np.float64)
+    out_intensity = np.empty(max_peaks, dtype=np.float64)
+    target_columns = {
+        name: targets.columns.get(name, [None] * len(targets))
+        for name in ("measured_compound_id", "compound_id", "compound_name",
+                     "adduct_name")
+    }
+    writer = _AnnotationWriter(output_path, row_group_size)
+    n_scans = n_peaks = 0
+    try:
+        for scan in iter_scans(path, ms_level=ms_level):
+            n = centroid(scan.mz, scan.intensity, out_mz, out_intensity,
+                         centroided=scan.centroided,
+                         min_intensity=min_intensity)
+            n_scans += 1
+            n_peaks += n
+            peaks, matched = targets.match(
+                out_mz[:n], scan.retention_time, polarity=scan.polarity,
+                ppm=ppm, rt_tolerance=rt_tolerance
+            )
+            if len(peaks) == 0:
+                continue
+
+            # Most intense peak per target
+            order = np.lexsort((-out_intensity[peaks], matched))
+            peaks, matched = peaks[order], matched[order]
+            first = np.ones(len(matched), dtype=bool)
+            first[1:] = matched[1:] != matched[:-1]
+            peaks, matched = peaks[first], matched[first]
+
+            peak_mz = out_mz[peaks].copy()
+            target_mz = targets.mz[matched]
+            selected = matched.tolist()
+            writer.add({
+                "scan_index": np.full(len(peaks), scan.index, dtype=np.int64),
+                "scan_id": [scan.scan_id] * len(peaks),
+                "retention_time": np.full(len(peaks), scan.retention_time),
+                "target_index": matched.astype(np.int64),
+                "measured_compound_id": [
+                    target_columns["measured_compound_id"][i]
+                    for i in selected
+                ],
+                "compound_id": [
+                    target_columns["compound_id"][i] for i in selected
+                ],
+                "compound_name": [
+                    target_columns["compound_name"][i] for i in selected
+                ],
+                "adduct_name": [
+                    target_columns["adduct_name"][i] for i in selected
+                ],
+                "target_mz": target_mz,
+                "peak_mz": peak_mz,
+                "intensity": out_intensity[peaks].copy(),
+                "ppm_error": (peak_mz - target_mz) / target_mz * 1e6,
+            })
+    finally:
+        writer.close()
+    return {"scans": n_scans, "peaks": n_peaks, "annotations": writer.n_rows}
@@ -0,0 +1,589 @@
+"""
+Offline copy of the library for annotating without a round trip per query.
+
+`OfflineLibrary.load` downloads the compounds, adducts and measured compounds
+as a compressed columnar snapshot (`GET /snapshot/`) and keeps it in an
+on-disk cache, so later sessions start from the cache. `refresh` fetches only
+the rows inserted or updated since (`GET /changes/`), applies them and
+appends them to the cache. If the server cannot be reached, the cached
+library is used. Queries and m/z matching are answered from memory.
+
+Example:
+
+    from ms.io import DataHolder
+
+    library = DataHolder(api_url).offline_library()
+    library.get_measured_compounds(retention_time=5.2, ion_mode="positive")
+    library.match_features("positive", mz=[201.0313], retention_time=[5.21])
+    library.refresh()
+"""
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+import warnings
+
+import numpy as np
+import requests
+
+from .utils import send_with_retry
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from database.grid_index import MeasuredIonIndex
+
+FORMAT_VERSION = 3
+DEFAULT_CACHE_DIR = os.environ.get(
+    "MS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ms")
+)
+
+# The columns of the tables kept by the client: their dtype, None for
+# strings, and the field of the rows returned by `GET /changes/`
+TABLES = {
+    "compounds": {
+        "compound_id": (np.int64, "compound_id"),
+        "compound_name": (None, "compound_name"),
+        "type": (None, "type"),
+        "mass": (np.float64, "computed_mass"),
+        "molecular_formula": (None, "molecular_formula"),
+    },
+    "adducts": {
+        "adduct_id": (np.int64, "adduct_id"),
+        "adduct_name": (None, "adduct_name"),
+        "ion_mode": (None, "ion_mode"),
+        "mass_adjustment": (np.float64, "mass_adjustment"),
+    },
+    "retention_times": {
+        "retention_time_id": (np.int64, "retention_time_id"),
+        "retention_time": (np.float64, "retention_time"),
+        "comment": (None, "comment"),
+    },
+    "measured_compounds": {
+        "measured_compound_id": (np.int64, "measured_compound_id"),
+        "compound_id": (np.int64, "compound_id"),
+        "adduct_id": (np.int64, "adduct_id"),
+        "retention_time_id": (np.int64, "retention_time_id"),
+    },
+}
+
+
+def _decode_strings(codes: np.ndarray, offsets: np.ndarray,
+                    data: np.ndarray) -> list:
+    text = data.tobytes()
+    table = [
+        text[start:end].decode("utf-8")
+        for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())
+    ]
+    return [None if code < 0 else table[code] for code in codes.tolist()]
+
+
+def _decode_categories(codes: np.ndarray, categories: list[str]) -> list:
+    return [None if code < 0 else categories[code] for code in codes.tolist()]
+
+
+def _take(table: dict, rows: np.ndarray) -> dict:
+    return {
+        name: values[rows] if isinstance(values, np.ndarray)
+        else [values[i] for i in rows.tolist()]
+        for name, values in table.items()
+    }
+
+
+def _upsert(table: dict, rows: dict, key: str) -> dict:
+    """
+    Inserts rows into a table or replaces the rows with the same key. The
+    result is sorted by key.
+    """
+    merged = {
+        name: np.concatenate([values, rows[name]])
+        if isinstance(values, np.ndarray) else values + rows[name]
+        for name, values in table.items()
+    }
+    keys = merged[key]
+    # The last occurrence of every key wins
+    _, last = np.unique(keys[::-1], return_index=True)
+    return _take(merged, len(keys) - 1 - last)
+
+
+def _lookup(ids: np.ndarray, references: np.ndarray) -> np.ndarray:
+    """
+    Returns the position of every id in the sorted `references`, -1 if it is
+    missing.
+    """
+    if len(references) == 0:
+        return np.full(len(ids), -1)
+    positions = np.searchsorted(references, ids)
+    clipped = np.minimum(positions, len(references) - 1)
+    found = (positions < len(references)) & (references[clipped] == ids)
+    return np.where(found, positions, -1)
+
+
+def _cache_paths(cache_dir: str, api_url: str) -> tuple[str, str, str]:
+    key = hashlib.sha1(api_url.encode()).hexdigest()[:16]
+    base = os.path.join(cache_dir, f"library-{key}")
+    return base + ".npz", base + ".json", base + ".changes.json"
+
+
+def _write_atomic(path: str, data: bytes):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _get(api_url: str, endpoint: str, session=None, timeout: float = 30.0,
+         **kwargs):
+    response = send_with_retry(lambda: (session or requests).get(
+        api_url + endpoint, timeout=timeout, **kwargs
+    ))
+    if response.status_code not in (200, 304):
+        raise Exception(f"Failed to get {endpoint}: {response.text}")
+    return response
+
+
+class OfflineLibrary:
+    """
+    In-memory library built from a snapshot of the API and the changes
+    applied to it since.
+
+    Attributes:
+        metadata (dict): The metadata of the snapshot.
+        etag (str | None): The version of the snapshot reported by the API.
+        row_version (int): The change version the library is up to date with.
+        tables (dict): The columns of the "compounds" (with a known mass),
+        "adducts", "retention_times" and "measured_compounds", sorted by id.
+        ions (dict): The columns of the measured compounds, as returned by
+        `GET /screening/measured_ions/` plus "adduct_id",
+        "retention_time_id" and "retention_time_comment".
+    """
+    def __init__(self, data: bytes, etag: str | None = None):
+        """
+        Args:
+          data (bytes): The snapshot as returned by `GET /snapshot/`.
+          etag (str | None, optional): Its version. Defaults to None.
+        """
+        with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+            arrays = {name: npz[name] for name in npz.files}
+        self.metadata = json.loads(arrays.pop("metadata").tobytes())
+        if self.metadata.get("format") != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported snapshot format {self.metadata.get('format')}."
+            )
+        self.etag = etag
+        self.row_version = self.metadata["row_version"]
+        self.api_url = None
+        self.session = None
+        self.cache_dir = None
+        self.timeout = 30.0
+
+        strings = arrays["strings/offsets"], arrays["strings/data"]
+        categories = self.metadata["categories"]
+        self.tables = {
+            "compounds": {
+                "compound_id": arrays["compounds/compound_id"],
+                "compound_name": _decode_strings(
+                    arrays["compounds/compound_name"], *strings
+                ),
+                "type": _decode_categories(
+                    arrays["compounds/type"], categories["type"]
+                ),
+                "mass": arrays["compounds/mass"],
+                "molecular_formula": _decode_strings(
+                    arrays["compounds/molecular_formula"], *strings
+                ),
+            },
+            "adducts": {
+                "adduct_id": arrays["adducts/adduct_id"],
+                "adduct_name": _decode_strings(
+                    arrays["adducts/adduct_name"], *strings
+                ),
+                "ion_mode": _decode_categories(
+                    arrays["adducts/ion_mode"], categories["ion_mode"]
+                ),
+                "mass_adjustment": arrays["adducts/mass_adjustment"],
+            },
+            "retention_times": {
+                "retention_time_id":
+                    arrays["retention_times/retention_time_id"],
+                "retention_time": arrays["retention_times/retention_time"],
+                "comment": _decode_strings(
+                    arrays["retention_times/comment"], *strings
+                ),
+            },
+            "measured_compounds": {
+                "measured_compound_id": arrays["ions/measured_compound_id"],
+                "compound_id": arrays["ions/compound_id"],
+                "adduct_id": arrays["ions/adduct_id"],
+                "retention_time_id": arrays["ions/retention_time_id"],
+            },
+        }
+        self._join()
+
+    def _join(self):
+        """
+        Derives the ions of the measured compounds from the tables.
+        """
+        compounds = self.tables["compounds"]
+        adducts = self.tables["adducts"]
+        retention_times = self.tables["retention_times"]
+        measured = self.tables["measured_compounds"]
+        c = _lookup(measured["compound_id"], compounds["compound_id"])
+        a = _lookup(measured["adduct_id"], adducts["adduct_id"])
+        r = _lookup(
+            measured["retention_time_id"], retention_times["retention_time_id"]
+        )
+        rows = np.flatnonzero((c >= 0) & (a >= 0) & (r >= 0))
+        c, a, r = c[rows], a[rows], r[rows]
+        self.ions = {
+            "measured_compound_id": measured["measured_compound_id"][rows],
+            "compound_id": measured["compound_id"][rows],
+            "compound_name": _take(compounds, c)["compound_name"],
+            "adduct_name": _take(adducts, a)["adduct_name"],
+            "ion_mode": _take(adducts, a)["ion_mode"],
+            "mz": compounds["mass"][c] + adducts["mass_adjustment"][a],
+            "retention_time": retention_times["retention_time"][r],
+            "retention_time_comment": _take(retention_times, r)["comment"],
+            "adduct_id": measured["adduct_id"][rows],
+            "retention_time_id": measured["retention_time_id"][rows],
+        }
+        self._ion_type = np.array(compounds["type"], dtype=object)[c]
+        self._index = None
+        self._library_ions = None
+
+    @property
+    def compounds(self) -> dict:
+        return self.tables["compounds"]
+
+    @property
+    def adducts(self) -> dict:
+        return self.tables["adducts"]
+
+    def apply_changes(self, changes: dict) -> int:
+        """
+        Applies the inserts and updates returned by `GET /changes/`.
+
+        Args:
+          changes (dict): The response of `GET /changes/?since=<row_version>`.
+
+        Returns:
+          int: The number of changed rows.
+        """
+        n_changed = 0
+        for name, columns in TABLES.items():
+            records = changes.get(name) or []
+            if not records:
+                continue
+            rows = {
+                column: np.array(
+                    [record[field] for record in records], dtype=dtype
+                ) if dtype is not None
+                else [record[field] for record in records]
+                for column, (dtype, field) in columns.items()
+            }
+            key = next(iter(columns))
+            table = _upsert(self.tables[name], rows, key)
+            if name == "compounds":
+                table = _take(table, np.flatnonzero(~np.isnan(table["mass"])))
+            self.tables[name] = table
+            n_changed += len(records)
+        self.row_version = max(self.row_version, changes["version"])
+        if n_changed:
+            self._join()
+        return n_changed
+
+    @classmethod
+    def load(
+        cls,
+        api_url: str,
+        cache_dir: str | None = None,
+        session: requests.Session | None = None,
+        refresh: bool = False,
+        timeout: float = 30.0
+        ) -> "OfflineLibrary":
+        """
+        Loads the library from the cache, downloading the snapshot first if
+        it is not cached. With `refresh`, the changes since the cached
+        version are fetched and applied afterwards.
+
+        Args:
+          api_url (str): The URL of the API.
+          cache_dir (str | None, optional): The cache directory. Defaults to
+          $MS_CACHE_DIR or ~/.cache/ms.
+          session (requests.Session, optional): Session to send the request
+          with. Defaults to None.
+          refresh (bool, optional): Whether to fetch the changes. Defaults to
+          False.
+          timeout (float, optional): The timeout of requests in seconds.
+
+        Returns:
+          OfflineLibrary: The library.
+
+        Raises:
+          Exception: If the snapshot is neither cached nor downloadable.
+        """
+        cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        os.makedirs(cache_dir, exist_ok=True)
+        data_path, meta_path, changes_path = _cache_paths(cache_dir, api_url)
+
+        if os.path.exists(data_path) and os.path.exists(meta_path):
+            with open(meta_path) as f:
+                etag = json.load(f).get("etag")
+            with open(data_path, "rb") as f:
+                library = cls(f.read(), etag=etag)
+            if os.path.exists(changes_path):
+                with open(changes_path) as f:
+                    for changes in json.load(f):
+                        library.apply_changes(changes)
+        else:
+            response = _get(api_url, "/snapshot/", session, timeout)
+            library = cls(response.content, etag=response.headers.get("ETag"))
+            library._save(cache_dir, api_url, response.content)
+        library.api_url = api_url
+        library.session = session
+        library.cache_dir = cache_dir
+        library.timeout = timeout
+        if refresh:
+            library.refresh()
+        return library
+
+    def _save(self, cache_dir: str, api_url: str, data: bytes):
+        data_path, meta_path, changes_path = _cache_paths(cache_dir, api_url)
+        _write_atomic(data_path, data)
+        _write_atomic(meta_path, json.dumps({
+            "api_url": api_url, "etag": self.etag
+        }).encode())
+        if os.path.exists(changes_path):
+            os.remove(changes_path)
+
+    def _save_changes(self, changes: dict):
+        changes_path = _cache_paths(self.cache_dir, self.api_url)[2]
+        saved = []
+        if os.path.exists(changes_path):
+            with open(changes_path) as f:
+                saved = json.load(f)
+        saved.append(changes)
+        _write_atomic(changes_path, json.dumps(saved).encode())
+
+    def refresh(self, full: bool = False) -> bool:
+        """
+        Brings the library up to date with the API. By default only the rows
+        inserted or updated since `row_version` are fetched and applied; they
+        are appended to the cache, too. With `full`, or if the API's version
+        is behind the library (e.g. after a restore of the database), the
+        snapshot is downloaded again if it changed. If the API cannot be
+        reached, the library stays as it is.
+
+        Args:
+          full (bool, optional): Whether to download the whole snapshot.
+          Defaults to False.
+
+        Returns:
+          bool: Whether the library changed.
+        """
+        if self.api_url is None:
+            raise ValueError("The library was not loaded from an API.")
+        try:
+            if not full:
+                changes = _get(
+                    self.api_url, "/changes/", self.session, self.timeout,
+                    params={"since": self.row_version}
+                ).json()
+                if changes["version"] >= self.row_version:
+                    if changes["version"] == self.row_version:
+                        return False
+                    self._save_changes(changes)
+                    return self.apply_changes(changes) > 0
+
+            response = _get(
+                self.api_url, "/snapshot/", self.session, self.timeout,
+                headers={"If-None-Match": self.etag} if self.etag else {}
+            )
+        except requests.RequestException as e:
+            warnings.warn(
+                f"Using the cached library, the API is unreachable: {e}"
+            )
+            return False
+        if response.status_code == 304:
+            return False
+        library = OfflineLibrary(
+            response.content, etag=response.headers.get("ETag")
+        )
+        library._save(self.cache_dir, self.api_url, response.content)
+        for name in ("api_url", "session", "cache_dir", "timeout"):
+            setattr(library, name, getattr(self, name))
+        self.__dict__.update(library.__dict__)
+        return True
+
+    def _records(self, rows: np.ndarray, fields: list[str]) -> list[dict]:
+        columns = [
+            self.ions[field][rows].tolist()
+            if isinstance(self.ions[field], np.ndarray)
+            else [self.ions[field][i] for i in rows.tolist()]
+            for field in fields
+        ]
+        return [dict(zip(fields, values)) for values in zip(*columns)]
+
+    def get_measured_compounds(
+        self,
+        retention_time: float | None = None,
+        type: str | None = None,
+        ion_mode: str | None = None
+        ) -> list[dict]:
+        """
+        Answers the queries of `DataHolder.get_measured_compounds_from_db`:
+        the measured compounds with exactly this retention time, ion mode and
+        compound type (None matches compounds without type), or all measured
+        compounds if neither retention time nor ion mode is given.
+
+        Returns:
+          list[dict]: The measured compounds as returned by the API.
+        """
+        if (retention_time is None) != (ion_mode is None):
+            raise ValueError("Please provide retention_time and ion_mode.")
+        selected = np.ones(len(self.ions["measured_compound_id"]), dtype=bool)
+        if ion_mode is not None:
+            selected &= self.ions["retention_time"] == retention_time
+            selected &= np.array(self.ions["ion_mode"], dtype=object) \
+                == ion_mode
+            selected &= self._ion_type == type
+        return self._records(np.flatnonzero(selected), [
+            "compound_id", "compound_name", "retention_time",
+            "retention_time_comment", "adduct_name"
+        ])
+
+    def get_measured_ions(self, ion_mode: str | None = None) -> list[dict]:
+        """
+        Answers the queries of `DataHolder.get_measured_ions_from_db`.
+        """
+        selected = np.arange(len(self.ions["measured_compound_id"]))
+        if ion_mode:
+            selected = np.flatnonzero(
+                np.array(self.ions["ion_mode"], dtype=object) == ion_mode
+            )
+        return self._records(selected, [
+            "measured_compound_id", "compound_id", "compound_name",
+            "adduct_name", "ion_mode", "mz", "retention_time"
+        ])
+
+    def match_features(
+        self,
+        ion_mode: str,
+        mz: list[float],
+        retention_time: list[float],
+        ppm: float = 5.0,
+        mz_tolerance: float | None = None,
+        rt_tolerance: float | None = 0.1
+        ) -> list[dict]:
+        """
+        Matches a feature table against the measured compounds like
+        `POST /screening/measured_compounds/`.
+
+        Returns:
+          list[dict]: The matches, ordered by feature and measured compound.
+        """
+        if len(mz) != len(retention_time):
+            raise ValueError(
+                "mz and retention_time must have the same length."
+            )
+        if self._index is None:
+            self._index = MeasuredIonIndex(self.ions)
+        mz = np.asarray(mz, dtype=np.float64)
+        retention_time = np.asarray(retention_time, dtype=np.float64)
+        features, rows = self._index.match(
+            ion_mode, mz, retention_time, ppm=ppm,
+            mz_tolerance=mz_tolerance, rt_tolerance=rt_tolerance
+        )
+        order = np.lexsort(
+            (self.ions["measured_compound_id"][rows], features)
+        )
+        features, rows = features[order], rows[order]
+        ion_mz = self.ions["mz"][rows]
+        ion_rt = self.ions["retention_time"][rows]
+        records = self._records(rows, [
+            "measured_compound_id", "compound_id", "compound_name",
+            "adduct_name", "mz", "retention_time"
+        ])
+        for record, feature, ppm_error, rt_error in zip(
+            records, features.tolist(),
+            ((mz[features] - ion_mz) / ion_mz * 1e6).tolist(),
+            (retention_time[features] - ion_rt).tolist()
+        ):
+            record.update(
+                feature_index=feature, ppm_error=ppm_error, rt_error=rt_error
+            )
+        return records
+
+    def match_mz(
+        self,
+        mz: list[float],
+        ion_mode: str | None = None,
+        ppm: float = 5.0,
+        type: str | None = None
+        ) -> list[dict]:
+        """
+        Matches m/z values against the theoretical ions of all compounds
+        with all adducts, without retention times.
+
+        Args:
+          mz (list[float]): The m/z values.
+          ion_mode (str | None, optional): Only use adducts of this ion mode.
+          ppm (float, optional): The tolerance in ppm. Defaults to 5.0.
+          type (str | None, optional): Only use compounds of this type.
+
+        Returns:
+          list[dict]: "index" (position in `mz`), "compound_id",
+          "compound_name", "adduct_name", "ion_mode", "mz" and "ppm_error"
+          of every match, ordered by m/z value and ion m/z.
+        """
+        key = (ion_mode, type)
+        if self._library_ions is None or self._library_ions[0] != key:
+            compound_rows = np.arange(len(self.compounds["compound_id"]))
+            if type:
+                compound_rows = np.flatnonzero(
+                    np.array(self.compounds["type"], dtype=object) == type
+                )
+            adduct_rows = np.arange(len(self.adducts["adduct_id"]))
+            if ion_mode:
+                adduct_rows = np.flatnonzero(
+                    np.array(self.adducts["ion_mode"], dtype=object)
+                    == ion_mode
+                )
+            c = np.repeat(compound_rows, len(adduct_rows))
+            a = np.tile(adduct_rows, len(compound_rows))
+            ion_mz = self.compounds["mass"][c] \
+                + self.adducts["mass_adjustment"][a]
+            order = np.argsort(ion_mz, kind="stable")
+            self._library_ions = (key, c[order], a[order], ion_mz[order])
+        _, c, a, ion_mz = self._library_ions
+
+        mz = np.asarray(mz, dtype=np.float64)
+        starts = np.searchsorted(ion_mz, mz * (1 - ppm * 1e-6), side="left")
+        ends = np.searchsorted(ion_mz, mz * (1 + ppm * 1e-6), side="right")
+        counts = np.maximum(ends - starts, 0)
+        index = np.repeat(np.arange(len(mz)), counts)
+        positions = np.arange(counts.sum()) \
+            - np.repeat(np.cumsum(counts) - counts, counts) \
+            + np.repeat(starts, counts)
+        c, a, matched = c[positions], a[positions], ion_mz[positions]
+        return [
+            {
+                "index": i,
+                "compound_id": compound_id,
+                "compound_name": self.compounds["compound_name"][ci],
+                "adduct_name": self.adducts["adduct_name"][ai],
+                "ion_mode": self.adducts["ion_mode"][ai],
+                "mz": value,
+                "ppm_error": ppm_error,
+            }
+            for i, ci, ai, compound_id, value, ppm_error in zip(
+                index.tolist(), c.tolist(), a.tolist(),
+                self.compounds["compound_id"][c].tolist(), matched.tolist(),
+                ((mz[index] - matched) / matched * 1e6).tolist()
+            )
+        ]
@@ -1,4 +1,6 @@
 import json
+import time
+
 import pandas as pd
 
 def is_valid_json(json_str: str) -> bool:
@@ -39,4 +41,48 @@ def check_unique_cols(df, unique_cols):
       raise ValueError(
         f"Duplicates in columns {non_unique_cols} are not allowed."
       )
-    return True
\ No newline at end of file
+    return True
+
+# Responses of an overloaded server that are worth retrying
+RETRY_STATUS_CODES = (429, 503)
+MAX_RETRIES = 5
+MAX_RETRY_DELAY_S = 30.0
+
+
+def send_with_retry(send, max_retries: int = MAX_RETRIES):
+    """
+    Sends a request and, while the server answers 429 or 503, waits as long 
+    as its Retry-After header asks (or with exponential backoff without the
+    header) and sends it again.
+
+    Args:
+      send (callable): Sends the request and returns the response.
+      max_retries (int, optional): How often the request is sent again. 
+      Defaults to MAX_RETRIES.
+
+    Returns:
+      requests.Response: The first response that is not 429 or 503, or the
+      last response.
+    """
+    for attempt in range(max_retries + 1):
+        response = send()
+        if response.status_code not in RETRY_STATUS_CODES \
+                or attempt == max_retries:
+            return response
+        time.sleep(retry_delay(response, attempt))
+
+
+def retry_delay(response, attempt: int) -> float:
+    """
+    Returns the seconds to wait before retrying, from the Retry-After header
+    of the response if it has one.
+    """
+    delay = 2 ** attempt
+    retry_after = response.headers.get("Retry-After") \
+        if response is not None else None
+    if retry_after is not None:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            pass
+    return min(delay, MAX_RETRY_DELAY_S)
@@ -0,0 +1,209 @@
+"""
+Extracted ion chromatograms (XICs) of all targets in one pass over a run.
+
+For every scan, the m/z windows of all targets are located in the sorted
+peaks with two binary searches, and the intensity inside every window is
+read from the cumulative intensity sum (or the maximum with `reduceat`).
+Non-zero points are appended to growable arrays and finally grouped by
+target into a compact `Chromatograms` structure.
+
+Example:
+
+    from ms.io import DataHolder
+    from ms.mzml import TargetList
+    from ms.xic import extract_xics
+
+    ions = DataHolder(api_url).get_measured_ions_from_db("positive")
+    xics = extract_xics("run.mzML", TargetList.from_records(ions))
+    rt, intensity = xics.chromatogram(0)
+"""
+import numpy as np
+
+from .mzml import TargetList, iter_scans
+
+AGGREGATES = ("sum", "max")
+
+
+class _GrowableArray:
+    """
+    A 1-D array with amortized constant time appends.
+    """
+    def __init__(self, dtype, capacity: int = 1024):
+        self._data = np.empty(capacity, dtype=dtype)
+        self._size = 0
+
+    def extend(self, values: np.ndarray):
+        end = self._size + len(values)
+        if end > len(self._data):
+            data = np.empty(max(end, 2 * len(self._data)),
+                            dtype=self._data.dtype)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+        self._data[self._size:end] = values
+        self._size = end
+
+    def append(self, value):
+        self.extend(np.array([value], dtype=self._data.dtype))
+
+    def array(self) -> np.ndarray:
+        return self._data[:self._size].copy()
+
+
+class Chromatograms:
+    """
+    The XICs of many targets, stored sparsely: only scans with intensity
+    inside a target's window are kept, grouped by target.
+
+    Attributes:
+        targets (TargetList): The targets, in the order of the chromatograms.
+        retention_time (np.ndarray): The retention times of all scans.
+        offsets (np.ndarray): The points of target i are
+        offsets[i]:offsets[i+1].
+        scan_index (np.ndarray): The scan (position in `retention_time`) of
+        every point, int32.
+        intensity (np.ndarray): The intensity of every point, float32.
+    """
+    def __init__(self, targets, retention_time, offsets, scan_index,
+                 intensity):
+        self.targets = targets
+        self.retention_time = retention_time
+        self.offsets = offsets
+        self.scan_index = scan_index
+        self.intensity = intensity
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def chromatogram(
+        self,
+        i: int,
+        dense: bool = False
+        ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the retention times and intensities of target i, either only
+        the non-zero points or all scans with zeros filled in.
+        """
+        s = slice(self.offsets[i], self.offsets[i + 1])
+        if not dense:
+            return self.retention_time[self.scan_index[s]], self.intensity[s]
+        intensity = np.zeros(len(self.retention_time), dtype=np.float32)
+        intensity[self.scan_index[s]] = self.intensity[s]
+        return self.retention_time, intensity
+
+    def to_dense(self) -> np.ndarray:
+        """
+        Returns all chromatograms as array of shape (targets, scans).
+        """
+        dense = np.zeros((len(self), len(self.retention_time)),
+                         dtype=np.float32)
+        targets = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+        dense[targets, self.scan_index] = self.intensity
+        return dense
+
+    def save(self, path: str):
+        """
+        Saves the arrays of the chromatograms and the target m/z and
+        retention times as compressed npz file.
+        """
+        np.savez_compressed(
+            path,
+            retention_time=self.retention_time,
+            offsets=self.offsets,
+            scan_index=self.scan_index,
+            intensity=self.intensity,
+            target_mz=self.targets.mz,
+            target_retention_time=self.targets.retention_time
+        )
+
+
+def extract_xics(
+    path: str,
+    targets: TargetList,
+    ppm: float = 5.0,
+    rt_window: float | None = None,
+    aggregate: str = "sum",
+    ms_level: int = 1
+    ) -> Chromatograms:
+    """
+    Extracts the chromatograms of all targets in a single pass over the scans
+    of an mzML file.
+
+    Args:
+        path (str): The path of the mzML file.
+        targets (TargetList): The targets.
+        ppm (float, optional): The half width of the m/z windows relative to
+        the target m/z. Defaults to 5.0.
+        rt_window (float | None, optional): Only extract scans within this
+        many minutes of the retention time of a target (targets without
+        retention time are extracted over the whole run). None for the whole
+        run. Defaults to None.
+        aggregate (str, optional): "sum" or "max" of the intensities inside
+        a window. Defaults to "sum".
+        ms_level (int, optional): The MS level of the scans. Defaults to 1.
+
+    Returns:
+        Chromatograms: The chromatograms in the order of `targets`.
+
+    Raises:
+        ValueError: If `aggregate` is unknown.
+    """
+    if aggregate not in AGGREGATES:
+        raise ValueError(
+            f"Unknown aggregate '{aggregate}', use one of {AGGREGATES}."
+        )
+    low = targets.mz * (1 - ppm * 1e-6)
+    high = targets.mz * (1 + ppm * 1e-6)
+    known_rt = ~np.isnan(targets.retention_time)
+
+    retention_times = _GrowableArray(np.float64)
+    point_target = _GrowableArray(np.int32)
+    point_scan = _GrowableArray(np.int32)
+    point_intensity = _GrowableArray(np.float32)
+
+    for n_scan, scan in enumerate(iter_scans(path, ms_level=ms_level)):
+        retention_times.append(scan.retention_time)
+        mz, intensity = scan.mz, scan.intensity
+        if len(mz) > 1 and (np.diff(mz) < 0).any():
+            order = np.argsort(mz, kind="stable")
+            mz, intensity = mz[order], intensity[order]
+
+        active = np.ones(len(targets), dtype=bool)
+        if rt_window is not None:
+            active[known_rt] = np.abs(
+                targets.retention_time[known_rt] - scan.retention_time
+            ) <= rt_window
+        if scan.polarity is not None:
+            active &= (targets.ion_mode == scan.polarity) \
+                | (targets.ion_mode == None)  # noqa
+        selected = np.flatnonzero(active)
+        if len(selected) == 0 or len(mz) == 0:
+            continue
+
+        starts = np.searchsorted(mz, low[selected], side="left")
+        ends = np.searchsorted(mz, high[selected], side="right")
+        if aggregate == "sum":
+            cumulative = np.concatenate([[0.0], np.cumsum(intensity)])
+            values = cumulative[ends] - cumulative[starts]
+        else:
+            padded = np.append(intensity, 0.0)
+            values = np.maximum.reduceat(
+                padded, np.column_stack([starts, ends]).ravel()
+            )[::2]
+        nonzero = (ends > starts) & (values > 0)
+
+        point_target.extend(selected[nonzero])
+        point_scan.extend(np.full(nonzero.sum(), n_scan))
+        point_intensity.extend(values[nonzero])
+
+    point_target = point_target.array()
+    order = np.argsort(point_target, kind="stable")
+    offsets = np.concatenate([
+        [0], np.cumsum(np.bincount(point_target, minlength=len(targets)))
+    ])
+    return Chromatograms(
+        targets,
+        retention_times.array(),
+        offsets,
+        point_scan.array()[order],
+        point_intensity.array()[order]
+    )